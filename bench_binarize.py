@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""Binarization algorithms (binarize.ALGORITHMS) over a book's pages: time
+per page, and downstream line yield of dewarp.get_AH_lines (lines found,
+letters on them, median RMS residual of the baselines about their fit).
+
+python bench_binarize.py DIR|IMAGE ... [-a NAME ...] [--scale S]
+python bench_binarize.py DIR --select [--min-yield F] [--max-residual PX]
+
+--select picks the cheapest algorithm (binarization plus line detection
+time) that finds at least min-yield times the lines of the reference (the
+pipeline's dewarp.BINARIZE), with a median residual of at most max-residual
+(default: 1.25 x the reference's). More lines alone is not better: noisy
+binarizations get lines out of background texture. Pass the result to
+demo.py --binarize.
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from rebook import binarize, dewarp, lib
+from rebook.letters import fit_polys
+
+EXTENSIONS = ('.jpg', '.jpeg', '.png', '.tif', '.tiff')
+
+
+def page_paths(paths):
+    result = []
+    for path in paths:
+        if os.path.isdir(path):
+            result.extend(sorted(p for p in glob.glob(os.path.join(path, '*'))
+                                 if p.lower().endswith(EXTENSIONS)))
+        else:
+            result.append(path)
+    return result
+
+
+# RMS distance of each line's base points from its robust baseline fit
+def residuals(lines):
+    fit_polys(lines)
+    rms = []
+    for line in lines:
+        if line.model is None: continue
+        base = line.base_points()
+        rms.append(np.sqrt(np.mean((base[:, 1] - line.model(base[:, 0])) ** 2)))
+    return rms
+
+
+def measure(name, gray):
+    algorithm = binarize.ALGORITHMS[name]
+    start = time.perf_counter()
+    with np.errstate(all='ignore'):
+        bw = algorithm(gray)
+    t_binarize = time.perf_counter() - start
+
+    start = time.perf_counter()
+    _, lines, _, _ = dewarp.get_AH_lines(bw)
+    t_lines = time.perf_counter() - start
+
+    return {
+        't_binarize': t_binarize,
+        't_lines': t_lines,
+        'lines': len(lines),
+        'letters': sum(len(line) for line in lines),
+        'residuals': residuals(lines),
+    }
+
+
+def run(paths, names, scale=1.0):
+    results = dict((name, []) for name in names)
+    for path in paths:
+        im = lib.imread(path)
+        if scale != 1.0:
+            im = cv2.resize(im, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        gray = binarize.grayscale(im)
+        print('{} {}x{}'.format(path, gray.shape[1], gray.shape[0]), file=sys.stderr)
+        for name in names:
+            try:
+                row = measure(name, gray)
+            except Exception as e:
+                print('  {}: {}: {}'.format(name, type(e).__name__, e), file=sys.stderr)
+                row = {'t_binarize': np.nan, 't_lines': np.nan, 'lines': 0, 'letters': 0,
+                       'residuals': [], 'error': True}
+            results[name].append(row)
+    return results
+
+
+def summarize(results):
+    summary = {}
+    for name, rows in results.items():
+        summary[name] = {
+            'time': sum(r['t_binarize'] + r['t_lines'] for r in rows) / len(rows),
+            't_binarize': sum(r['t_binarize'] for r in rows) / len(rows),
+            'lines': sum(r['lines'] for r in rows),
+            'letters': sum(r['letters'] for r in rows),
+            'residual': np.median(sum((r['residuals'] for r in rows), [])) \
+                if any(r['residuals'] for r in rows) else np.inf,
+            'errors': sum(1 for r in rows if r.get('error')),
+        }
+    return summary
+
+
+def select(summary, reference, min_yield=0.9, max_residual=None):
+    if max_residual is None:
+        max_residual = 1.25 * summary[reference]['residual']
+    candidates = [name for name, s in summary.items()
+                  if not s['errors'] and s['lines'] >= min_yield * summary[reference]['lines']
+                  and s['residual'] <= max_residual]
+    return min(candidates, key=lambda name: summary[name]['time']) if candidates else reference
+
+
+def report(summary, chosen=None):
+    print('{:<16} {:>10} {:>10} {:>7} {:>8} {:>9}'.format(
+        'algorithm', 'binarize', 'total', 'lines', 'letters', 'residual'))
+    for name, s in sorted(summary.items(), key=lambda item: item[1]['time']):
+        print('{:<16} {:8.0f}ms {:8.0f}ms {:7d} {:8d} {:8.2f}px{}{}'.format(
+            name, s['t_binarize'] * 1000, s['time'] * 1000, s['lines'], s['letters'],
+            s['residual'], '  errors {}'.format(s['errors']) if s['errors'] else '',
+            '  <-' if name == chosen else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('paths', nargs='+', help='page images or directories of them')
+    parser.add_argument('-a', '--algorithm', action='append', choices=list(binarize.ALGORITHMS),
+                        help='only these algorithms (repeatable)')
+    parser.add_argument('--scale', type=float, default=1.0, help='downscale pages first')
+    parser.add_argument('--select', action='store_true', help='pick an algorithm for this book')
+    parser.add_argument('--min-yield', type=float, default=0.9)
+    parser.add_argument('--max-residual', type=float, default=None)
+    args = parser.parse_args()
+
+    paths = page_paths(args.paths)
+    if not paths:
+        parser.error('no pages found')
+
+    names = args.algorithm or list(binarize.ALGORITHMS)
+    if args.select and dewarp.BINARIZE not in names:
+        names.append(dewarp.BINARIZE)
+    summary = summarize(run(paths, names, args.scale))
+    chosen = select(summary, dewarp.BINARIZE, args.min_yield, args.max_residual) \
+        if args.select else None
+    report(summary, chosen)
+    if chosen is not None:
+        print('--binarize {}'.format(chosen))
+
+
+if __name__ == '__main__':
+    main()
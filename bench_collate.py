@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+"""Line collation: collate_lines_scan (every letter vs every line) against the
+y-indexed collate_lines, on synthetic pages of increasing density.
+
+python bench_collate.py [image ...]   (also checks the lines on real pages)
+"""
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from rebook import algorithm, binarize
+from rebook.letters import LetterTable
+
+AH = 20
+
+# n_lines lines of text with slight skew and curl, two columns, some specks
+def synthetic_page(n_lines, letters_per_line, seed=0):
+    rng = np.random.RandomState(seed)
+    page_h = int(n_lines * AH * 1.8) + 4 * AH
+    col_w = letters_per_line * AH
+    boxes = []
+    for col in range(2):
+        x_start = 2 * AH + col * (col_w + 4 * AH)
+        for i in range(n_lines):
+            base = 2 * AH + i * page_h / (n_lines + 1)
+            x = x_start
+            for _ in range(letters_per_line):
+                w = rng.randint(AH // 3, AH)
+                h = AH + rng.choice([0, 0, 0, AH // 2])  # some ascenders
+                y = base + 0.02 * x + 10 * np.sin(x / col_w * np.pi) - h
+                boxes.append((x, int(y), w, h))
+                x += w + rng.randint(1, AH // 2) + (AH if rng.rand() < 0.15 else 0)
+    n_specks = len(boxes) // 20
+    specks = np.column_stack([
+        rng.randint(0, 2 * (col_w + 4 * AH), n_specks), rng.randint(0, page_h, n_specks),
+        rng.randint(1, 4, n_specks), rng.randint(1, 4, n_specks),
+    ])
+    boxes = np.concatenate([np.array(boxes), specks])
+    boxes = boxes[rng.permutation(len(boxes))]
+
+    stats = np.column_stack([boxes, boxes[:, 2] * boxes[:, 3]]).astype(np.int32)
+    centroids = boxes[:, :2] + boxes[:, 2:4] / 2.0
+    return LetterTable(None, stats, centroids, np.arange(1, len(stats) + 1))
+
+
+def key(lines):
+    return [[letter.label for letter in line] for line in lines]
+
+
+def measure(func, letters, AH, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(AH, letters)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def compare(name, letters, AH, repeat=3):
+    t_scan, scan = measure(algorithm.collate_lines_scan, letters, AH, repeat)
+    t_index, index = measure(algorithm.collate_lines, letters, AH, repeat)
+    assert key(scan) == key(index), name
+    print('{:<28} {:6d} letters {:5d} lines  scan {:8.1f} ms  index {:7.1f} ms  {:5.1f}x'.format(
+        name, len(letters), len(index), t_scan * 1000, t_index * 1000, t_scan / t_index))
+
+
+def main(paths):
+    for n_lines, per_line in [(10, 40), (20, 60), (40, 80), (80, 100)]:
+        letters = synthetic_page(n_lines, per_line)
+        compare('synthetic {}x{}'.format(n_lines, per_line), letters, AH,
+                repeat=1 if len(letters) > 5000 else 3)
+
+    for path in paths:
+        im = cv2.imread(path)
+        bw = binarize.binarize(im, algorithm=lambda im: binarize.sauvola_noisy(im, k=0.1))
+        letters = algorithm.all_letters(bw)
+        page_AH = algorithm.dominant_char_height(bw, letters=letters)
+        compare(path, algorithm.filter_size(page_AH, bw, letters=letters), page_AH, repeat=1)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""Import cost of each entry point, from python -X importtime in a fresh
+interpreter: total import time (best of N runs) and which heavy optional
+packages got loaded.
+
+python bench_imports.py [-n N] [--top K]
+
+--top lists the K slowest top-level imports per entry point. Entry points
+whose own dependencies are missing are reported as such, with the time
+up to the failing import.
+"""
+import argparse
+import subprocess
+import sys
+
+HEAVY = ('scipy', 'skimage', 'sklearn', 'rawpy', 'onnxruntime', 'rapidocr_onnxruntime',
+         'ultralytics', 'torch', 'rtmlib', 'matplotlib', 'fpdf')
+
+ENTRY_POINTS = [
+    ('demo.py --help', ['demo.py', '--help']),
+    ('demo worker', ['-c', 'import demo; from rebook import lib; from rebook.dewarp import go_dewarp; '
+                           'from rebook.segment import load_model; from rebook.spliter import segment_book; '
+                           'from rapidocr_onnxruntime import RapidOCR']),
+    ('demo worker --scantailor-split', ['-c', 'import demo; from rebook import lib; '
+                                              'from rebook.dewarp import go_dewarp; '
+                                              'from rapidocr_onnxruntime import RapidOCR']),
+    ('scantailor_bridge', ['-c', 'import scantailor_bridge']),
+    ('rebook.lib', ['-c', 'import rebook.lib']),
+    ('rebook.binarize', ['-c', 'import rebook.binarize']),
+    ('rebook.dewarp', ['-c', 'import rebook.dewarp']),
+    ('rebook.spliter', ['-c', 'import rebook.spliter']),
+    ('rebook.segment', ['-c', 'import rebook.segment']),
+]
+
+
+# [(name, depth, cumulative us)] from -X importtime output
+def parse(stderr):
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        depth = (len(name) - len(name.lstrip())) // 2
+        rows.append((name.strip(), depth, int(cumulative)))
+    return rows
+
+
+def measure(argv, runs):
+    best = None
+    for _ in range(runs):
+        proc = subprocess.run([sys.executable, '-X', 'importtime'] + argv,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        rows = parse(proc.stderr)
+        total = sum(us for _, depth, us in rows if depth == 0)
+        failed = proc.returncode != 0 and 'Error' in proc.stderr
+        error = proc.stderr.strip().splitlines()[-1] if failed else None
+        if best is None or total < best[0]:
+            best = (total, rows, error)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', type=int, default=3, help='runs per entry point')
+    parser.add_argument('--top', type=int, default=0)
+    args = parser.parse_args()
+
+    for name, argv in ENTRY_POINTS:
+        total, rows, error = measure(argv, args.n)
+        loaded = {module.split('.')[0] for module, _, _ in rows} & set(HEAVY)
+        loaded = sorted(m for m in loaded if not error or "'{}'".format(m) not in error)
+        print('{:<32} {:7.0f} ms  heavy: {}{}'.format(
+            name, total / 1000, ', '.join(loaded) or '-',
+            '  [{}]'.format(error) if error else ''))
+        for module, _, us in sorted((r for r in rows if r[1] == 0), key=lambda r: -r[2])[:args.top]:
+            print('    {:<28} {:7.0f} ms'.format(module, us / 1000))
+
+
+if __name__ == '__main__':
+    main()
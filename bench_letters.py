@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""Letter stage: per-component Letter objects vs the columnar LetterTable.
+
+python bench_letters.py [image ...]   (default: book/*.jpg)
+"""
+import glob
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from rebook import algorithm, binarize
+from rebook.letters import Letter, LetterTable
+
+
+def connected_components(bw):
+    return cv2.connectedComponentsWithStats(bw ^ 255, connectivity=4)
+
+
+def letters_stage_objects(cc):
+    # what all_letters / dominant_char_height / filter_size did before
+    max_label, labels, stats, centroids = cc
+    letters = [Letter(label, labels, stats[label], centroids[label])
+               for label in range(1, max_label)]
+    heights = [letter.h for letter in letters if letter.w > 10]
+    hist, _ = np.histogram(heights, 256, [0, 256])
+    AH = np.argmax(hist[8:]) + 8
+    valid = [l for l in letters if algorithm.valid_letter(AH, l)]
+    base_points = np.array([l.base_point() for l in valid])
+    return letters, AH, len(valid), base_points
+
+
+def letters_stage_table(cc):
+    max_label, labels, stats, centroids = cc
+    letters = LetterTable(labels, stats[1:], centroids[1:], np.arange(1, max_label))
+    AH = algorithm.dominant_char_height(None, letters=letters)
+    valid = algorithm.filter_size(AH, None, letters=letters)
+    base_points = valid.base_points()
+    return letters, AH, len(valid), base_points
+
+
+def measure(func, arg, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(arg)
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    kept = func(arg)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, current, kept
+
+
+def main(paths):
+    for path in paths:
+        im = cv2.imread(path)
+        bw = binarize.binarize(im, algorithm=lambda im: binarize.sauvola_noisy(im, k=0.1))
+        print('{} {}x{}'.format(path, bw.shape[1], bw.shape[0]))
+
+        t_cc, _, cc = measure(connected_components, bw)
+        t_obj, m_obj, r_obj = measure(letters_stage_objects, cc)
+        t_tab, m_tab, r_tab = measure(letters_stage_table, cc)
+        assert r_obj[1:3] == r_tab[1:3]
+        assert np.array_equal(r_obj[3], r_tab[3])
+        print('  connectedComponentsWithStats: {:7.1f} ms (shared)'.format(t_cc * 1000))
+        print('  objects: {:7.1f} ms  {:6.2f} MB retained'.format(t_obj * 1000, m_obj / 1e6))
+        print('  table:   {:7.1f} ms  {:6.2f} MB retained'.format(t_tab * 1000, m_tab / 1e6))
+        print('  AH={} letters={}  time {:.1f}x  memory {:.1f}x'.format(
+            r_tab[1], r_tab[2], t_obj / t_tab, m_obj / max(m_tab, 1)))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or sorted(glob.glob('book/*.jpg')))
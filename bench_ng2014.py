@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""ntirogiannis2014 stage timings, and ng2014_fallback with the early
+contrast check against the full run followed by the mean > 180 check.
+
+python bench_ng2014.py [image ...]   (default: book/*.jpg)
+
+Each image is run as a whole and as its left and right halves (single
+pages), at full and half resolution.
+"""
+import glob
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from rebook import binarize
+
+
+def variants(gray):
+    h, w = gray.shape
+    for name, im in [('spread', gray), ('left', gray[:, :w // 2]), ('right', gray[:, w // 2:])]:
+        yield name, im
+        yield name + ' 1/2', cv2.resize(im, None, fx=0.5, fy=0.5, interpolation=cv2.INTER_AREA)
+
+
+def main(paths):
+    for path in paths:
+        gray = binarize.grayscale(cv2.imread(path))
+        for name, im in variants(gray):
+            times = {}
+            start = time.perf_counter()
+            full = binarize.ntirogiannis2014(im, times)
+            reference = full if full.mean() > 180 else binarize.sauvola(im)
+            t_full = time.perf_counter() - start
+
+            start = time.perf_counter()
+            result = binarize.ng2014_fallback(im)
+            t_fallback = time.perf_counter() - start
+
+            print('{} {:<10} ng2014+check {:6.0f} ms  fallback {:6.0f} ms  {}  identical {}'.format(
+                path, name, t_full * 1000, t_fallback * 1000,
+                'ng2014 ' if full.mean() > 180 else 'sauvola', np.array_equal(reference, result)))
+            print('    ' + '  '.join('{} {:.0f}'.format(stage[len('ng2014 '):], t * 1000)
+                                     for stage, t in times.items()))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or sorted(glob.glob('book/*.jpg')))
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""Sauvola/Niblack: the previous whole-image implementation (padded copy,
+float32 integrals, full-size temporaries) against the strip-streamed one,
+for time and peak memory (tracemalloc), at full camera resolution.
+
+python bench_sauvola.py [image ...]   (default: book/*.jpg)
+
+Streamed output must be bit-identical for every strip height and thread
+count, including a single strip. Agreement with the float32 version is
+reported separately: its integrals round at scan sizes.
+"""
+import glob
+import os
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from rebook import binarize, lib
+
+
+def whole_image_sauvola(im, window_size=61, k=0.2):
+    W = window_size
+    s = W // 2
+    padded = np.pad(im, (s, s), 'reflect')
+    sum1, sum2 = cv2.integral2(padded, sdepth=cv2.CV_32F)
+    S1 = sum1[W:, W:] - sum1[W:, :-W] - sum1[:-W, W:] + sum1[:-W, :-W]
+    S2 = sum2[W:, W:] - sum2[W:, :-W] - sum2[:-W, W:] + sum2[:-W, :-W]
+    means = S1 / (W * W)
+    stds = np.sqrt((S2 / (W * W) - means * means).clip(0, None))
+    thresh = means * (1 + k * ((stds / 127) - 1))
+    return lib.bool_to_u8(im > thresh)
+
+
+def measure(func, gray, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(gray)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    func(gray)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+
+def streamed(rows, threads):
+    def run(gray):
+        lib.STRIP_ROWS, lib.THREADS = rows, threads
+        try:
+            return binarize.sauvola(gray, k=0.1)
+        finally:
+            lib.STRIP_ROWS, lib.THREADS = default_rows, None
+    return run
+
+
+default_rows = lib.STRIP_ROWS
+
+
+def main(paths):
+    cpus = os.cpu_count() or 1
+    for path in paths:
+        gray = binarize.grayscale(cv2.imread(path))
+        h, w = gray.shape
+        print('{} {}x{} ({} CPU)'.format(path, w, h, cpus))
+
+        t_old, m_old, old = measure(lambda g: whole_image_sauvola(g, k=0.1), gray)
+        print('  {:<22} {:7.1f} ms  peak {:6.1f} MB'.format('whole image float32', t_old * 1000, m_old / 1e6))
+
+        reference = streamed(h, 1)(gray)
+        for rows in sorted({16, default_rows, 256, 1024, h}):
+            for threads in sorted({1, 2, cpus}):
+                t, m, out = measure(streamed(rows, threads), gray)
+                print('  {:<22} {:7.1f} ms  peak {:6.1f} MB  identical {}'.format(
+                    'strips {} x{}'.format(rows, threads), t * 1000, m / 1e6,
+                    np.array_equal(out, reference)))
+
+        print('  agreement with float32 version {:.5%}'.format((old == reference).mean()))
+        lib.STRIP_ROWS = h
+        single = binarize.niblack(gray, k=-0.2)
+        lib.STRIP_ROWS = default_rows
+        print('  niblack identical across strips {}'.format(
+            np.array_equal(single, binarize.niblack(gray, k=-0.2))))
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or sorted(glob.glob('book/*.jpg')))
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""Book segmentation: ultralytics YOLO (.pt) against its ONNX export on
+onnxruntime (rebook.segment), for load time, time per frame and agreement
+of the book contour (IoU of the filled contours) that book_spliter gets.
+
+python bench_segment.py MODEL.pt MODEL.onnx [image ...]   (default: book/*.jpg)
+
+Export with: yolo export model=MODEL.pt format=onnx (imgsz 640). Contours
+should agree to IoU > 0.99; the ultralytics predictor pads to a multiple
+of 32 where a static export is padded square, which moves mask edges by
+about a pixel at 640.
+"""
+import glob
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from rebook import segment, spliter
+
+
+def load(path):
+    start = time.perf_counter()
+    model = segment.load_model(path)
+    return model, time.perf_counter() - start
+
+
+def iou(a, b, shape):
+    if a is None or b is None:
+        return float(a is None and b is None)
+    masks = [np.zeros(shape[:2], np.uint8) for _ in range(2)]
+    for mask, contour in zip(masks, (a, b)):
+        cv2.drawContours(mask, [contour], -1, 1, cv2.FILLED)
+    return (masks[0] & masks[1]).sum() / max((masks[0] | masks[1]).sum(), 1)
+
+
+def main(pt, onnx, paths):
+    models = [load(pt), load(onnx)]
+    for path, (_, t) in zip((pt, onnx), models):
+        print('{:<40} load {:6.0f} ms'.format(path, t * 1000))
+
+    for path in paths:
+        frame = cv2.imread(path)
+        contours, times = [], []
+        for model, _ in models:
+            spliter.segment_book(model, frame)  # warm-up
+            start = time.perf_counter()
+            contours.append(spliter.segment_book(model, frame))
+            times.append(time.perf_counter() - start)
+        print('{}  ultralytics {:5.0f} ms  onnx {:5.0f} ms  IoU {:.4f}'.format(
+            path, times[0] * 1000, times[1] * 1000, iou(contours[0], contours[1], frame.shape)))
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        sys.exit(__doc__)
+    main(sys.argv[1], sys.argv[2], sys.argv[3:] or sorted(glob.glob('book/*.jpg')))
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""Moving a 24 MP image to a worker process and a result of the same size
+back: pickled through multiprocessing.Pool against rebook.shm handles.
+
+python bench_shm.py [-n IMAGES] [-j WORKERS] [--shape H W C]
+
+Both go through rebook.engine.run with the same read-ahead window, pool
+start-up included. The worker does a trivial operation (invert) so the
+time is transport:
+pickling copies the image through a pipe both ways, with shared memory
+only handles cross and the worker reads and writes the slots in place.
+Also reports plain pickle.dumps/loads of one image for reference.
+"""
+import argparse
+import pickle
+import time
+
+import numpy as np
+
+from rebook import engine, shm
+
+
+def invert_pickled(im):
+    return 255 - im
+
+
+def invert_shared(handle):
+    with shm.pool.lease(handle) as im:
+        out = shm.pool.alloc(im.shape, im.dtype)
+        np.subtract(255, im, out=shm.pool.get(out))
+    return out
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('-n', type=int, default=20, help='images per run')
+    parser.add_argument('-j', type=int, default=2, help='worker processes')
+    parser.add_argument('--shape', type=int, nargs=3, default=[4000, 6000, 3])
+    args = parser.parse_args()
+
+    im = np.random.randint(0, 256, args.shape, np.uint8)
+    mb = im.nbytes / 1e6
+    print('image {} ({:.0f} MB), {} images, {} workers'.format(im.shape, mb, args.n, args.j))
+
+    t_dump = timed(lambda: pickle.dumps(im, protocol=pickle.HIGHEST_PROTOCOL))
+    data = pickle.dumps(im, protocol=pickle.HIGHEST_PROTOCOL)
+    t_load = timed(lambda: pickle.loads(data))
+    print('pickle.dumps {:6.1f} ms   loads {:6.1f} ms'.format(t_dump * 1000, t_load * 1000))
+
+    def run():
+        for result in engine.run(invert_pickled, [im] * args.n, workers=args.j, window=args.j):
+            out = result.value
+        assert out[0, 0, 0] == 255 - im[0, 0, 0]
+    t = timed(run)
+    print('pickled      {:6.1f} ms/image  {:7.0f} MB/s'.format(t / args.n * 1000, 2 * mb * args.n / t))
+
+    # engine.run reads at most `window` inputs ahead, each of which may
+    # hold an input and an output slot; plus the result being taken
+    window = args.j
+    with shm.ImagePool.for_images(2 * window + 1, im.shape) as images:
+        def run():
+            handles = (images.put(im) for _ in range(args.n))
+            for result in engine.run(invert_shared, handles, workers=args.j, window=window,
+                                     initializer=shm.install, initargs=(images,)):
+                out = images.take(result.value)
+            assert out[0, 0, 0] == 255 - im[0, 0, 0]
+        t = timed(run)
+    print('shared       {:6.1f} ms/image  {:7.0f} MB/s'.format(t / args.n * 1000, 2 * mb * args.n / t))
+    print('(shared includes copying the image into a slot and the result out of one)')
+
+
+if __name__ == '__main__':
+    main()
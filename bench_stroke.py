@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""Stroke width: stroke_width_iterative (the reference) against
+fast_stroke_width, at full camera resolution: time and agreement, which
+should be identical.
+
+python bench_stroke.py [image ...]   (default: book/*.jpg)
+
+Each page is also run with strokes thickened (eroded), which raises the
+stroke radius and the number of dilations: both versions make
+stroke_radius passes, the fast one only computes the percentile faster.
+"""
+import glob
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from rebook import algorithm, binarize
+
+
+def measure(func, bw, repeat=3):
+    best = np.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(bw)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def compare(name, bw):
+    t_iter, ref = measure(algorithm.stroke_width_iterative, bw)
+    t_fast, new = measure(algorithm.fast_stroke_width, bw)
+    fg = bw == 0
+    agree = (ref[fg] == new[fg]).mean()
+    ratio = new[fg].mean() / max(ref[fg].mean(), 1e-9)
+    print('  {:<10} iterative {:6.1f} ms  fast {:6.1f} ms  {:4.1f}x  '
+          'agree {:6.2%}  mean width ratio {:.3f}  identical {}'.format(
+              name, t_iter * 1000, t_fast * 1000, t_iter / t_fast, agree, ratio,
+              np.array_equal(ref, new)))
+
+
+def main(paths):
+    for path in paths:
+        im = cv2.imread(path)
+        bw = binarize.binarize(im, algorithm=lambda im: binarize.sauvola_noisy(im, k=0.1))
+        print('{} {}x{}'.format(path, bw.shape[1], bw.shape[0]))
+        compare('page', bw)
+        for size in [5, 9]:
+            bold = cv2.erode(bw, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size)))
+            compare('bold {}'.format(size), bold)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:] or sorted(glob.glob('book/*.jpg')))
@@ -2,12 +2,7 @@ import os
 import glob
 import cv2
 import numpy as np
-import onnxruntime
-from ultralytics import YOLO
-from rapidocr_onnxruntime import RapidOCR
 from argparse import ArgumentParser
-from rebook.spliter import book_spliter
-from rebook.dewarp import go_dewarp
 import traceback
 from concurrent.futures import ProcessPoolExecutor, as_completed
 
@@ -55,6 +50,8 @@ def white_balance_correct(image: np.ndarray) -> np.ndarray:
     return balanced_img
 
 def hand_landmark(image: np.ndarray) -> list[list[float]]:
+    from rtmlib import Hand, PoseTracker
+
     hand = PoseTracker(
     Hand,
     tracking=False,
@@ -94,13 +91,19 @@ def resize_to_match_aspect(img: np.ndarray, ref_shape: tuple[int, int, int]) ->
         resized = cv2.resize(img, (img.shape[1], new_h), interpolation=cv2.INTER_CUBIC)
     return resized
 
+# Workers run side by side: each gets its share of the CPUs for the strip
+# threads (lib.map_strips) instead of one thread per CPU each.
+def worker_init(workers: int) -> None:
+    from rebook import lib
+    lib.THREADS = max(1, (os.cpu_count() or 1) // workers)
+
 def process_image(image_path: str, args_dict: dict) -> tuple[str, list[str]]:
     import cv2
     import numpy as np
     import traceback
     from rapidocr_onnxruntime import RapidOCR
+    from rebook import lib, output
     from rebook.dewarp import go_dewarp
-    from rebook.spliter import book_spliter
 
     debug: bool = args_dict['debug']
     model_seg: str = args_dict['model_seg']
@@ -114,16 +117,24 @@ def process_image(image_path: str, args_dict: dict) -> tuple[str, list[str]]:
     scantailor_split: bool = args_dict['scantailor_split']
     split_pages: bool = args_dict['split_pages']
 
-    if hand_mark:
-        from rtmlib import Hand, PoseTracker, draw_skeleton
     if not scantailor_split:
-        from ultralytics import YOLO
-        model = YOLO(model_seg)
+        from rebook.segment import load_model
+        from rebook.spliter import book_spliter, segment_book
+        model = load_model(model_seg)
     ocr = RapidOCR()
 
     original_filename: str = os.path.basename(image_path)
     base, ext = os.path.splitext(original_filename)
+    out_ext: str = output.extension(args_dict.get('output_format'), ext)
+    out_params: list = output.encode_params(out_ext, args_dict.get('quality'), args_dict.get('png_compression'))
+    # uitvoer op de achtergrond schrijven; het origineel pas archiveren (link/kopie/move,
+    # geen her-encode) als die uitvoer op schijf staat
+    to_archive: bool = False
+    writer = output.Writer()
     result_lines: list[str] = []
+    # workers may be spawned without the parent's logging setup
+    lib.setup_logging(debug, json_path=args_dict.get('log_json'))
+    lib.page = base
     try:
         frame = cv2.imread(image_path)
         if frame is None:
@@ -142,8 +153,8 @@ def process_image(image_path: str, args_dict: dict) -> tuple[str, list[str]]:
         else:
             if hand_mark:
                 f_points = hand_landmark(frame)
-            results = model(frame)
-            re = book_spliter(frame, results, f_points)
+            contour = segment_book(model, frame)
+            re = book_spliter(frame, contour, f_points)
         if re is not None:
             book_left, book_right, ctr_l, ctr_r, f_points_l, f_points_r = re
             if scantailor_split:
@@ -169,13 +180,18 @@ def process_image(image_path: str, args_dict: dict) -> tuple[str, list[str]]:
                         debug_visualize_index_numbers(page_im, index_numbers, debug_filename)
                         print(f"Gedetecteerde {len(index_numbers)} indexnummers voor {base}_{side}: {[text for _, text in index_numbers]}")
                     
+                    lib.page = f"{base}_{side}"
                     img_dewarped = go_dewarp(
                         page_im, page_ctr,
                         debug=debug,
                         f_points=page_points,
                         split=split_pages,
                         index_numbers=index_numbers,  # Geef indexnummers door
-                        focal_length=args_dict.get('focal_length')  # Experimentele focal length
+                        focal_length=args_dict.get('focal_length'),  # Experimentele focal length
+                        analysis_scale=args_dict.get('analysis_scale'),
+                        trace_path=args_dict.get('opt_trace'),
+                        trace_name=f"{base}_{side}",
+                        binarize_algorithm=args_dict.get('binarize'),
                     )
                     # Handle graceful degradation
                     if len(img_dewarped) > 0 and len(img_dewarped[0]) > 1:
@@ -188,14 +204,14 @@ def process_image(image_path: str, args_dict: dict) -> tuple[str, list[str]]:
                     dewarped_img: np.ndarray = img_dewarped[0][0]
                     dewarped_img = resize_to_match_aspect(dewarped_img, input_shape)
                     img_dewarped_ill: np.ndarray = ill_correct(dewarped_img)
-                    dewarped_filename: str = f"{base}_{side}_dewarped{ext}"
-                    cropped_pic_filename: str = f"{base}_{side}_dewarped_pic{ext}"
-                    cv2.imwrite(os.path.join(archive_folder, original_filename), frame)
-                    cv2.imwrite(os.path.join(output_folder, dewarped_filename), img_dewarped_ill)
+                    dewarped_filename: str = f"{base}_{side}_dewarped{out_ext}"
+                    cropped_pic_filename: str = f"{base}_{side}_dewarped_pic{out_ext}"
+                    to_archive = True
+                    writer.write(os.path.join(output_folder, dewarped_filename), img_dewarped_ill, out_params)
                     
                     # Visualiseer textlines op originele afbeelding
                     if visualize_textlines and boxes is not None:
-                        textlines_filename = f"{base}_{side}_textlines{ext}"
+                        textlines_filename = f"{base}_{side}_textlines{out_ext}"
                         textlines_path = os.path.join(output_folder, textlines_filename)
                         visualize_textlines_on_image(page_im, boxes, textlines_path)
                     
@@ -221,7 +237,7 @@ def process_image(image_path: str, args_dict: dict) -> tuple[str, list[str]]:
                                     cropped_img = white_balance_correct(dewarped_img)[y_min:y_max, x_min:x_max]
                                 else:
                                     cropped_img = img_dewarped_ill[y_min:y_max, x_min:x_max]
-                                cv2.imwrite(os.path.join(output_folder, cropped_pic_filename), cropped_img)
+                                writer.write(os.path.join(output_folder, cropped_pic_filename), cropped_img, out_params)
                     dets, _ = ocr(img_dewarped_ill, use_det=True, use_cls=False, use_rec=False)
                     if dets is not None and len(dets) > 0:
                         dets = dets[:3] + dets[-3:]
@@ -254,7 +270,7 @@ def process_image(image_path: str, args_dict: dict) -> tuple[str, list[str]]:
                     
                     # Voeg textlines-visualisatie toe aan output
                     if visualize_textlines and boxes is not None:
-                        textlines_filename = f"{base}_{side}_textlines{ext}"
+                        textlines_filename = f"{base}_{side}_textlines{out_ext}"
                         result_lines.append(f'![{textlines_filename}]({output_folder}/{textlines_filename})\n\n')
                     
                     result_lines.append(f'![{dewarped_filename}]({output_folder}/{dewarped_filename})\n\n')
@@ -264,6 +280,18 @@ def process_image(image_path: str, args_dict: dict) -> tuple[str, list[str]]:
                     continue
     except Exception as e:
         result_lines.append(f'Error processing {image_path}: {e}\n')
+    finally:
+        # ook bij een vroege return: anders blijft de schrijfthread hangen
+        try:
+            writer.close()
+        except Exception as e:
+            result_lines.append(f'Error writing output for {image_path}: {e}\n')
+            to_archive = False
+    if to_archive:
+        try:
+            output.archive(image_path, archive_folder, args_dict.get('archive_mode', 'link'))
+        except Exception as e:
+            result_lines.append(f'Error archiving {image_path}: {e}\n')
     return base, result_lines
 
 def visualize_textlines_on_image(image: np.ndarray, boxes: list, output_path: str) -> None:
@@ -413,6 +441,9 @@ def debug_visualize_index_numbers(image: np.ndarray, index_numbers: list[tuple[f
     cv2.imwrite(debug_filename, debug_img)
 
 if __name__ == '__main__':
+    from rebook.binarize import ALGORITHMS
+    from rebook.output import ARCHIVE_MODES, FORMATS
+
     parser = ArgumentParser()
     parser.add_argument(
         "-sp", "--split-pages",
@@ -431,7 +462,7 @@ if __name__ == '__main__':
         '--model_seg',
         type=str,
         default='model/yolov8l-seg.pt',
-        help='Model file path for YOLO segment.',
+        help='Segmentation model: ultralytics .pt, or an ONNX export (.onnx) run on onnxruntime without torch.',
     )
     parser.add_argument(
         '-ha',
@@ -477,6 +508,33 @@ if __name__ == '__main__':
         default='original_img',
         help='Archive original image in this folder.',
     )
+    parser.add_argument(
+        '--archive-mode',
+        default='link',
+        choices=ARCHIVE_MODES,
+        help='How originals get into the archive folder, without re-encoding: '
+             'hardlink (copy across file systems), copy or move. Done once the outputs are written.',
+    )
+    parser.add_argument(
+        '--output-format',
+        default=None,
+        choices=FORMATS,
+        help='Format of the output images (default: same as the input).',
+    )
+    parser.add_argument(
+        '--quality',
+        type=int,
+        default=None,
+        help='JPEG/WebP quality 0-100 (default: OpenCV, 95).',
+    )
+    parser.add_argument(
+        '--png-compression',
+        type=int,
+        default=None,
+        choices=range(10),
+        metavar='0-9',
+        help='PNG compression level (default: OpenCV, 1).',
+    )
     parser.add_argument(
         '-n',
         '--note_name',
@@ -502,6 +560,28 @@ if __name__ == '__main__':
         default=None,
         help='Experimental focal length override (default: 3230 for mobile, 10000 for flatbed).',
     )
+    parser.add_argument(
+        '--analysis-scale',
+        default=None,
+        help="Estimate the dewarp surface on a downscaled page ('auto' or a factor like 0.5); the output is still rendered at full resolution. A scaled estimate far off the full-resolution lines is redone at full resolution.",
+    )
+    parser.add_argument(
+        '--log-json',
+        default=None,
+        help="Write log records as JSON lines to this file ('-' for stderr) instead of text.",
+    )
+    parser.add_argument(
+        '--opt-trace',
+        default=None,
+        help='Append optimizer telemetry (one JSON line per page) to this file; plot with python -m rebook.telemetry.',
+    )
+    parser.add_argument(
+        '--binarize',
+        default=None,
+        choices=list(ALGORITHMS),
+        help='Binarization for line detection (default sauvola_noisy); '
+             'bench_binarize.py DIR --select picks one per book.',
+    )
     args = parser.parse_args()
     debug: bool = args.debug
     model_seg: str = args.model_seg
@@ -531,6 +611,14 @@ if __name__ == '__main__':
         'scantailor_split': scantailor_split,
         'split_pages': args.split_pages,
         'focal_length': args.focal_length,
+        'analysis_scale': args.analysis_scale,
+        'opt_trace': args.opt_trace,
+        'log_json': args.log_json,
+        'binarize': args.binarize,
+        'archive_mode': args.archive_mode,
+        'output_format': args.output_format,
+        'quality': args.quality,
+        'png_compression': args.png_compression,
     }
     image_paths = glob.glob(os.path.join(input_folder, '*.jpg'))
     image_paths += glob.glob(os.path.join(input_folder, '*.jpeg'))
@@ -540,7 +628,8 @@ if __name__ == '__main__':
         with open(note_name, 'a', encoding='utf-8') as note_file:
             # Beperk het aantal workers als je CUDA gebruikt
             max_workers = 5  # Of 1 als je zeker wilt zijn van geen OOM
-            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            with ProcessPoolExecutor(max_workers=max_workers, initializer=worker_init,
+                                     initargs=(max_workers,)) as executor:
                 futures = [executor.submit(process_image, image_path, args_dict) for image_path in image_paths]
                 for future in as_completed(futures):
                     base, result_lines = future.result()
@@ -13,82 +13,42 @@ DTYPE = np.uint8
 
 ctypedef np.uint8_t DTYPE_t
 
-# IM = inpainting mask with 1s in background, 0s in foreground
-def inpaint_ng14(np.ndarray[DTYPE_t, ndim=2] im,
-                 np.ndarray[DTYPE_t, ndim=2] IM):
-    cdef int im_h = im.shape[0]
-    cdef int im_w = im.shape[1]
-
-    cdef int y, x
+cdef void sweep(DTYPE_t[:, ::1] I, DTYPE_t[:, ::1] M, int im_h, int im_w,
+                bint up, bint left) noexcept nogil:
+    cdef int i, j, y, x
     cdef int temp
-    cdef np.ndarray[DTYPE_t, ndim=2, mode="c"] I = \
-        np.pad(im, (1, 1), 'edge')
-    cdef np.ndarray[DTYPE_t, ndim=2, mode="c"] Pi = \
-        np.zeros([im_h, im_w], dtype=DTYPE)
-
-    cdef np.ndarray[DTYPE_t, ndim=2, mode="c"] IM_padded = \
-        np.pad(IM, (1, 1), 'constant', constant_values=1)
-    cdef np.ndarray[DTYPE_t, ndim=2, mode="c"] M = IM_padded.copy()
-    for y in range(1, im_h + 1):
-        for x in range(1, im_w + 1):
-            if M[y, x] == 0:
-                temp  = I[y, x - 1] & -M[y, x - 1]
-                temp += I[y - 1, x] & -M[y - 1, x]
-                temp += I[y, x + 1] & -M[y, x + 1]
-                temp += I[y + 1, x] & -M[y + 1, x]
-                Pi[y - 1, x - 1] = temp / (M[y, x - 1] + M[y - 1, x] + \
-                                           M[y, x + 1] + M[y + 1, x])
-                I[y, x] = Pi[y - 1, x - 1]
-                M[y, x] = 1
-
-    cdef np.ndarray[DTYPE_t, ndim=2, mode="c"] Pmin = Pi.copy()
-    cdef np.ndarray[np.uint32_t, ndim=2, mode="c"] Psum = Pi.copy().astype(np.uint32)
-
-    np.copyto(M, IM_padded)
-    for y in range(im_h, 0, -1):
-        for x in range(1, im_w + 1):
+    for i in range(1, im_h + 1):
+        y = im_h + 1 - i if up else i
+        for j in range(1, im_w + 1):
+            x = im_w + 1 - j if left else j
             if M[y, x] == 0:
                 temp  = I[y, x - 1] & -M[y, x - 1]
                 temp += I[y - 1, x] & -M[y - 1, x]
                 temp += I[y, x + 1] & -M[y, x + 1]
                 temp += I[y + 1, x] & -M[y + 1, x]
-                Pi[y - 1, x - 1] = temp / (M[y, x - 1] + M[y - 1, x] + \
-                                           M[y, x + 1] + M[y + 1, x])
-                I[y, x] = Pi[y - 1, x - 1]
+                I[y, x] = temp // (M[y, x - 1] + M[y - 1, x] + \
+                                   M[y, x + 1] + M[y + 1, x])
                 M[y, x] = 1
-    np.minimum(Pmin, Pi, out=Pmin)
-    Psum += Pi
 
-    np.copyto(M, IM_padded)
-    for y in range(1, im_h + 1):
-        for x in range(im_w, 0, -1):
-            if M[y, x] == 0:
-                temp  = I[y, x - 1] & -M[y, x - 1]
-                temp += I[y - 1, x] & -M[y - 1, x]
-                temp += I[y, x + 1] & -M[y, x + 1]
-                temp += I[y + 1, x] & -M[y + 1, x]
-                Pi[y - 1, x - 1] = temp / (M[y, x - 1] + M[y - 1, x] + \
-                                           M[y, x + 1] + M[y + 1, x])
-                I[y, x] = Pi[y - 1, x - 1]
-                M[y, x] = 1
-    np.minimum(Pmin, Pi, out=Pmin)
-    Psum += Pi
+# One directional pass of the ng2014 inpainting: rows bottom-up if up,
+# columns right-to-left if left. IM = inpainting mask with 1s in background,
+# 0s in foreground. Returns im with the foreground filled in. The passes are
+# independent and run without the GIL, so they can go on threads
+# (binarize.inpaint_ng14 combines them).
+def inpaint_ng14_sweep(np.ndarray[DTYPE_t, ndim=2] im,
+                       np.ndarray[DTYPE_t, ndim=2] IM,
+                       bint up, bint left):
+    cdef int im_h = im.shape[0]
+    cdef int im_w = im.shape[1]
 
-    np.copyto(M, IM_padded)
-    for y in range(im_h, 0, -1):
-        for x in range(im_w, 0, -1):
-            if M[y, x] == 0:
-                temp  = I[y, x - 1] & -M[y, x - 1]
-                temp += I[y - 1, x] & -M[y - 1, x]
-                temp += I[y, x + 1] & -M[y, x + 1]
-                temp += I[y + 1, x] & -M[y + 1, x]
-                Pi[y - 1, x - 1] = temp / (M[y, x - 1] + M[y - 1, x] + \
-                                           M[y, x + 1] + M[y + 1, x])
-                I[y, x] = Pi[y - 1, x - 1]
-                M[y, x] = 1
-    np.minimum(Pmin, Pi, out=Pmin)
-    Psum += Pi
+    cdef np.ndarray[DTYPE_t, ndim=2, mode="c"] I = \
+        np.pad(im, (1, 1), 'edge')
+    cdef np.ndarray[DTYPE_t, ndim=2, mode="c"] M = \
+        np.pad(IM, (1, 1), 'constant', constant_values=1)
 
-    cdef np.ndarray[DTYPE_t, ndim=2, mode="c"] Pavg = (Psum / 4).astype(np.uint8)
+    cdef DTYPE_t[:, ::1] I_view = I
+    cdef DTYPE_t[:, ::1] M_view = M
+    with nogil:
+        sweep(I_view, M_view, im_h, im_w, up, left)
 
-    return Pmin, Pavg, I[1:im_h + 1, 1:im_w + 1]
+    return I[1:im_h + 1, 1:im_w + 1]
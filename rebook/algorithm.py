@@ -1,15 +1,17 @@
 from __future__ import division, print_function
 
 import cv2
+import logging
+from bisect import bisect_left, bisect_right, insort
 import math
 import numpy as np
-from scipy import interpolate
-from skimage.measure import ransac
 from numpy.polynomial import Polynomial as Poly
-from . import lib
+from . import analysis, labels, lib, robust
 from .geometry import Line
 from .lib import debug_imwrite, is_bw
-from .letters import Letter, TextLine
+from .letters import Letter, LetterTable, TextLine, fit_lines, letter_stats
+
+log = logging.getLogger(__name__)
 
 cross33 = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
 
@@ -19,6 +21,7 @@ def skew_angle(im, orig, AH, lines):
     else:
         debug = orig.copy()
 
+    fit_lines([l for l in lines if len(l) >= 8])
     alphas = []
     for l in lines:
         if len(l) < 8: continue
@@ -67,30 +70,27 @@ def top_contours(contours, hierarchy):
 def all_letters(im):
     # Safety check for image format
     if len(im.shape) != 2:
-        if lib.debug:
-            print(f'[all_letters] WARNING: Expected 2D image, got shape {im.shape}')
+        log.debug('[all_letters] Expected 2D image, got shape %s', im.shape)
         return []
     
     if im.dtype != np.uint8:
-        if lib.debug:
-            print(f'[all_letters] WARNING: Converting {im.dtype} to uint8')
+        log.debug('[all_letters] Converting %s to uint8', im.dtype)
         im = im.astype(np.uint8)
     
     try:
-        max_label, labels, stats, centroids = \
-            cv2.connectedComponentsWithStats(im ^ 255, connectivity=4)
-        return [Letter(label, labels, stats[label], centroids[label]) \
-                for label in range(1, max_label)]
+        return LetterTable.from_components(analysis.memo_components(im))
     except cv2.error as e:
-        if lib.debug:
-            print(f'[all_letters] OpenCV error: {e}')
+        log.debug('[all_letters] OpenCV error: %s', e)
         return []
 
 def dominant_char_height(im, letters=None):
     if letters is None:
         letters = all_letters(im)
 
-    heights = [letter.h for letter in letters if letter.w > 10]
+    if isinstance(letters, LetterTable):
+        heights = letters.h[letters.w > 10]
+    else:
+        heights = [letter.h for letter in letters if letter.w > 10]
 
     hist, _ = np.histogram(heights, 256, [0, 256])
     # TODO: make depend on DPI.
@@ -124,6 +124,12 @@ def valid_letter(AH, l):
     # return l.h < 6 * AH and l.w < 6 * AH and l.h > AH / 3 and l.w > AH / 4
     return l.h < 3 * AH and l.w < 3 * AH and l.h > AH / 3 and l.w > AH / 4 and l.h/l.w > 0.4 and l.h/l.w < 2.5
 
+# valid_letter over a whole LetterTable
+def valid_letters(AH, letters):
+    h, w = letters.h, letters.w
+    ratio = h / w
+    return (h < 3 * AH) & (w < 3 * AH) & (h > AH / 3) & (w > AH / 4) & (ratio > 0.4) & (ratio < 2.5)
+
 def filter_size(AH, im, letters=None):
     if letters is None:
         letters = all_letters(im)
@@ -135,11 +141,15 @@ def filter_size(AH, im, letters=None):
         lib.debug_imwrite('size_filter.png', debug)
 
     # Slightly tuned from paper (h < 3 * AH and h < AH / 4)
+    if isinstance(letters, LetterTable):
+        return letters[valid_letters(AH, letters)]
     return [l for l in letters if valid_letter(AH, l)]
 
 def horizontal_lines(AH, im, components=None):
     if components is None:
         components = all_letters(im)
+    if isinstance(components, LetterTable):
+        components = components[components.w > AH * 10]
 
     result = []
     for component in components:
@@ -153,15 +163,41 @@ def horizontal_lines(AH, im, components=None):
 
     return result
 
+# Lines by the extent of their base points, so a mark (underline) is only
+# compared with the lines it can touch. Base points are computed once per
+# line; update() after a line changes.
+class LineIndex(object):
+    def __init__(self, lines):
+        self.lines = lines
+        self.base_points = [None] * len(lines)
+        self.bounds = np.zeros((len(lines), 4), dtype=int)  # x0, x1, y0, y1 (inclusive)
+        for i in range(len(lines)):
+            self.update(i)
+
+    def update(self, i):
+        base_points = self.lines[i].base_points().astype(int)
+        self.base_points[i] = base_points
+        self.bounds[i] = base_points[:, 0].min(), base_points[:, 0].max(), \
+            base_points[:, 1].min(), base_points[:, 1].max()
+
+    # indices, in order, of lines with base points at x in [x0, x1) whose
+    # base y range meets [y0, y1]
+    def query(self, x0, x1, y0, y1):
+        b = self.bounds
+        return np.flatnonzero((b[:, 0] < x1) & (b[:, 1] >= x0) & (b[:, 2] <= y1) & (b[:, 3] >= y0))
+
 def combine_underlined(AH, im, lines, components):
     lines_set = set(lines)
+    index = LineIndex(lines)
     underlines = horizontal_lines(AH, im, components)
     for underline in underlines:
         raster = underline.raster()
         bottom = underline.y + underline.h - 1 - raster[::-1].argmax(axis=0)
         close_lines = []
-        for line in lines:
-            base_points = line.base_points().astype(int)
+        for i in index.query(underline.x, underline.right(),
+                             underline.y - AH, underline.y + underline.h - 1 + AH):
+            line = lines[i]
+            base_points = index.base_points[i]
             base_points = base_points[(base_points[:, 0] >= underline.x) \
                                       & (base_points[:, 0] < underline.right())]
             if len(base_points) == 0: continue
@@ -170,47 +206,54 @@ def combine_underlined(AH, im, lines, components):
             underline_ys = bottom[base_points[:, 0] - underline.x]
             if np.all(np.abs(base_ys - underline_ys) < AH):
                 line.underlines.append(underline)
-                close_lines.append(line)
+                close_lines.append(i)
 
         if len(close_lines) > 1:
             # print('merging some underlined lines!')
-            combined = close_lines[0]
+            combined = lines[close_lines[0]]
             lines_set.discard(combined)
-            for line in close_lines[1:]:
-                lines_set.discard(line)
-                combined.merge(line)
+            for i in close_lines[1:]:
+                lines_set.discard(lines[i])
+                combined.merge(lines[i])
 
             lines_set.add(combined)
+            index.update(close_lines[0])
 
-    return list(lines_set)
+    # keep the input order; set order depends on object ids
+    return [line for line in lines if line in lines_set]
 
 def hand_drawn_lines(AH, im, lines, components=None):
     if components is None:
         components = all_letters(im)
+    if isinstance(components, LetterTable):
+        components = components[(components.w > AH * 3) & (components.h < AH * 4)]
 
+    index = LineIndex(lines)
     underlines = []
     for component in components:
         if component.w > AH * 3 and component.h < AH * 4:
             mask = component.raster()
             proj = mask.sum(axis=0)
             smooth = (proj[:-2] + proj[1:-1] + proj[2:]) / 3.0
-            if np.percentile(smooth, 85) <= AH / 1.0 and \
-                np.percentile(smooth, 85) - np.percentile(smooth, 15) <= AH / 2.0:
+            p15, p85 = np.percentile(smooth, [15, 85])
+            if p85 <= AH / 1.0 and p85 - p15 <= AH / 2.0:
                 top_contour = component.top_contour()
-                clipped_top_contour = top_contour.copy()
-                clipped_top_contour[top_contour < np.percentile(top_contour, 20)] = np.percentile(top_contour, 20)
-                for idx, line in enumerate(lines):
-                    base_points = line.base_points().astype(int)
+                clipped_top_contour = np.maximum(top_contour, int(np.percentile(top_contour, 20)))
+                # base y must lie in (top - 1.5 AH, top]
+                for idx in index.query(component.left(), component.right(),
+                                       component.y - AH * 1.5, component.y + component.h - 1):
+                    base_points = index.base_points[idx]
                     points_filter = (base_points[:, 0] >= component.left()) & (base_points[:, 0] < component.right())
                     base_points = base_points[points_filter]
                     if len(base_points) == 0: continue
                     base_y = base_points[:, 1]
                     y_diff = clipped_top_contour[base_points[:, 0] - component.left()] - base_y
                     if np.all((y_diff >= 0) & (y_diff < AH * 1.5)):
+                        in_range = np.flatnonzero(points_filter)
                         underlines.append([
-                            idx, 
-                            np.where(points_filter)[0][0], 
-                            np.where(points_filter)[0][-1], 
+                            int(idx), 
+                            in_range[0], 
+                            in_range[-1], 
                             component.left_mid(),
                             component.right_mid(),
                             ])
@@ -231,7 +274,75 @@ def hand_drawn_lines(AH, im, lines, components=None):
 
     return underlines
 
+# Letters in x order; each letter joins the best line whose last (or second
+# to last) box overlaps it vertically and ends less than 4 AH (AH) before it.
+# Line tails live in y-sorted indexes (one per power-of-two height class, so
+# one tall blob doesn't widen every query) and a letter only looks at the
+# tails in its own y-range. Tails that can no longer match anything are
+# dropped on sight. Produces exactly the lines of collate_lines_scan.
 def collate_lines(AH, word_boxes):
+    if len(word_boxes) == 0: return []
+
+    if isinstance(word_boxes, LetterTable):
+        xs, ys, ws, hs = word_boxes.x, word_boxes.y, word_boxes.w, word_boxes.h
+    else:
+        stats = letter_stats(word_boxes)
+        xs, ys, ws, hs = stats[:, 0], stats[:, 1], stats[:, 2], stats[:, 3]
+    order = np.argsort(xs, kind='stable')
+    xs, ys, ws, hs = xs[order].tolist(), ys[order].tolist(), ws[order].tolist(), hs[order].tolist()
+
+    lines = []  # letter indices (in x order)
+    tails = {}  # height class -> sorted (y, line, slot); slot 0 = last box, 1 = the one before
+    for i in range(len(xs)):
+        x1, y1, w1, h1 = xs[i], ys[i], ws[i], hs[i]
+
+        candidates = set()
+        for size, index in tails.items():
+            lo = bisect_left(index, (y1 - (1 << size) + 1,))
+            hi = bisect_right(index, (y1 + h1, len(lines)))
+            candidates.update(line_idx for _, line_idx, _ in index[lo:hi])
+
+        best_score, best_line = None, None
+        for line_idx in sorted(candidates):
+            l = lines[line_idx]
+            j0 = l[-1]
+            jp = l[-2] if len(l) > 1 else j0
+            x0, y0, w0, h0 = xs[j0], ys[j0], ws[j0], hs[j0]
+            x0p, y0p, w0p, h0p = xs[jp], ys[jp], ws[jp], hs[jp]
+            if x1 >= x0 + w0 + 4 * AH and x1 >= x0p + w0p + AH:
+                # x only grows: this line is finished
+                remove_tails(tails, l, line_idx, ys, hs)
+                continue
+
+            if x1 < x0 + w0 + 4 * AH and y0 <= y1 + h1 and y1 <= y0 + h0:
+                score = x1 - x0 - w0 + abs(y1 - y0)
+            elif x1 < x0p + w0p + AH and y0p <= y1 + h1 and y1 <= y0p + h0p:
+                score = x1 - x0p - w0p + abs(y1 - y0p)
+            else:
+                continue
+            # ties go to the oldest line, like the stable sort in collate_lines_scan
+            if best_line is None or score < best_score:
+                best_score, best_line = score, line_idx
+
+        if best_line is None:
+            best_line = len(lines)
+            lines.append([])
+        l = lines[best_line]
+        remove_tails(tails, l, best_line, ys, hs)
+        l.append(i)
+        for slot, j in enumerate(l[-1:-3:-1]):
+            insort(tails.setdefault(hs[j].bit_length(), []), (ys[j], best_line, slot))
+
+    index = order.tolist()
+    return [TextLine([word_boxes[index[j]] for j in l]) for l in lines]
+
+def remove_tails(tails, l, line_idx, ys, hs):
+    for slot, j in enumerate(l[-1:-3:-1]):
+        index = tails[hs[j].bit_length()]
+        del index[bisect_left(index, (ys[j], line_idx, slot))]
+
+# Reference implementation: every letter against every line.
+def collate_lines_scan(AH, word_boxes):
     word_boxes = sorted(word_boxes, key=lambda c_x_y_w_h: c_x_y_w_h.x)
     lines = []
     for word_box in word_boxes:
@@ -289,7 +400,7 @@ def dewarp_text(im):
     im_h, im_w = im.shape
 
     AH = dominant_char_height(im)
-    print('AH =', AH)
+    log.debug('AH = %s', AH)
 
     word_boxes = word_contours(im)
     lines = collate_lines(AH, word_boxes)
@@ -350,11 +461,11 @@ def safe_rotate(im, angle):
     debug_imwrite('prerotated.png', im)
     im_h, im_w = im.shape[:2]
     if abs(angle) > math.pi / 4:
-        print("warning: too much rotation")
+        log.warning('too much rotation')
         return im
 
     angle_deg = angle * 180 / math.pi
-    print('rotating to angle:', angle_deg, 'deg')
+    log.debug('rotating to angle: %s deg', angle_deg)
 
     im_h_new = im_w * abs(math.sin(angle)) + im_h * math.cos(angle)
     im_w_new = im_h * abs(math.sin(angle)) + im_w * math.cos(angle)
@@ -372,10 +483,53 @@ def safe_rotate(im, angle):
     debug_imwrite('rotated.png', result)
     return result
 
+# np.percentile(values, q) for values >= 0 that are mostly 0: only the
+# nonzero part is partitioned.
+def percentile_nonneg(values, q):
+    flat = values.ravel()
+    nonzero = flat[flat > 0]
+    n, n_zero = flat.size, flat.size - nonzero.size
+    pos = (n - 1) * q / 100.0
+    lo = int(math.floor(pos))
+    ks = [lo, min(lo + 1, n - 1)]
+    nonzero_ks = [k - n_zero for k in ks if k >= n_zero]
+    if nonzero_ks:
+        nonzero = np.partition(nonzero, nonzero_ks)
+    a, b = [nonzero[k - n_zero] if k >= n_zero else 0 for k in ks]
+    t = pos - lo
+    return b - (b - a) * (1 - t) if t >= 0.5 else a + (b - a) * t
+
+# Stroke width (2 * inscribed radius + 1) at every black pixel: the widest
+# distance-transform value within stroke_radius pixels along the stroke,
+# by stroke_radius 3x3 dilations each clipped to the ink, as in
+# stroke_width_iterative (identical output). Only the 95th percentile is
+# faster (it skips the zero background); the dilations are still up to 20
+# full-image passes. A single square max filter crosses white gaps, and a
+# per-component or skeleton maximum gives other widths once a component is
+# wider than stroke_radius.
 def fast_stroke_width(im):
     # im should be black-on-white. max stroke width 41.
     assert im.dtype == np.uint8 and is_bw(im)
 
+    inv = im + 1
+    dists = cv2.distanceTransform(inv, cv2.DIST_L2, 5)
+    stroke_radius = min(20, int(math.ceil(percentile_nonneg(dists, 95))))
+    dists *= 2
+    dists += 1
+    dists = dists.astype(np.uint8)
+    ink = im ^ 255
+    rect = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
+    for _ in range(stroke_radius):
+        cv2.dilate(dists, rect, dst=dists)
+        cv2.bitwise_and(dists, ink, dst=dists)
+
+    dists[dists >= 41] = 0
+    return dists
+
+# Reference for fast_stroke_width: stroke_radius geodesic 3x3 dilations.
+def stroke_width_iterative(im):
+    assert im.dtype == np.uint8 and is_bw(im)
+
     inv = im + 1
     inv_mask = im ^ 255
     dists = cv2.distanceTransform(inv, cv2.DIST_L2, 5)
@@ -399,6 +553,7 @@ def fine_dewarp(out_0, im, AH, lines, underlines, all_letters, points, index_num
     y_offsets = []
     line_points = []  # Separate list for line points
     
+    fit_lines([line for line in lines if len(line) >= 10])
     for line in lines:
         if len(line) < 10 or abs(line.fit_line().angle()) > 0.05: continue
         line_p = line.fit_line()
@@ -445,38 +600,34 @@ def fine_dewarp(out_0, im, AH, lines, underlines, all_letters, points, index_num
             index_y_positions = np.linspace(0, im_h, len(index_x_positions))
             right_bounds = np.column_stack([index_x_positions, index_y_positions])
             
-            if lib.debug:
-                print(f"[fine_dewarp] Gebruikt {len(index_numbers)} indexnummers voor rechterkantlijn bepaling (mediaan x={median_x:.1f})")
-    
-    # x = my + b model weighted t
-    class LinearXModel(object):
-        def estimate(self, data):
-            self.params = Poly.fit(data[:, 1], data[:, 0], 1, domain=[-1, 1])
-            return True
-
-        def residuals(self, data):
-            return abs(self.params(data[:, 1]) - data[:, 0])
+            log.debug('[fine_dewarp] Gebruikt %d indexnummers voor rechterkantlijn bepaling (mediaan x=%.1f)', len(index_numbers), median_x)
     
+    # x = my + b
+    def fit_x(coords):
+        return Poly.fit(coords[:, 1], coords[:, 0], 1, domain=[-1, 1])
+
+    sides = [left_bounds, right_bounds]
+    # Gebruik een strengere threshold om uitschieters (zoals paginanummers) te negeren
+    threshold = max(AH / 20.0, 3.0)  # Minimaal 3 pixels tolerance
+    fits = iter(robust.fit_polys([coords for coords in sides if len(coords) >= 3],
+                                 1, 3, threshold, transpose=True))
+
     vertical_lines = []
     points_in_vertical_liner = []
-    for coords in [left_bounds, right_bounds]:
+    for coords in sides:
         # Controleer of er voldoende punten zijn voor RANSAC
         if len(coords) < 3:
-            if lib.debug:
-                print(f"Waarschuwing: Slechts {len(coords)} punten voor verticale lijn detectie in fine_dewarp")
+            log.debug('Waarschuwing: Slechts %d punten voor verticale lijn detectie in fine_dewarp', len(coords))
             # Gebruik een eenvoudige lineaire fit als er te weinig punten zijn
             if len(coords) >= 2:
-                model = LinearXModel()
-                model.estimate(coords)
-                vertical_lines.append(model.params)
+                vertical_lines.append(fit_x(coords))
                 points_in_vertical_liner.append(coords.tolist())
             else:
                 # Als er te weinig punten zijn, maak een verticale lijn
                 if len(coords) == 1:
                     x_coord = coords[0][0]
                     # Maak een verticale lijn: x = constant (bijna verticaal)
-                    from numpy.polynomial import Polynomial
-                    model_params = Polynomial([x_coord, 0.0001])  # x = x_coord + 0.0001*y (bijna verticaal)
+                    model_params = Poly([x_coord, 0.0001])  # x = x_coord + 0.0001*y (bijna verticaal)
                     vertical_lines.append(model_params)
                     points_in_vertical_liner.append(coords.tolist())
                 else:
@@ -484,33 +635,16 @@ def fine_dewarp(out_0, im, AH, lines, underlines, all_letters, points, index_num
                     vertical_lines.append(None)
                     points_in_vertical_liner.append([])
             continue
-            
-        # Normale RANSAC fit
-        try:
-            # Gebruik min_samples gebaseerd op aantal beschikbare punten
-            min_samples = min(3, len(coords))
-            # Gebruik een strengere threshold om uitschieters (zoals paginanummers) te negeren
-            threshold = max(AH / 20.0, 3.0)  # Minimaal 3 pixels tolerance
-            model, inliers = ransac(coords, LinearXModel, min_samples, threshold)
-            if model is not None:
-                vertical_lines.append(model.params)
-                ps = [p for p, inlier in zip(coords, inliers) if inlier]
-                points_in_vertical_liner.append(ps)
-            else:
-                if lib.debug:
-                    print("RANSAC faalde in fine_dewarp, gebruik eenvoudige lineaire fit")
-                # Fallback naar eenvoudige lineaire fit
-                model = LinearXModel()
-                model.estimate(coords)
-                vertical_lines.append(model.params)
-                points_in_vertical_liner.append(coords.tolist())
-        except Exception as e:
-            if lib.debug:
-                print(f"Fout bij RANSAC in fine_dewarp: {e}, gebruik eenvoudige lineaire fit")
+
+        model, inliers = next(fits)
+        if model is not None:
+            vertical_lines.append(model)
+            ps = [p for p, inlier in zip(coords, inliers) if inlier]
+            points_in_vertical_liner.append(ps)
+        else:
+            log.debug('RANSAC faalde in fine_dewarp, gebruik eenvoudige lineaire fit')
             # Fallback naar eenvoudige lineaire fit
-            model = LinearXModel()
-            model.estimate(coords)
-            vertical_lines.append(model.params)
+            vertical_lines.append(fit_x(coords))
             points_in_vertical_liner.append(coords.tolist())
     
     # x_offsets = []
@@ -543,6 +677,7 @@ def fine_dewarp(out_0, im, AH, lines, underlines, all_letters, points, index_num
     #                         method='nearest')
     # ymesh -= y_offset_interp
     
+    from scipy import interpolate
     y_offset_interp = interpolate.SmoothBivariateSpline(
         points_combined[:, 0], points_combined[:, 1], y_offsets_combined.clip(-AH, AH),
         s=4 * points_combined.shape[0]
@@ -555,14 +690,12 @@ def fine_dewarp(out_0, im, AH, lines, underlines, all_letters, points, index_num
     for point in points:
         # Check if point is scalar or array
         if np.isscalar(point):
-            if lib.debug:
-                print(f'[{"/".join(lib.debug_prefix)}] fine_dewarp: skipping scalar point {point}')
+            log.debug('fine_dewarp: skipping scalar point %s', point)
             continue
             
         # Ensure point is at least 2D
         if len(point) < 2:
-            if lib.debug:
-                print(f'[{"/".join(lib.debug_prefix)}] fine_dewarp: skipping 1D point {point}')
+            log.debug('fine_dewarp: skipping 1D point %s', point)
             continue
             
         point_2 = [int(point[0]), int(point[1])]
@@ -571,8 +704,7 @@ def fine_dewarp(out_0, im, AH, lines, underlines, all_letters, points, index_num
         point_2[0] = max(0, min(point_2[0], conv_xmesh.shape[0] - 1))
         point_2[1] = max(0, min(point_2[1], conv_xmesh.shape[1] - 1))
         
-        if lib.debug:
-            print(f'[{"/".join(lib.debug_prefix)}] fine_dewarp anchor point: {point} -> {point_2} (mesh shape: {conv_xmesh.shape})')
+        log.debug('fine_dewarp anchor point: %s -> %s (mesh shape: %s)', point, point_2, conv_xmesh.shape)
     # ----------------------------------------------------------------------
     
     out = cv2.remap(out_0, conv_xmesh, conv_ymesh,
@@ -588,8 +720,7 @@ def fine_dewarp(out_0, im, AH, lines, underlines, all_letters, points, index_num
         out = np.transpose(out, (1, 0))
     else:
         # Unknown format, leave as-is
-        if lib.debug:
-            print(f'[fine_dewarp] WARNING: Unexpected array shape {out.shape}, skipping transpose')
+        log.warning('[fine_dewarp] Unexpected array shape %s, skipping transpose', out.shape)
     
     # debug = cv2.cvtColor(out, cv2.COLOR_GRAY2BGR)
     # for line in lines:
@@ -614,8 +745,7 @@ def fine_dewarp(out_0, im, AH, lines, underlines, all_letters, points, index_num
 
     # Controleer of we voldoende control points hebben
     if len(control_points) < 4:
-        if lib.debug:
-            print("Waarschuwing: Onvoldoende control points, gebruik standaard waarden")
+        log.debug('Waarschuwing: Onvoldoende control points, gebruik standaard waarden')
         # Vul aan met standaard waarden
         while len(control_points) < 4:
             if len(control_points) == 2:
@@ -678,7 +808,7 @@ def fine_dewarp(out_0, im, AH, lines, underlines, all_letters, points, index_num
             all_points = []
             bounding_boxes = []
             num_letters = sum(len(line) for line in lines[pre_lines[0][0]:pre_lines[1][0]])
-            print('Number of letters:', num_letters, abs(f_points[1][1] - f_points[0][1]))
+            log.debug('Number of letters: %d %s', num_letters, abs(f_points[1][1] - f_points[0][1]))
             if num_letters > abs(f_points[1][1] - f_points[0][1]) / AH * 5:
                 for _, line in enumerate(lines[pre_lines[0][0]:pre_lines[1][0]]):
                     point_1 = line[0].left_top()
@@ -770,6 +900,8 @@ def fine_dewarp(out_0, im, AH, lines, underlines, all_letters, points, index_num
             next_underline = underlines[i + 1]
             current_idx, current_start, current_end, _, _ = current
             next_idx, next_start, next_end, _, _ = next_underline
+            current_right_mid = transformed_points[i][5]
+            next_left_mid = transformed_points[i + 1][4]
             if (current_idx == next_idx - 1 and 
                 # current_end == len(lines[current_idx]) - 1 and 
                 # next_start == 0):
@@ -810,20 +942,25 @@ def remove_stroke_outliers(im, lines, k=1.0):
     if lib.debug:
         lib.debug_imwrite('strokes.png', lib.normalize_u8(stroke_widths.clip(0, 10)))
 
-    mask = np.zeros(im.shape, dtype=np.uint8)
+    # per-letter stroke statistics in one pass per label map
+    letter_means = {}
+    all_values = []
+    by_map = {}
     for line in lines:
         for letter in line:
-            sliced = letter.crop().apply(mask)
-            sliced |= letter.raster()
-
-    lib.debug_imwrite('letter_mask.png', -mask)
+            by_map.setdefault(id(letter.label_map), (letter.label_map, []))[1].append(letter.label)
+    for label_map, letter_labels in by_map.values():
+        n_labels = labels.n_labels_of(label_map)
+        mask = labels.mask(label_map, letter_labels, n_labels)
+        counts, means, stds = labels.mean_std(label_map, stroke_widths, n_labels, mask=mask)
+        letter_means[id(label_map)] = counts, means, stds
+        all_values.append(stroke_widths[mask])
 
-    masked_strokes = stroke_widths.copy()
-    masked_strokes &= -mask
+        if lib.debug: lib.debug_imwrite('letter_mask.png', lib.bool_to_u8(mask))
 
-    strokes_mean, strokes_std = masked_mean_std(masked_strokes, mask)
-    if lib.debug:
-        print('overall: mean:', strokes_mean, 'std:', strokes_std)
+    all_values = np.concatenate(all_values) if all_values else np.zeros(0)
+    strokes_mean, strokes_std = all_values.mean(), all_values.std()
+    log.debug('overall: mean: %s std: %s', strokes_mean, strokes_std)
 
     debug = cv2.cvtColor(im, cv2.COLOR_GRAY2RGB)
     new_lines = []
@@ -831,19 +968,13 @@ def remove_stroke_outliers(im, lines, k=1.0):
         if len(line) <= 1: continue
         good_letters = []
         for letter in line:
-            crop = letter.crop()
-            if not crop.nonempty(): continue
-
-            raster = letter.raster()
-            sliced_strokes = crop.apply(stroke_widths).copy()
-            sliced_strokes &= lib.bool_to_u8(raster)
+            counts, means, stds = letter_means[id(letter.label_map)]
+            if counts[letter.label] == 0: continue
 
-            mean, std = masked_mean_std(sliced_strokes, raster)
+            mean, std = means[letter.label], stds[letter.label]
             if mean < strokes_mean - k * strokes_std:
                 if lib.debug:
-                    print('skipping {:4d} {:4d} {:.03f} {:.03f}'.format(
-                        letter.x, letter.y, mean, std,
-                    ))
+                    log.debug('skipping %4d %4d %.03f %.03f', letter.x, letter.y, mean, std)
                     letter.box(debug, color=lib.RED)
             else:
                 if lib.debug: letter.box(debug, color=lib.GREEN)
@@ -0,0 +1,119 @@
+from __future__ import division, print_function
+
+import cv2
+import logging
+import numpy as np
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+# Per-run memo for image analysis (grayscale, local mean/std, binarization,
+# connected components). Only active inside session(); go_dewarp and
+# batch.process_image open one. Entries are keyed on the identity of the
+# input buffer (address, shape, strides) plus the parameters, and keep the
+# input alive so the address can't be reused during the run. Inputs and
+# results must not be modified in place while a session is open: results
+# are returned read-only so that mistakes fail loudly.
+#
+# Pixelwise results (grayscale) for a crop (view) of a cached image are
+# served by slicing the parent's result.
+_cache = None
+_stats = None
+
+@contextmanager
+def session():
+    global _cache, _stats
+    if _cache is not None:  # nested: share the outer run's cache
+        yield
+        return
+
+    _cache, _stats = {}, {'hits': 0, 'crops': 0, 'misses': 0}
+    try:
+        yield
+    finally:
+        log.debug('analysis cache: %(hits)d hits, %(crops)d from crops, %(misses)d computed', _stats)
+        _cache, _stats = None, None
+
+def active():
+    return _cache is not None
+
+def address(im):
+    return im.__array_interface__['data'][0]
+
+def buffer_key(im):
+    return (address(im), im.shape, im.strides, im.dtype.str)
+
+# Hashable identity for an algorithm argument. Lambdas created at the same
+# call site share a code object; closures and defaults are part of the key.
+def callable_key(fn):
+    if fn is None or isinstance(fn, (int, float, str, tuple)):
+        return fn
+    func = getattr(fn, 'func', None)
+    if func is not None:  # functools.partial
+        return (callable_key(func), tuple(fn.args), tuple(sorted(fn.keywords.items())))
+    code = getattr(fn, '__code__', None)
+    if code is None:
+        return id(fn)
+    cells = tuple(id(c.cell_contents) for c in fn.__closure__ or ())
+    return (code, fn.__defaults__, cells)
+
+def freeze(result):
+    if isinstance(result, np.ndarray):
+        result.flags.writeable = False
+    elif isinstance(result, tuple):
+        for r in result:
+            freeze(r)
+    return result
+
+def memo(kind, im, params, compute):
+    if _cache is None:
+        return compute()
+
+    key = (kind, buffer_key(im), params)
+    entry = _cache.get(key)
+    if entry is not None:
+        _stats['hits'] += 1
+        return entry[1]
+
+    _stats['misses'] += 1
+    result = freeze(compute())
+    _cache[key] = (im, result)
+    return result
+
+# (parent image, row, col) if im is a crop of an image cached under kind.
+def find_parent(kind, im, params):
+    if _cache is None: return None
+
+    start = address(im)
+    for (k, (p_address, shape, strides, dtype), p), (parent, _) in _cache.items():
+        if k != kind or p != params or strides != im.strides or dtype != im.dtype.str:
+            continue
+        if shape[2:] != im.shape[2:] or start < p_address:
+            continue
+        row, rest = divmod(start - p_address, strides[0])
+        col, rest = divmod(rest, strides[1])
+        if rest == 0 and row + im.shape[0] <= shape[0] and col + im.shape[1] <= shape[1]:
+            return parent, row, col
+
+    return None
+
+# Pixelwise results: a crop of the input gets the same crop of the result.
+def memo_pixelwise(kind, im, params, compute):
+    if _cache is not None and (kind, buffer_key(im), params) not in _cache:
+        found = find_parent(kind, im, params)
+        if found is not None:
+            parent, row, col = found
+            _stats['crops'] += 1
+            result = _cache[(kind, buffer_key(parent), params)][1]
+            return result[row:row + im.shape[0], col:col + im.shape[1]]
+
+    return memo(kind, im, params, compute)
+
+# connectedComponentsWithStats of the black pixels of a 0/255 image, as
+# (n_labels, label_map, stats, centroids). Exact repeats only: relabelling a
+# parent's label map for a crop costs as much as a fresh CC pass.
+def components(im, connectivity=4):
+    return cv2.connectedComponentsWithStats(im ^ 255, connectivity=connectivity)
+
+def memo_components(im, connectivity=4):
+    return memo('cc', im, (connectivity,), lambda: components(im, connectivity))
@@ -2,34 +2,45 @@ from __future__ import print_function
 
 import argparse
 import cv2
-import glob
 import numpy as np
 import os
-import re
 import sys
-from fpdf import FPDF
-from multiprocessing import cpu_count
-from multiprocessing.pool import Pool
+from collections import namedtuple
 from os.path import join, isfile
-from subprocess import check_call, check_output
 
-import algorithm
-import binarize
-import dewarp
-from crop import crop
-from geometry import Crop
-from lib import debug_imwrite
-import lib
+from . import algorithm
+from . import analysis
+from . import binarize
+from . import dewarp
+from . import engine
+from . import lib
+from . import pdfwriter
+from . import sources
+from .crop import crop
+from .geometry import Crop
+from .lib import debug_imwrite
 
 extension = '.png'
-def process_image(original, dpi=None):
+
+# dewarp/rotate/dpi from the command line; passed to the workers with each
+# page instead of through a global.
+Options = namedtuple('Options', 'dewarp rotate dpi')
+
+# full_res: original is the half-size decode of this lib.RawImage (already
+# rotated); dewarping estimates on it and renders from the full decode.
+def process_image(original, dpi=None, full_res=None, dewarp=False, rotate=0):
+    with analysis.session():
+        return _process_image(original, dpi, full_res, dewarp, rotate)
+
+def _process_image(original, dpi=None, full_res=None, do_dewarp=False, rotate=0):
     original_rot90 = original
 
-    for i in range(args.rotate // 90):
-        original_rot90 = np.rot90(original_rot90)
+    if full_res is None:
+        for i in range(rotate // 90):
+            original_rot90 = np.rot90(original_rot90)
 
     # original_rot90 = cv2.resize(original_rot90, (0, 0), None, 1.5, 1.5)
-    im_h, im_w = original_rot90.shape[:2]
+    im_h, im_w = full_res.shape if full_res is not None else original_rot90.shape[:2]
     # image height should be about 10 inches. round to 100
     if not dpi:
         dpi = int(round(im_h / 1100.0) * 100)
@@ -38,9 +49,9 @@ def process_image(original, dpi=None):
     split = im_w > im_h # two pages
 
     cropped_images = []
-    if args.dewarp:
+    if do_dewarp:
         lib.debug_prefix.append('dewarp')
-        dewarped_images = dewarp.kim2014(original_rot90)
+        dewarped_images = dewarp.kim2014(original_rot90, full_res=full_res)
         for im in dewarped_images:
             bw = binarize.binarize(im, algorithm=binarize.sauvola, resize=1.0)
             lib.debug_prefix.append('crop')
@@ -92,112 +103,113 @@ def process_image(original, dpi=None):
 
     return dpi, out_images
 
-def process_file(file_args):
-    (inpath, outdir, dpi) = file_args
-    outfiles = glob.glob('{}/{}_*{}'.format(outdir, inpath[:-4], extension))
-    if outfiles:
+# job: (page, key, entry, outdir, options). entry is the manifest record
+# of an input that is already done; its page is sent without data.
+def process_file(job):
+    page, key, entry, outdir, options = job
+    inpath = page.name
+    if entry is not None:
         print('skipping', inpath)
-        return outfiles
-    else:
-        print('processing', inpath)
+        return entry['dpi'], entry['outputs']
+    print('processing', inpath)
 
-    original = lib.imread(inpath)
-    dpi, out_images = process_image(original, dpi=dpi)
+    os.makedirs(join(outdir, os.path.dirname(inpath)), exist_ok=True)
+
+    if options.dewarp and page.kind == 'file' and lib.is_raw(inpath):
+        full_res = lib.RawImage(inpath, options.rotate // 90)
+        dpi, out_images = process_image(full_res.half(), dpi=options.dpi, full_res=full_res,
+                                         dewarp=True)
+    else:
+        original = sources.decode(page)
+        if original is None:
+            raise ValueError('cannot decode {}'.format(inpath))
+        dpi, out_images = process_image(original, dpi=options.dpi, dewarp=options.dewarp,
+                                        rotate=options.rotate)
+    outfiles = []
     for idx, outimg in enumerate(out_images):
         outfile = '{}/{}_{}{}'.format(outdir, inpath[:-4], idx, extension)
-        print('    writing', outfile)
-        cv2.imwrite(outfile, outimg)
+        # pages are binarized: 1-bit PNG, which goes into the PDF as it is
+        if not cv2.imwrite(outfile, outimg, [cv2.IMWRITE_PNG_BILEVEL, 1]):
+            raise IOError('could not write {}'.format(outfile))
         outfiles.append(outfile)
 
-    return outfiles
-
-def pdfimages(pdf_filename):
-    assert pdf_filename.endswith('.pdf')
-    dirpath = pdf_filename[:-4]
-    if not os.path.isdir(dirpath):
-        os.makedirs(dirpath)
-    if not os.listdir(dirpath):
-        check_call(['pdfimages', '-png', pdf_filename, join(dirpath, 'page')])
-    return dirpath
-
-def unzip(zip_filename):
-    assert zip_filename.endswith('.zip')
-    directory = os.path.dirname(zip_filename)
-    filenames = check_output(['zipinfo', '-1', zip_filename]).splitlines()
-    paths = [os.path.join(directory, f) for f in filenames]
-    if not any([os.path.isfile(f) for f in paths]):
-        check_call(['unzip', zip_filename])
-    return [f for f in paths if os.path.isfile(f)]
-
-def sorted_numeric(strings):
-    return sorted(strings, key=lambda f: list(map(int, re.findall('[0-9]+', f))))
-
-def accumulate_paths(target, accum):
-    for path in target:
-        assert os.path.exists(path)
-        if os.path.isfile(path):
-            if path.endswith('.pdf'):
-                accumulate_paths([pdfimages(path)], accum)
-            elif path.endswith('.zip'):
-                accumulate_paths(unzip(path), accum)
-            elif re.match(r'.*\.(png|jpg|tif|dng)', path):
-                accum.append(path)
-        else:
-            assert os.path.isdir(path)
-            files = [os.path.join(path, base) for base in sorted_numeric(os.listdir(path))]
-            accumulate_paths(files, accum)
+    return dpi, outfiles
+
+def jobs(pages, outdir, options, manifest):
+    for page in pages:
+        key = engine.fingerprint(page)
+        entry = manifest.lookup(page.name, key)
+        if entry is not None:
+            page = page._replace(data=None)
+        yield page, key, entry, outdir, options
+
+# One process per CPU already; don't also split strips across threads.
+def single_threaded():
+    lib.THREADS = 1
+
+# results come back in input order: the PDF and the manifest follow it
+def collect(results, manifest, pdf, progress, failed):
+    for result in results:
+        progress.update(result)
+        page, key, entry = result.item[:3]
+        if not result.ok:
+            print('failed', page.name, file=sys.stderr)
+            print(result.error, file=sys.stderr)
+            failed.append(page.name)
+            continue
+        dpi, outfiles = result.value
+        if entry is None:
+            manifest.record(page.name, key, outfiles, dpi=dpi)
+        if pdf is not None:
+            for outfile in outfiles:
+                pdf.add_file(outfile, dpi)
 
 def run(args):
+    options = Options(args.dewarp, args.rotate, args.dpi)
     if args.single_file:
         lib.debug = True
         im = lib.imread(args.single_file)
-        _, out_images = process_image(im, dpi=args.dpi)
+        _, out_images = process_image(im, dpi=options.dpi, dewarp=options.dewarp,
+                                      rotate=options.rotate)
         for idx, outimg in enumerate(out_images):
             cv2.imwrite('out{}.png'.format(idx), outimg)
-        return
-
-    if args.concurrent:
-        pool = Pool(cpu_count())
-        map_fn = pool.map
-    else:
-        map_fn = map
-
-    files = []
-    accumulate_paths(args.indirs, files)
-    files = sorted_numeric(list(set(files)))
-    print('Files:', files)
-
-    for p in files:
-        d = os.path.dirname(p)
-        if not os.path.isdir(join(args.outdir, d)):
-            os.makedirs(join(args.outdir, d))
+        return 0
 
-    outfiles = map_fn(process_file, list(zip(files,
-                        [args.outdir] * len(files),
-                        [args.dpi] * len(files))))
+    os.makedirs(args.outdir, exist_ok=True)
+    manifest = engine.Manifest(join(args.outdir, 'manifest.jsonl'))
 
-    outfiles = sum(outfiles, [])
-    outfiles.sort(key=lambda f: list(map(int, re.findall('[0-9]+', f))))
-
-    # outtif = join(args.outdir, 'out.tif')
     outpdfpath = join(args.outdir, 'out.pdf')
+    pdf = None
     if not isfile(outpdfpath):
         print('making pdf:', outpdfpath)
-        pdf = FPDF(unit='in', format='Letter')
-        pdf.set_margins(0, 0, 0)
-        for outfile in outfiles:
-            print('.', end='')
-            sys.stdout.flush()
-            pdf.add_page()
-            im = cv2.imread(outfile)
-            inches_w = float(im.shape[1]) / args.dpi
-            inches_h = float(im.shape[0]) / args.dpi
-            x = (8.5 - inches_w) / 2
-            y = (11.0 - inches_h) / 2
-            pdf.image(outfile, w=inches_w, x=x, y=y)
-        print()
-
-        pdf.output(name=outpdfpath)
+        pdf = pdfwriter.PDFWriter(outpdfpath)
+
+    pages = jobs(sources.iter_pages(args.indirs), args.outdir, options, manifest)
+    if args.concurrent:
+        results = engine.run(process_file, pages, workers=args.jobs or None,
+                             chunksize=args.chunksize, initializer=single_threaded)
+    else:
+        results = engine.run(process_file, pages, workers=0)
+
+    progress = engine.Progress()
+    failed = []
+    try:
+        collect(results, manifest, pdf, progress, failed)
+    except BaseException:
+        if pdf is not None:
+            pdf.abort()
+        raise
+
+    print(progress.summary(), file=sys.stderr)
+    if pdf is not None:
+        pdf.close()
+    if failed:
+        # the PDF has the pages that succeeded; after fixing, delete it and
+        # rerun: done pages are skipped, then the PDF is made whole
+        print('{} input(s) failed, left out of the pdf:'.format(len(failed)), file=sys.stderr)
+        for name in failed:
+            print('  ' + name, file=sys.stderr)
+    return 1 if failed else 0
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Batch-process for PDF')
@@ -206,13 +218,15 @@ if __name__ == '__main__':
     parser.add_argument('-f', '--file', dest='single_file', action='store',
                         help="Run on single file instead")
     parser.add_argument('-c', '--concurrent', action='store_true',
-                        help="Run w/ threads.")
+                        help="Run w/ processes.")
+    parser.add_argument('-j', '--jobs', type=int, default=0,
+                        help="Worker processes with -c (default: one per CPU).")
+    parser.add_argument('--chunksize', type=int, default=1,
+                        help="Pages per task sent to a worker.")
     parser.add_argument('-d', '--dpi', action='store', type=int,
                         help="Force a particular DPI")
     parser.add_argument('--dewarp', action='store_true', help="Dewarp pages.")
     parser.add_argument('--rotate', action='store', type=int, choices=[0, 90, 180, 270],
                         default=0, help="Rotate CCW by 90, 180, or 270 degrees.")
 
-    global args
-    args = parser.parse_args()
-    run(args)
+    sys.exit(run(parser.parse_args()))
@@ -1,15 +1,20 @@
 from __future__ import print_function
 
 import cv2
+import logging
 import numpy as np
 import numpy.polynomial.polynomial as poly
 import sys
+from collections import OrderedDict
 
-from . import algorithm, inpaint, lib
+from . import algorithm, analysis, inpaint, labels, lib
 
 from .algorithm import fast_stroke_width
+from .letters import LetterTable
 from .lib import mean_std, normalize_u8, clip_u8, bool_to_u8, debug_imwrite
 
+log = logging.getLogger(__name__)
+
 cross33 = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
 rect33 = cv2.getStructuringElement(cv2.MORPH_RECT, (3, 3))
 rect55 = cv2.getStructuringElement(cv2.MORPH_RECT, (5, 5))
@@ -54,74 +59,95 @@ def teager(im):
         - padded[2:, 1:-1] * padded[:-2, 1:-1] \
         - padded[1:-1, 2:] * padded[1:-1, :-2])
 
-def ng2014_normalize(im):
-    IM = niblack(im, window_size=61, k=-0.2)
-    debug_imwrite('niblack.png', IM)
-    IM = cv2.erode(IM, rect33)
-    debug_imwrite('dilated.png', IM)
-
-    inpainted_min, inpainted_avg, modified = inpaint.inpaint_ng14(im, -IM)
+# The four directional passes of inpaint.inpaint_ng14_sweep, on threads:
+# per-pixel minimum and (floor) average of the passes, and the last pass
+# (bottom-up, right-to-left). mask: 1 in background, 0 where to inpaint.
+def inpaint_ng14(im, mask):
+    directions = [(False, False), (True, False), (False, True), (True, True)]
+    passes = lib.parallel_map(lambda d: inpaint.inpaint_ng14_sweep(im, mask, *d), directions)
+
+    inpainted_min = passes[0].copy()
+    total = passes[0].astype(np.uint16)
+    for p in passes[1:]:
+        np.minimum(inpainted_min, p, out=inpainted_min)
+        total += p
+    inpainted_avg = (total // 4).astype(np.uint8)
+
+    return inpainted_min, inpainted_avg, passes[-1]
+
+def ng2014_normalize(im, times=None):
+    with lib.timed('ng2014 niblack', times):
+        IM = niblack(im, window_size=61, k=-0.2)
+        debug_imwrite('niblack.png', IM)
+        IM = cv2.erode(IM, rect33)
+        debug_imwrite('dilated.png', IM)
+
+    with lib.timed('ng2014 inpaint', times):
+        inpainted_min, inpainted_avg, modified = inpaint_ng14(im, -IM)
     debug_imwrite('inpainted_min.png', inpainted_min)
     debug_imwrite('inpainted_avg.png', inpainted_avg)
 
-    bg = (inpainted_min & ~IM) | (modified & IM)
-    debug_imwrite('bg.png', bg)
-    bgp = (inpainted_avg & ~IM) | (modified & IM)
-    debug_imwrite('bgp.png', bg)
-
-    im_f = im.astype(float) + 1
-    bg_f = bg.astype(float) + 1
-    F = im_f / bg_f
-    N = clip_u8(255 * (F - F.min()))
-    debug_imwrite('N.png', N)
+    with lib.timed('ng2014 normalize', times):
+        bg = (inpainted_min & ~IM) | (modified & IM)
+        debug_imwrite('bg.png', bg)
+        bgp = (inpainted_avg & ~IM) | (modified & IM)
+        debug_imwrite('bgp.png', bg)
+
+        # F = (im + 1) / (bg + 1) has at most 256 x 256 values: evaluate it
+        # on the table of (im, bg) pairs and look the pixels up.
+        pairs = (im.astype(np.uint16) << 8) | bg
+        present = np.bincount(pairs.ravel(), minlength=1 << 16) > 0
+        im_f, bg_f = np.divmod(np.arange(1 << 16), 256)
+        F = (im_f + 1.0) / (bg_f + 1.0)
+        N = clip_u8(255 * (F - F[present].min()))[pairs]
+        debug_imwrite('N.png', N)
 
     return N, bgp
 
+# Components grouped by height; counts and areas per height via bincount.
 class HeightMap(object):
     def __init__(self, letters):
-        self.letters = sorted(letters, key=lambda l: l.h)
-
-        idx = 0
-        unique_values, unique_indices = np.unique([l.h for l in self.letters],
-                                                  return_index=True)
+        if not isinstance(letters, LetterTable):
+            letters = LetterTable.from_letters(letters)
+        self.letters = letters[np.argsort(letters.h, kind='stable')]
 
+        heights = self.letters.h
+        self.counts = np.bincount(heights)
+        self.areas = np.bincount(heights, weights=self.letters.areas)
         # map from height -> start of range containing height in letters
-        self.start_indices = [0]
-        for idx, v1, v2 in zip(unique_indices, np.concatenate([[0], unique_values]), unique_values):
-            self.start_indices.extend([idx] * (v2 - v1))
+        self.start_indices = np.concatenate([[0], np.cumsum(self.counts)])
 
-        self.start_indices.append(len(self.letters))
-
-        self.total_area = sum((letter.area() for letter in self.letters))
+        self.total_area = self.areas.sum()
 
     def max_height(self):
-        return self.letters[-1].h
+        return len(self.counts) - 1
 
     def height_area(self, height):
-        return sum((letter.area() for letter in self[height]))
+        return self.areas[height]
 
     # RC_j in paper
     def ratio_components(self, height):
-        return float(len(self[height])) / len(self.letters)
+        return float(self.counts[height]) / len(self.letters)
 
     # RP_j in paper
     def ratio_pixels(self, height):
-        return float(self.height_area(height)) / self.total_area
+        return float(self.areas[height]) / self.total_area
 
     def __getitem__(self, height):
         idx1 = self.start_indices[height]
         idx2 = self.start_indices[height + 1]
         return self.letters[idx1:idx2]
 
+# Morphological skeleton with the 3x3 cross: the union over n of E^n minus
+# its opening (E = erosion). E^n keeps the pixels with L1 distance to the
+# background > n, so a pixel is on the skeleton iff its distance is maximal
+# in its 4-neighbourhood. One distance transform instead of an opening and
+# an erosion per unit of stroke radius.
 def skeleton(im):
     im_inv = ~im
-    eroded = im_inv.copy()
-    skel = np.zeros(im.shape, dtype=im.dtype)
-    while eroded.max() == im_inv.max():  # presumably 255
-        skel |= eroded & ~cv2.morphologyEx(eroded, cv2.MORPH_OPEN, cross33)
-        eroded = cv2.erode(eroded, cross33)
-
-    return ~skel
+    dist = cv2.distanceTransform(im_inv, cv2.DIST_L1, 3)
+    ridge = cv2.dilate(dist, cross33) <= dist
+    return ~bool_to_u8(ridge & (im_inv > 0))
 
 def gradient(im):
     im_inv = ~im
@@ -143,54 +169,63 @@ def dilate_square(im, size):
     return cv2.dilate(cv2.dilate(im, horiz), vert)
 
 def gradient2(im):
-    im_inv = ~im
-    mins = erode_square(im_inv, 15)
-    maxes = dilate_square(im_inv, 15)
+    out = np.empty(im.shape, dtype=np.uint8)
+    im_h = im.shape[0]
+    margin = 15 // 2
 
-    diff = maxes - mins
+    def strip(r0, r1):
+        a0, a1 = max(r0 - margin, 0), min(r1 + margin, im_h)
+        im_inv = ~im[a0:a1]
+        mins = erode_square(im_inv, 15)
+        maxes = dilate_square(im_inv, 15)
 
-    return bool_to_u8(diff < 50)
+        diff = maxes - mins
+        out[r0:r1] = bool_to_u8(diff[r0 - a0:r1 - a0] < 50)
+
+    lib.map_strips(strip, im_h)
+    return out
 
 def sauvola_noisy(im, *args, **kwargs):
-    return sauvola(im, *args, **kwargs) | gradient2(im)
+    result = sauvola(im, *args, **kwargs)
+    result |= gradient2(im)
+    return result
 
+# times: stage timings are added to this dict (and logged at debug level).
+# min_contrast: return None as soon as the contrast C turns out <= this,
+# before the stroke width and local Niblack stages.
 # @lib.timeit
-def ntirogiannis2014(im):
+def ntirogiannis2014(im, times=None, min_contrast=None):
     lib.debug_prefix.append('ng2014')
 
     debug_imwrite('input.png', im)
     im_h, _ = im.shape
-    N, BG_prime = ng2014_normalize(im)
-    O = otsu(N)
+    N, BG_prime = ng2014_normalize(im, times)
+    with lib.timed('ng2014 otsu', times):
+        O = otsu(N)
 
     debug_imwrite('O.png', O)
-    letters = algorithm.all_letters(O)
-    height_map = HeightMap(letters)
+    with lib.timed('ng2014 components', times):
+        letters = algorithm.all_letters(O)
+        height_map = HeightMap(letters)
 
     ratio_sum = 0
     for h in range(1, height_map.max_height() + 1):
-        if len(height_map[h]) == 0: continue
+        if height_map.counts[h] == 0: continue
         ratio_sum += height_map.ratio_pixels(h) / height_map.ratio_components(h)
         if ratio_sum > 1:
             break
 
     min_height = h
 
-    if lib.debug: print('Accept components only >= height', h)
+    log.debug('Accept components only >= height %s', h)
 
     OP = O.copy()
-    for h in range(1, min_height):
-        for letter in height_map[h]:
-            sliced = letter.slice(OP)
-            np.place(sliced, letter.raster(), 255)
+    small = letters.labels[letters.h < min_height]
+    OP[labels.mask(letters.label_map, small, len(letters) + 1)] = 255
     debug_imwrite('OP.png', OP)
 
-    strokes = fast_stroke_width(OP)
-    debug_imwrite('strokes.png', normalize_u8(strokes.clip(0, 10)))
-    SW = int(round(strokes.sum() / np.count_nonzero(strokes)))
-    if lib.debug: print('SW =', SW)
-
-    S = skeleton(OP)
+    with lib.timed('ng2014 skeleton', times):
+        S = skeleton(OP)
     debug_imwrite('S.png', S)
 
     S_inv = ~S
@@ -203,11 +238,11 @@ def ntirogiannis2014(im):
     # FG = (S_inv & im).astype(np.int32)
     # FG_avg = FG.sum() / float(FG_count)
     # FG_std = np.sqrt(((S_inv_32 & (FG - FG_avg)) ** 2).sum() / float(FG_count))
-    if lib.debug: print('FG:', FG_avg, FG_std)
+    log.debug('FG: %s %s', FG_avg, FG_std)
 
     BG_avg = BG_prime.mean()
     BG_std = BG_prime.std()
-    if lib.debug: print('BG:', BG_avg, BG_std)
+    log.debug('BG: %s %s', BG_avg, BG_std)
 
     if FG_avg + FG_std != 0:
         C = -50 * np.log10((FG_avg + FG_std) / (BG_avg - BG_std))
@@ -216,20 +251,31 @@ def ntirogiannis2014(im):
         C = -50 * np.log10((2.5) / (BG_avg - BG_std))
         k = -0.2 - 0.1 * C / 10
 
-    if lib.debug: print('niblack:', C, k)
-    local = niblack(N, window_size=(2 * SW) | 1, k=k)
+    log.debug('niblack: %s %s', C, k)
+    if min_contrast is not None and C <= min_contrast:
+        log.debug('Contrast %.1f <= %s, giving up', C, min_contrast)
+        lib.debug_prefix.pop()
+        return None
+
+    with lib.timed('ng2014 stroke width', times):
+        strokes = fast_stroke_width(OP)
+    debug_imwrite('strokes.png', normalize_u8(strokes.clip(0, 10)))
+    SW = int(round(strokes.sum() / np.count_nonzero(strokes)))
+    log.debug('SW = %s', SW)
+
+    with lib.timed('ng2014 local niblack', times):
+        local = niblack(N, window_size=(2 * SW) | 1, k=k)
     debug_imwrite('local.png', local)
-    local_CCs = algorithm.all_letters(local)
+    with lib.timed('ng2014 local components', times):
+        local_CCs = algorithm.all_letters(local)
 
     # NB: paper uses OP here, which results in neglecting all small components.
+    # fraction of each component that is also foreground in O
     O_inv = ~O
-    O_inv_32 = O_inv.astype(np.int8, copy=False).astype(np.int32).astype(np.uint32, copy=False)
-    label_map_O_inv = O_inv_32 & local_CCs[0].label_map
-    CO_inv = np.zeros(im.shape, dtype=np.uint8)
-    for cc in local_CCs:
-        if np.count_nonzero(cc.slice(label_map_O_inv) == cc.label) / float(cc.area()) >= C / 100:
-            CO_sliced = cc.slice(CO_inv)
-            np.place(CO_sliced, cc.raster(), 255)
+    n_labels = len(local_CCs) + 1
+    in_O = labels.count(local_CCs.label_map, n_labels, mask=O_inv)[local_CCs.labels]
+    selected = local_CCs.labels[in_O / local_CCs.areas.astype(np.float64) >= C / 100]
+    CO_inv = bool_to_u8(labels.mask(local_CCs.label_map, selected, n_labels))
 
     CO = ~CO_inv
     debug_imwrite('CO.png', CO)
@@ -243,33 +289,43 @@ def ntirogiannis2014(im):
     return FB
 
 # Sometimes ng2014 returns bad results with tons of black pixels.
-# Fall back to sauvola in that case.
-def ng2014_fallback(im):
-    result = ntirogiannis2014(im)
-    if result.mean() > 180:
+# Fall back to sauvola in that case. With contrast C <= 0 every local
+# component passes the C / 100 selection, so the result is the local Niblack
+# map with its background noise: that is decided before the costly stages.
+def ng2014_fallback(im, times=None):
+    result = ntirogiannis2014(im, times, min_contrast=0)
+    if result is not None and result.mean() > 180:
         return result
     else:
-        return sauvola(im)
+        with lib.timed('sauvola fallback', times):
+            return sauvola(im)
+
+# im > thresh(means, stds), strip by strip straight into the uint8 output;
+# see lib.mean_std_rows.
+def local_threshold(im, window_size, thresh):
+    out = np.empty(im.shape, dtype=np.uint8)
+
+    def strip(r0, r1):
+        means, stds = lib.mean_std_rows(im, window_size, r0, r1)
+        out[r0:r1] = bool_to_u8(im[r0:r1] > thresh(means, stds))
+
+    lib.map_strips(strip, im.shape[0])
+    return out
 
 # @lib.timeit
 def niblack(im, window_size=61, k=0.2):
-    means, stds = mean_std(im, window_size)
-    thresh = means + k * stds
-
-    return bool_to_u8(im > thresh)
+    return local_threshold(im, window_size, lambda means, stds: means + k * stds)
 
 # @lib.timeit
 def sauvola(im, window_size=61, k=0.2):
     assert im.dtype == np.uint8
-    means, stds = mean_std(im, window_size)
-    thresh = means * (1 + k * ((stds / 127) - 1))
-
-    return bool_to_u8(im > thresh)
+    return local_threshold(im, window_size,
+                           lambda means, stds: means * (1 + k * ((stds / 127) - 1)))
 
 def kittler(im):
     h, g = np.histogram(im.ravel(), 256, [0, 256])
-    h = h.astype(np.float)
-    g = g.astype(np.float)
+    h = h.astype(np.float64)
+    g = g.astype(np.float64)
     g = g[:-1]
     c = np.cumsum(h)
     m = np.cumsum(h * g)
@@ -299,7 +355,7 @@ def roth(im, s=51, t=0.8):
 def kamel(im, s=None, T=25):
     im_h, im_w = im.shape
     if s is None or s <= 0:
-        s = im_h / 200
+        s = im_h // 200
     size = 2 * s + 1
     means = cv2.blur(im, (size, size), borderType=cv2.BORDER_REFLECT)
     padded = np.pad(means, (s, s), 'edge')
@@ -340,7 +396,7 @@ def yan(im, alpha=0.4):
     candidates, = np.where(run_length_hist[argmax:argmax+3] >
                            run_length_hist[argmax] * .8)
     stroke_width = candidates.max() + argmax
-    print('stroke width:', stroke_width)
+    log.debug('stroke width: %s', stroke_width)
 
     size = 2 * stroke_width + 1
     means = cv2.blur(im, (size, size),
@@ -411,7 +467,7 @@ def lu2010(im):
     # im_bg = polynomial_background_easy(im_bg_row.T).T
     # im_bg = im_bg.clip(0.1, 255)
     IM = cv2.erode(niblack(im, window_size=61, k=0.2), rect33)
-    inpainted, modified = inpaint.inpaint_ng14(im, -IM)
+    inpainted, _, modified = inpaint_ng14(im, -IM)
     im_bg = (inpainted & ~IM) | (modified & IM)
     im_bg = im_bg.astype(np.float32).clip(0.1, 255)
     debug_imwrite('bg.png', im_bg)
@@ -438,7 +494,7 @@ def lu2010(im):
     H, _ = np.histogram(nonzero_distances_row(E_inv), np.arange(im_h / 100))
     H[1] = 0  # don't use adjacent pix
     W = H.argmax()
-    print('stroke width:', W)
+    log.debug('stroke width: %s', W)
     size = 2 * W
     N_min = W
 
@@ -500,31 +556,52 @@ def premultiply(im):
 def grayscale(im, algorithm=CIELab_gray):
     if len(im.shape) > 2:
         if im.shape[2] == 4:
-            return algorithm(premultiply(im))
+            compute = lambda: algorithm(premultiply(im))
         else:
-            return algorithm(im)
+            compute = lambda: algorithm(im)
+        return analysis.memo_pixelwise('gray', im, (analysis.callable_key(algorithm),), compute)
     else:
         return im
 
 def binarize(im, algorithm=adaptive_otsu, gray=CIELab_gray, resize=1.0):
     if (im + 1 < 2).all():  # black and white
         return im
-    else:
+
+    def compute(im=im):
         if resize < 0.99 or resize > 1.01:
             im = cv2.resize(im, (0, 0), None, resize, resize)
         return algorithm(grayscale(im, algorithm=gray))
 
+    params = (analysis.callable_key(algorithm), analysis.callable_key(gray), resize)
+    return analysis.memo('binarize', im, params, compute)
+
+# Every algorithm as gray -> black text on white, with the parameters the
+# pipeline uses. bench_binarize.py times them and picks one per book;
+# dewarp.BINARIZE names the one used for line detection.
+ALGORITHMS = OrderedDict([
+    ('otsu', otsu),
+    ('kittler', kittler),
+    ('adaptive_otsu', adaptive_otsu),
+    ('niblack', lambda im: niblack(im, k=-0.2)),
+    ('sauvola', lambda im: sauvola(im, k=0.1)),
+    ('sauvola_noisy', lambda im: sauvola_noisy(im, k=0.1)),
+    ('roth', lambda im: ~roth(im)),  # these three mark text white
+    ('su2013', lambda im: ~su2013(im)),
+    ('retinex', lambda im: ~retinex(im)),
+    ('kamel', kamel),
+    ('yan', yan),
+    ('lu2010', lu2010),
+    ('ng2014', ntirogiannis2014),
+    ('ng2014_fallback', ng2014_fallback),
+])
+
 def go(argv):
     im = grayscale(lib.imread(argv[1]))
     lib.debug = True
     lib.debug_prefix = ['binarize']
     lib.debug_imwrite('gradient2.png', gradient2(im))
-    lib.debug_imwrite('sauvola_noisy.png', sauvola_noisy(im, k=0.1))
-    lib.debug_imwrite('adaptive_otsu.png', binarize(im, algorithm=adaptive_otsu))
-    lib.debug_imwrite('ng2014.png', binarize(im, algorithm=ntirogiannis2014))
-    lib.debug_imwrite('yan.png', binarize(im, algorithm=yan))
-    lib.debug_imwrite('sauvola.png', sauvola(im, k=0.1))
-    lib.debug_imwrite('retinex.png', binarize(im, algorithm=retinex))
+    for name, algorithm in ALGORITHMS.items():
+        lib.debug_imwrite('{}.png'.format(name), binarize(im, algorithm=algorithm))
 
 if __name__ == '__main__':
     go(sys.argv)
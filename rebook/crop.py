@@ -1,10 +1,13 @@
 from __future__ import division, print_function
 
 import cv2
+import logging
 import numpy as np
 
 from . import algorithm, collate, lib
 
+log = logging.getLogger(__name__)
+
 def split_lines(lines, all_lines=None):
     # Maximize horizontal separation
     # sorted by starting x value, ascending).
@@ -16,9 +19,9 @@ def split_lines(lines, all_lines=None):
     argmax = -1
     for idx, line in enumerate(lines[2:-3], 2):
         if line.right() - line.left() > 2000:
-            print('line:', line.crop())
+            log.debug('line: %s', line.crop())
             for l in line:
-                print(l)
+                log.debug('%s', l)
         current_r = max(current_r, line.right())
         x2 = lines[idx + 1].left()
         if lib.debug:
@@ -28,7 +31,7 @@ def split_lines(lines, all_lines=None):
             quantity = x2 - current_r
             argmax = idx
 
-    if lib.debug: print('split:', argmax, 'out of', len(lines), '@', current_r)
+    log.debug('split: %d out of %d @ %s', argmax, len(lines), current_r)
 
     line_groups = [l for l in (lines[:argmax + 1], lines[argmax + 1:]) if l]
 
@@ -42,9 +45,9 @@ def split_lines(lines, all_lines=None):
             all_lines = sorted(all_lines, key=lambda line: line.left())
             lefts = [line.left() for line in all_lines]
             middle_idx = np.searchsorted(lefts, boundary)
-            print('boundary:', boundary)
-            print('left:', lefts[:middle_idx])
-            print('right:', lefts[middle_idx:])
+            log.debug('boundary: %s', boundary)
+            log.debug('left: %s', lefts[:middle_idx])
+            log.debug('right: %s', lefts[middle_idx:])
             return line_groups, [all_lines[:middle_idx], all_lines[middle_idx:]]
 
 def filter_position(AH, im, lines, split):
@@ -73,19 +76,19 @@ def crop(im, bw, split=True):
     all_letters = algorithm.all_letters(bw)
     AH = algorithm.dominant_char_height(bw, letters=all_letters)
     letters = algorithm.filter_size(AH, bw, letters=all_letters)
-    all_lines = collate.collate_lines(AH, letters)
+    all_lines = collate.collate_lines(AH, list(letters))
     combined = algorithm.combine_underlined(AH, bw, all_lines, all_letters)
     lines = algorithm.remove_stroke_outliers(bw, combined)
 
     if not lines:
-        print('WARNING: no lines in image.')
+        log.warning('no lines in image.')
         return AH, []
 
     lines = filter_position(AH, bw, lines, split)
     lines = [line for line in lines if not np.all(line.crop().apply(bw) == 255)]
 
     if not lines:
-        print('WARNING: eliminated all lines.')
+        log.warning('eliminated all lines.')
         return AH, []
 
     if split and im_w > im_h:  # two pages
@@ -2,22 +2,27 @@ from __future__ import print_function
 
 import cv2
 import itertools
+import json
+import logging
 import numpy as np
 import sys
+import time
 
 from math import atan2, pi
 from numpy import dot, newaxis
 from numpy.linalg import norm, inv, solve
 from numpy.polynomial import Polynomial as Poly
-from scipy import optimize as opt
-from scipy import interpolate
-from scipy.linalg import block_diag
-from skimage.measure import ransac
 
-from . import algorithm, binarize, collate, crop, lib, newton
+from . import algorithm, analysis, binarize, collate, crop, lib, newton, robust, telemetry
 from .geometry import Crop
+from .letters import Letter, TextLine
 from .lib import RED, GREEN, BLUE, draw_circle, draw_line
 
+# scipy takes half a second to import; it is imported where it is used, so
+# line detection alone (get_AH_lines, the Scantailor bridge) doesn't pay it.
+
+log = logging.getLogger(__name__)
+
 """
 focal length f = 3270.5 pixels
 Samsung S22U, 3230
@@ -25,6 +30,16 @@ Samsung S22U, 3230
 """
 f = 3230
 THRESHOLD_MULT = 1.0
+# minimum mesh width in output pixels
+MIN_POINTS_W = 1800
+# run_retry stops at a final residual norm below this (pixels)
+GOOD_NORM = 120
+# binarization for line detection, a name in binarize.ALGORITHMS; pick one
+# per book with bench_binarize.py --select
+BINARIZE = 'sauvola_noisy'
+
+def binarize_lines(im, resize=1.0):
+    return binarize.binarize(im, algorithm=binarize.ALGORITHMS[BINARIZE], resize=resize)
 
 # Camera parameter object - alleen voor debug visualisatie
 class CameraParams:
@@ -52,22 +67,14 @@ def arc_length_points(xs, ys, n_points):
     arc_points = np.stack((xs, ys))
     arc_lengths = norm(np.diff(arc_points, axis=1), axis=0)
     cumulative_arc = np.hstack([[0], np.cumsum(arc_lengths)])
+    from scipy import interpolate
     D = interpolate.interp1d(cumulative_arc, arc_points, assume_sorted=True)
 
     total_arc = cumulative_arc[-1]
-    if lib.debug: print('total D arc length:', total_arc)
+    log.debug('total D arc length: %s', total_arc)
     s_domain = np.linspace(0, total_arc, n_points)
     return D(s_domain), total_arc
 
-# x = my + b model weighted t
-class LinearXModel(object):
-    def estimate(self, data):
-        self.params = Poly.fit(data[:, 1], data[:, 0], 1, domain=[-1, 1])
-        return True
-
-    def residuals(self, data):
-        return abs(self.params(data[:, 1]) - data[:, 0])
-
 def side_lines(AH, lines, index_numbers=None):
     im_h, _ = bw.shape
 
@@ -88,14 +95,15 @@ def side_lines(AH, lines, index_numbers=None):
             index_y_positions = np.linspace(0, im_h, len(index_x_positions))
             right_bounds = np.column_stack([index_x_positions, index_y_positions])
             
-            if lib.debug:
-                print(f"Gebruikt {len(index_numbers)} indexnummers voor rechterkantlijn bepaling (mediaan x={median_x:.1f})")
+            log.debug('Gebruikt %d indexnummers voor rechterkantlijn bepaling (mediaan x=%.1f)', len(index_numbers), median_x)
 
     vertical_lines = []
     debug = cv2.cvtColor(bw, cv2.COLOR_GRAY2BGR)
-    for coords in [left_bounds, right_bounds]:
-        model, inliers = ransac(coords, LinearXModel, 3, AH / 10.0 * THRESHOLD_MULT)
-        vertical_lines.append(model.params)
+    # x = my + b
+    sides = [left_bounds, right_bounds]
+    fits = robust.fit_polys(sides, 1, 3, AH / 10.0 * THRESHOLD_MULT, transpose=True)
+    for coords, (model, inliers) in zip(sides, fits):
+        vertical_lines.append(model)
         for p, inlier in zip(coords, inliers):
             draw_circle(debug, p, 4, color=GREEN if inlier else RED)
 
@@ -110,14 +118,6 @@ def estimate_vanishing(AH, lines, index_numbers=None):
     vy, = (p_left - p_right).roots()
     return np.array((p_left(vy), vy))
 
-class PolyModel5(object):
-    def estimate(self, data):
-        self.params = Poly.fit(data[:, 0], data[:, 1], 5, domain=[-1, 1])
-        return True
-
-    def residuals(self, data):
-        return abs(self.params(data[:, 0]) - data[:, 1])
-
 def trace_baseline(im, line, color=BLUE):
     domain = np.linspace(line.left() - 100, line.right() + 100, 200)
     points = np.vstack([domain, line.model(domain)]).T
@@ -140,9 +140,9 @@ def merge_lines(AH, lines):
                 and abs(integ(x_max) - integ(x_min)) / overlap < AH / 8.0:
             out_lines[-1].merge(line)
             points = np.array([letter.base_point() for letter in out_lines[-1]])
-            new_model, inliers = ransac(points, PolyModel5, 10, AH / 15.0)
+            new_model, inliers = robust.fit_poly(points, 5, 10, AH / 15.0)
             out_lines[-1].compress(inliers)
-            out_lines[-1].model = new_model.params
+            out_lines[-1].model = new_model
         else:
             out_lines.append(line)
 
@@ -151,29 +151,25 @@ def merge_lines(AH, lines):
     #     trace_baseline(debug, l, BLUE)
     # lib.debug_imwrite('merged.png', debug)
 
-    if lib.debug: print('original lines:', len(lines), 'merged lines:', len(out_lines))
+    log.debug('original lines: %d merged lines: %d', len(lines), len(out_lines))
     return out_lines
 
 # @lib.timeit
 def remove_outliers(im, AH, lines, line_len):
     debug = cv2.cvtColor(im, cv2.COLOR_GRAY2RGB)
 
-    result = []
-    for l in lines:
-        if len(l) < line_len: continue
-
-        points = np.array([letter.base_point() for letter in l])
-        min_samples = points.shape[0]//2+1
-        model, inliers = ransac(data=points, model_class=PolyModel5, min_samples=min_samples, residual_threshold=AH / 10.0 * THRESHOLD_MULT)
-        poly = model.params
-        l.model = poly
+    result = [l for l in lines if len(l) >= line_len]
+    all_points = [l.base_points() for l in result]
+    fits = robust.fit_polys(all_points, 5, [len(points) // 2 + 1 for points in all_points],
+                            AH / 10.0 * THRESHOLD_MULT)
+    for l, points, (model, inliers) in zip(result, all_points, fits):
+        l.model = model
         # trace_baseline(debug, l, BLUE)
         for p, is_in in zip(points, inliers):
             color = GREEN if is_in else RED
             draw_circle(debug, p, 4, color=color)
 
         l.compress(inliers)
-        result.append(l)
 
     for l in result:
         draw_circle(debug, l.original_letters[0].left_mid(), 6, BLUE, -1)
@@ -183,13 +179,19 @@ def remove_outliers(im, AH, lines, line_len):
     return merge_lines(AH, result)
 
 # @lib.timeit
-def correct_geometry(orig, mesh, interpolation=cv2.INTER_LINEAR, f_points=[], index_numbers=None):
+def remap_mesh(orig, mesh, interpolation=cv2.INTER_LINEAR):
     # coordinates (u, v) on mesh -> mesh[u][v] = (x, y) in distorted image
     mesh32 = mesh.astype(np.float32)
     xmesh, ymesh = mesh32[:, :, 0], mesh32[:, :, 1]
     conv_xmesh, conv_ymesh = cv2.convertMaps(xmesh, ymesh, cv2.CV_16SC2)
-    out_0 = cv2.remap(orig, conv_xmesh, conv_ymesh, interpolation=interpolation,
-                    borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+    return cv2.remap(orig, conv_xmesh, conv_ymesh, interpolation=interpolation,
+                     borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0))
+
+def correct_geometry(orig, mesh, interpolation=cv2.INTER_LINEAR, f_points=[], index_numbers=None,
+                     lines=None):
+    mesh32 = mesh.astype(np.float32)
+    xmesh, ymesh = mesh32[:, :, 0], mesh32[:, :, 1]
+    out_0 = remap_mesh(orig, mesh32, interpolation=interpolation)
 
     points = []
     if f_points:
@@ -208,20 +210,27 @@ def correct_geometry(orig, mesh, interpolation=cv2.INTER_LINEAR, f_points=[], in
             [vi_center, ui_left],
             [vi_center, ui_right],
         ]
-        if lib.debug: 
-            print('[{}] WARNING: Using dummy anchor points for fine_dewarp'.format('/'.join(lib.debug_prefix)))
+        log.debug('Using dummy anchor points for fine_dewarp')
     # -----------------------------------------------------------------------
 
-    im = binarize.binarize(out_0, algorithm=lambda im: binarize.sauvola_noisy(im, k=0.1))
-    AH, lines, underlines, all_letters = get_AH_lines_fine(im)
+    # lines: coarse-pass lines in orig coordinates; carried through the mesh
+    # so only the line regions need binarizing and labelling again.
+    fine = None
+    if lines and INCREMENTAL_FINE:
+        fine = get_AH_lines_incremental(out_0, mesh32, lines)
+
+    if fine is None:
+        im = binarize_lines(out_0)
+        AH, lines, underlines, all_letters = get_AH_lines_fine(im)
+    else:
+        im, AH, lines, underlines, all_letters = fine
     
     # --- GRACEFUL DEGRADE: fallback bij fine_dewarp failure ---------------
     try:
         out = algorithm.fine_dewarp(out_0, im, AH, lines, underlines, all_letters, points, index_numbers, f_points)
     except (ValueError, IndexError) as e:
         if 'axes don\'t match array' in str(e) or 'need at least one array to concatenate' in str(e):
-            if lib.debug:
-                print('[{}] fine_dewarp failed ({}): returning coarse remap'.format('/'.join(lib.debug_prefix), str(e)))
+            log.warning('fine_dewarp failed (%s): returning coarse remap', e)
             out = (out_0, None)  # Consistent tuple format
         else:
             raise
@@ -231,12 +240,17 @@ def correct_geometry(orig, mesh, interpolation=cv2.INTER_LINEAR, f_points=[], in
     return out
 
 def get_AH_lines(im):
+    AH, lines, all_lines, _, letters = get_AH_line_sets(im)
+    return AH, lines, all_lines, letters
+
+# get_AH_lines plus filtered: the candidates before the 10-letter cut, which
+# the fine pass reuses (fine_pass_lines)
+def get_AH_line_sets(im):
     all_letters = algorithm.all_letters(im)
     AH = algorithm.dominant_char_height(im, letters=all_letters)
-    if lib.debug: print('AH =', AH)
+    log.debug('AH = %s', AH)
     letters = algorithm.filter_size(AH, im, letters=all_letters)
     all_lines = algorithm.collate_lines(AH, letters)
-    # all_lines = collate.collate_lines(AH, letters)
     all_lines.sort(key=lambda l: l[0].y)
 
     combined = algorithm.combine_underlined(AH, im, all_lines, all_letters)
@@ -259,15 +273,44 @@ def get_AH_lines(im):
                         tuple(l2.base_point().astype(int)), BLUE, 2)
         lib.debug_imwrite('all_lines.png', debug)
 
-    return AH, lines, all_lines, letters
+    return AH, lines, all_lines, filtered, letters
+
+# lines handed to the fine pass: the coarse lines plus the short ones that
+# get_AH_lines_fine would keep (it cuts at 4 letters instead of 10).
+# remove_outliers compresses and merges the candidates in place, so filtered
+# holds the coarse lines themselves and lines merged into them: keep each
+# line once, and no short line whose letters are already taken.
+def fine_pass_lines(lines, filtered):
+    result, seen, taken = [], set(), set()
+    for line in lines + [l for l in filtered if 4 <= len(l) < 10]:
+        letter_ids = set(map(id, line))
+        if id(line) in seen or letter_ids & taken: continue
+        seen.add(id(line))
+        taken |= letter_ids
+        result.append(line)
+    return result
+
+# lines of an analysed page at offset, as seen in the image scaled by k.
+# Only the letter boxes carry over (no label map): enough for the
+# incremental fine pass, which maps letter corners through the mesh.
+def scale_lines(lines, k, offset=(0, 0)):
+    ox, oy = offset
+    result = []
+    for line in lines:
+        letters = []
+        for letter in line:
+            x, y, w, h, area = letter.stats[:5]
+            stats = np.array(((x + ox) * k, (y + oy) * k, w * k, h * k, area * k * k))
+            letters.append(Letter(letter.label, None, stats, (np.asarray(letter.centroid) + offset) * k))
+        result.append(TextLine(letters))
+    return result
 
 def get_AH_lines_fine(im):
     all_letters = algorithm.all_letters(im)
     AH = algorithm.dominant_char_height(im, letters=all_letters)
-    if lib.debug: print('Fine AH =', AH)
+    log.debug('Fine AH = %s', AH)
     letters = algorithm.filter_size(AH, im, letters=all_letters)
     all_lines = algorithm.collate_lines(AH, letters)
-    # all_lines = collate.collate_lines(AH, letters)
     all_lines.sort(key=lambda l: l[0].y)
 
     combined = algorithm.combine_underlined(AH, im, all_lines, all_letters)
@@ -281,6 +324,135 @@ def get_AH_lines_fine(im):
 
     return AH, lines, underlines, all_letters
 
+# Reuse coarse-pass lines in the fine pass instead of detecting from scratch.
+INCREMENTAL_FINE = True
+
+# mesh[v, u] = (x, y) in the source image; returns (u, v) for each source point
+# (nan outside the mesh). Nearest node of a subsampled mesh, then Newton steps
+# on the bilinear interpolation of the mesh.
+def invert_mesh(mesh, points, step=8, n_iter=8):
+    mesh = mesh.astype(np.float64)
+    mesh_h, mesh_w = mesh.shape[:2]
+    sample = mesh[::step, ::step]
+    from scipy import spatial
+    tree = spatial.cKDTree(sample.reshape(-1, 2))
+    _, idx = tree.query(points)
+    v, u = np.unravel_index(idx, sample.shape[:2])
+    u, v = (u * step).astype(np.float64), (v * step).astype(np.float64)
+    # collapsed mesh cells have no inverse: those points come back nan
+    singular = np.zeros(len(u), dtype=bool)
+
+    for _ in range(n_iter):
+        u0 = np.clip(np.floor(u), 0, mesh_w - 2).astype(int)
+        v0 = np.clip(np.floor(v), 0, mesh_h - 2).astype(int)
+        fu, fv = (u - u0)[:, newaxis], (v - v0)[:, newaxis]
+        p00, p01 = mesh[v0, u0], mesh[v0, u0 + 1]
+        p10, p11 = mesh[v0 + 1, u0], mesh[v0 + 1, u0 + 1]
+        P = (1 - fv) * ((1 - fu) * p00 + fu * p01) + fv * ((1 - fu) * p10 + fu * p11)
+        dP_du = (1 - fv) * (p01 - p00) + fv * (p11 - p10)
+        dP_dv = (1 - fu) * (p10 - p00) + fu * (p11 - p01)
+        # 2x2 solve by Cramer's rule, guarded against det ~ 0
+        det = dP_du[:, 0] * dP_dv[:, 1] - dP_dv[:, 0] * dP_du[:, 1]
+        singular |= ~(np.abs(det) > 1e-9)
+        det[singular] = 1.0
+        r = points - P
+        du = (r[:, 0] * dP_dv[:, 1] - dP_dv[:, 0] * r[:, 1]) / det
+        dv = (dP_du[:, 0] * r[:, 1] - r[:, 0] * dP_du[:, 1]) / det
+        du[singular] = dv[singular] = 0.0
+        u, v = u + du, v + dv
+
+    result = np.stack([u, v], axis=1)
+    outside = (u < 0) | (u > mesh_w - 1) | (v < 0) | (v > mesh_h - 1)
+    result[outside | singular] = np.nan
+    return result
+
+# Map lines into the dewarped image, binarize and label only a band around
+# each line, then assign the new components to the mapped lines.
+# Returns None if too little survives; caller falls back to get_AH_lines_fine.
+def get_AH_lines_incremental(out_0, mesh, lines, min_lines=3):
+    im_h, im_w = out_0.shape[:2]
+
+    letter_points = [
+        np.concatenate([letter.corners() for letter in line]).astype(np.float64)
+        for line in lines
+    ]
+    n_points = [len(points) for points in letter_points]
+    mapped = invert_mesh(mesh, np.concatenate(letter_points))
+    mapped = np.split(mapped, np.cumsum(n_points)[:-1])
+
+    # corners -> (top-left, bottom-left, top-right, bottom-right) per letter
+    bands = []
+    for points in mapped:
+        quads = points.reshape(-1, 4, 2)
+        quads = quads[np.isfinite(quads).all(axis=(1, 2))]
+        if len(quads) < 2: continue
+        heights = quads[:, [1, 3], 1].mean(axis=1) - quads[:, [0, 2], 1].mean(axis=1)
+        # a mesh that folds over can map a line upside down: not usable
+        if not np.median(heights) > 0: continue
+        base = np.stack([quads[:, :, 0].mean(axis=1), quads[:, [1, 3], 1].mean(axis=1)], axis=1)
+        bands.append((base, np.median(heights)))
+
+    if len(bands) < min_lines:
+        return None
+
+    line_AH = np.median([h for _, h in bands])
+    if not np.isfinite(line_AH) or line_AH <= 0:
+        return None
+    gray = binarize.grayscale(out_0)
+    im = np.full((im_h, im_w), 255, dtype=np.uint8)
+    # sauvola window needs context beyond the band itself
+    margin = int(line_AH * 2)
+    for base, _ in bands:
+        x0 = int(max(base[:, 0].min() - 2 * line_AH, 0))
+        x1 = int(min(base[:, 0].max() + 2 * line_AH, im_w))
+        y0 = int(max(base[:, 1].min() - 2 * line_AH, 0))
+        y1 = int(min(base[:, 1].max() + 2 * line_AH, im_h))
+        if x1 - x0 < 2 or y1 - y0 < 2: continue
+        px0, py0 = max(x0 - margin, 0), max(y0 - margin, 0)
+        px1, py1 = min(x1 + margin, im_w), min(y1 + margin, im_h)
+        if not (px0 <= x0 and x1 <= px1 and py0 <= y0 and y1 <= py1): continue
+        bw_crop = binarize.ALGORITHMS[BINARIZE](gray[py0:py1, px0:px1])
+        im[y0:y1, x0:x1] &= bw_crop[y0 - py0:y1 - py0, x0 - px0:x1 - px0]
+
+    # outside the bands im is blank, so labelling only sees the line regions
+    all_letters = algorithm.all_letters(im)
+    AH = algorithm.dominant_char_height(im, letters=all_letters)
+    log.debug('Incremental AH = %s', AH)
+    letters = algorithm.filter_size(AH, im, letters=all_letters)
+    if not letters:
+        return None
+
+    # assign each letter to the closest mapped baseline
+    letter_base = letters.base_points()
+    best_dist = np.full(len(letters), np.inf)
+    best_line = np.full(len(letters), -1)
+    for idx, (base, _) in enumerate(bands):
+        order = np.argsort(base[:, 0])
+        xs, ys = base[order, 0], base[order, 1]
+        in_domain = (letter_base[:, 0] >= xs[0] - AH) & (letter_base[:, 0] <= xs[-1] + AH)
+        dist = np.abs(np.interp(letter_base[:, 0], xs, ys) - letter_base[:, 1])
+        dist[~in_domain] = np.inf
+        closer = dist < best_dist
+        best_dist[closer] = dist[closer]
+        best_line[closer] = idx
+
+    new_lines = []
+    for idx in range(len(bands)):
+        selected = (best_line == idx) & (best_dist < AH / 2.0)
+        if np.count_nonzero(selected) == 0: continue
+        new_lines.append(TextLine(list(compress(letters, selected))))
+    new_lines.sort(key=lambda l: l[0].y)
+
+    new_lines = remove_outliers(im, AH, new_lines, 4)
+    if len(new_lines) < min_lines:
+        log.debug('incremental fine pass: %d lines, falling back', len(new_lines))
+        return None
+
+    underlines = algorithm.hand_drawn_lines(AH, im, new_lines, all_letters)
+    log.debug('incremental fine pass: %d of %d lines', len(new_lines), len(lines))
+
+    return im, AH, new_lines, underlines, all_letters
+
 # rotation matrix for rotation by ||theta|| around axis theta
 # theta: 3component x N; return: 3 x 3matrix x N
 def R_theta(theta):
@@ -423,16 +595,19 @@ def unpack_args(args, n_pages):
 
     a_ms = np.split(a_m_all, n_pages)
     aligns = align_all.reshape(n_pages, -1)
-
-    if n_pages == 1:
-        g = NormPoly(np.concatenate([[0], a_ms[0]]), OMEGA)
-    elif n_pages == 2:
-        g = SplitPoly(T,
-                      NormPoly(np.concatenate([[0], a_ms[0]]), OMEGA),
-                      NormPoly(np.concatenate([[0], a_ms[1]]), OMEGA))
+    g = make_surface(a_ms, T)
 
     return theta, a_ms, aligns, T, l_m, g
 
+# surface g from per-page coefficients (coeff 0 fixed to 0)
+def make_surface(a_ms, T):
+    if len(a_ms) == 1:
+        return NormPoly(np.concatenate([[0], a_ms[0]]), OMEGA)
+    elif len(a_ms) == 2:
+        return SplitPoly(T,
+                         NormPoly(np.concatenate([[0], a_ms[0]]), OMEGA),
+                         NormPoly(np.concatenate([[0], a_ms[1]]), OMEGA))
+
 E_str_t0s = []
 def E_str_project(R, g, base_points, t0s_idx):
     global E_str_t0s
@@ -445,7 +620,7 @@ def E_str_project(R, g, base_points, t0s_idx):
     # print([point.shape for point in base_points])
     # print([t0s.shape for t0s in E_str_t0s])
 
-    return [newton.t_i_k(R, g, points, t0s) \
+    return [telemetry.call('project', newton.t_i_k, R, g, points, t0s) \
             for points, t0s in zip(base_points, E_str_t0s[t0s_idx])]
 
 class Loss(object):
@@ -494,12 +669,15 @@ class DebugLoss(Loss):
         self.inner = inner
 
     def residuals(self, *args):
-        result = self.inner.residuals(*args)
-        if lib.debug: print('norm: {:3.6f}'.format(norm(result)))
+        result = telemetry.call('residuals', self.inner.residuals, *args)
+        if telemetry.current is not None: telemetry.current.evaluated(args[0], result)
+        if lib.debug: log.debug('norm: %3.6f', norm(result))
         return result
 
     def jac(self, *args):
-        return self.inner.jac(*args)
+        result = telemetry.call('jac', self.inner.jac, *args)
+        if telemetry.current is not None: telemetry.current.iteration(args[0])
+        return result
 
 class Preproject(Loss):
     def __init__(self, inner, base_points, n_pages):
@@ -721,6 +899,7 @@ def dE_str_dam(R, g, gp, all_points, all_ts, all_surface):
     return (R2.dot(all_points) * dt).T
 
 def dE_str_dl_k(base_points):
+    from scipy.linalg import block_diag
     blocks = [np.full((l.shape[-1], 1), -1) for l in base_points]
     return block_diag(*blocks)
 
@@ -818,7 +997,7 @@ def E_align_project(R, g, all_points, t0s_idx):
     if E_align_t0s[t0s_idx] is None:
         E_align_t0s[t0s_idx] = np.full((all_points.shape[1],), np.inf)
 
-    return newton.t_i_k(R, g, all_points, E_align_t0s[t0s_idx])
+    return telemetry.call('project', newton.t_i_k, R, g, all_points, E_align_t0s[t0s_idx])
 
 class E_align_page(Loss):
     def __init__(self, side_points, side_index, n_pages, page_index, n_total_lines):
@@ -912,7 +1091,8 @@ def make_E_align_page(page, AH, O, n_pages, page_index, n_total_lines):
         np.array([line.right_mid() for line in page]),
     ]
 
-    side_inliers = [ransac(coords, LinearXModel, 3, AH / 5.0)[1] for coords in side_points_2d]
+    side_inliers = [inliers for _, inliers in
+                    robust.fit_polys(side_points_2d, 1, 3, AH / 5.0, transpose=True)]
     inlier_use = [inliers.mean() > INLIER_THRESHOLD for inliers in side_inliers]
 
     if lib.debug:
@@ -971,6 +1151,12 @@ def debug_print_points(filename, points, step=None, color=BLUE):
 
 # @lib.timeit
 def make_mesh_2d(orig_shape, all_lines, all_letters, O, R, g, n_points_w=None):
+    boxes = make_mesh_boxes(orig_shape, all_lines, all_letters, O, R, g, n_points_w=n_points_w)
+    return [mesh_from_box(box_XYZ, box_n_points_w, O, R, g)
+            for box_XYZ, box_n_points_w in boxes]
+
+# surface-space extent (box_XYZ, n_points_w) of each page mesh
+def make_mesh_boxes(orig_shape, all_lines, all_letters, O, R, g, n_points_w=None):
     # all_letters = np.concatenate([line.letters for line in all_lines])
     corners_2d = np.concatenate([letter.corners() for letter in all_letters]).T
 
@@ -1027,27 +1213,33 @@ def make_mesh_2d(orig_shape, all_lines, all_letters, O, R, g, n_points_w=None):
             IPython.embed()
 
     if g.split():
-        mesh_l = make_mesh_2d_indiv(all_lines, corners_XYZ[:, corners_X <= g.T], O, R, g, n_points_w=n_points_w)
-        mesh_r = make_mesh_2d_indiv(all_lines, corners_XYZ[:, corners_X > g.T], O, R, g, n_points_w=n_points_w)
-        meshes = [mesh_l, mesh_r]
+        return [
+            mesh_box(all_lines, corners_XYZ[:, corners_X <= g.T], n_points_w=n_points_w),
+            mesh_box(all_lines, corners_XYZ[:, corners_X > g.T], n_points_w=n_points_w),
+        ]
     else:
-        mesh = make_mesh_2d_indiv(all_lines, corners_XYZ, O, R, g, n_points_w=n_points_w)
-        meshes = [mesh]
-
-    for i, mesh in enumerate(meshes):
-        # debug_print_points('mesh{}.png'.format(i), mesh, step=20)
-        pass
+        return [mesh_box(all_lines, corners_XYZ, n_points_w=n_points_w)]
 
-    return meshes
-
-def make_mesh_2d_indiv(all_lines, corners_XYZ, O, R, g, n_points_w=None):
+def mesh_box(all_lines, corners_XYZ, n_points_w=None):
     box_XYZ = Crop.from_points(corners_XYZ[:2]).expand(0.02)
-    if lib.debug: print('box_XYZ:', box_XYZ)
+    log.debug('box_XYZ: %s', box_XYZ)
 
     if n_points_w is None:
         # 90th percentile line width a good guess
         n_points_w = 1.2 * np.percentile(np.array([line.width() for line in all_lines]), 90)
-        n_points_w = max(n_points_w, 1800)
+        n_points_w = max(n_points_w, MIN_POINTS_W)
+
+    return box_XYZ, n_points_w
+
+def make_mesh_2d_indiv(all_lines, corners_XYZ, O, R, g, n_points_w=None):
+    box_XYZ, n_points_w = mesh_box(all_lines, corners_XYZ, n_points_w=n_points_w)
+    return mesh_from_box(box_XYZ, n_points_w, O, R, g)
+
+# mesh[v][u] = (x, y) in distorted image; f=None uses the global focal length
+def mesh_from_box(box_XYZ, n_points_w, O, R, g, f=None):
+    if f is None:
+        f = globals()['f']
+
     mesh_XYZ_x = np.linspace(box_XYZ.x0, box_XYZ.x1, 400)
     mesh_XYZ_z = g(mesh_XYZ_x)
     mesh_XYZ_xz_arc, total_arc = arc_length_points(mesh_XYZ_x, mesh_XYZ_z,
@@ -1057,7 +1249,7 @@ def make_mesh_2d_indiv(all_lines, corners_XYZ, O, R, g, n_points_w=None):
     # --- ROBUSTNESS: voorkom deling door nul of ∞ -------------------------
     if not np.isfinite(total_arc) or total_arc <= 1e-6:
         total_arc = max(abs(box_XYZ.w), 1.0)
-        if lib.debug: print('[{}] WARNING: total_arc fallback used, value: {}'.format('/'.join(lib.debug_prefix), total_arc))
+        log.debug('total_arc fallback used, value: %s', total_arc)
     # -----------------------------------------------------------------------
 
     # TODO: think more about estimation of aspect ratio for mesh
@@ -1069,23 +1261,21 @@ def make_mesh_2d_indiv(all_lines, corners_XYZ, O, R, g, n_points_w=None):
     mesh_XYZ = make_mesh_XYZ(mesh_XYZ_x_arc, mesh_XYZ_y, g)
     
     # Gebruik CameraParams voor consistente projectie
-    camera = CameraParams(globals()['f'], O)
+    camera = CameraParams(f, O)
     mesh_2d = gcs_to_image(mesh_XYZ, camera, R)
     
     # --- PRODUCTION SCALING: Apply to final mesh for dewarped.tif ---
-    current_f = globals()['f']
+    current_f = f
     baseline_f = 3230.0
     if current_f != baseline_f:
         scale_factor = current_f / baseline_f
         
         # SAFETY: Limit extreme scaling to prevent mesh explosion
         if scale_factor > 2.0 or scale_factor < 0.5:
-            if lib.debug:
-                print(f'[make_mesh_2d] WARNING: Extreme scale_factor {scale_factor:.3f} clamped to safe range')
+            log.debug('[make_mesh_2d] Extreme scale_factor %.3f clamped to safe range', scale_factor)
             scale_factor = np.clip(scale_factor, 0.5, 2.0)
         
-        if lib.debug:
-            print(f'[make_mesh_2d] Applying production scaling: f={current_f}, scale_factor={scale_factor:.3f}')
+        log.debug('[make_mesh_2d] Applying production scaling: f=%s, scale_factor=%.3f', current_f, scale_factor)
         
         # Apply scaling to mesh coordinates for consistent dewarping
         mesh_center_x = (mesh_2d[0].min() + mesh_2d[0].max()) / 2
@@ -1100,13 +1290,12 @@ def make_mesh_2d_indiv(all_lines, corners_XYZ, O, R, g, n_points_w=None):
         mesh_bounds = Crop.from_points(mesh_2d)
         max_coord = max(abs(mesh_bounds.x0), abs(mesh_bounds.y0), abs(mesh_bounds.x1), abs(mesh_bounds.y1))
         if max_coord > 1e6:  # Extreme coordinates detected
-            if lib.debug:
-                print(f'[make_mesh_2d] ERROR: Mesh explosion detected, max_coord={max_coord:.0f}')
+            log.warning('[make_mesh_2d] Mesh explosion detected, max_coord=%.0f', max_coord)
             # Fallback: disable scaling for this case
             mesh_2d = gcs_to_image(mesh_XYZ, camera, R)  # Reset to unscaled
     # ----------------------------------------------------------------
     
-    if lib.debug: print('mesh:', Crop.from_points(mesh_2d))
+    log.debug('mesh: %s', Crop.from_points(mesh_2d))
 
     # make sure meshes are not reversed
     if mesh_2d[0, :, 0].mean() > mesh_2d[0, :, -1].mean():
@@ -1171,6 +1360,7 @@ def lm(fun, x0, jac, args=(), kwargs={}, ftol=1e-6, max_nfev=10000, x_scale=None
         JsTJs = dot(Js.T, Js)
         lam /= LAM_DOWN
 
+    from scipy import optimize as opt
     return opt.OptimizeResult(x=x, fun=r)
 
 
@@ -1186,20 +1376,142 @@ def lsq(func, jac, x_scale):
 
     return result
 
-def kim2014(orig, O=None, split=True, n_points_w=None, f_points=[], index_numbers=None, flatbed=False):
+# target dominant character height (pixels) for analysis_scale='auto'
+ANALYSIS_AH = 32
+
+def auto_analysis_scale(orig, target_AH=ANALYSIS_AH, probe_size=2000):
+    # quick AH estimate on a copy whose long side is at most probe_size
+    im_h, im_w = orig.shape[:2]
+    probe_scale = min(1.0, probe_size / float(max(im_h, im_w)))
+    probe = binarize_lines(orig, resize=probe_scale)
+    AH = algorithm.dominant_char_height(probe) / probe_scale
+    log.debug('probe AH = %s', AH)
+    return min(1.0, target_AH / AH)
+
+# Estimate the surface on orig downscaled by `scale`, then render at full
+# resolution. O, f and the minimum mesh width are scaled down for the analysis
+# and the resulting models scaled back up.
+def kim2014_scaled(orig, scale, O=None, split=True, n_points_w=None, f_points=[], index_numbers=None):
+    small = cv2.resize(orig, (0, 0), None, scale, scale, interpolation=cv2.INTER_AREA)
+    small_O = None if O is None else np.asarray(O, dtype=np.float64) * scale
+    small_n_points_w = None if n_points_w is None else n_points_w * scale
+    models = estimate_scaled(small, scale, O=small_O, split=split, n_points_w=small_n_points_w)
+    return render_scaled(orig, models, scale, f_points=f_points, index_numbers=index_numbers)
+
+# Models for the surface in an image `scale` times the size of small,
+# estimated on small (O and n_points_w in small's coordinates).
+def estimate_scaled(small, scale, O=None, split=True, n_points_w=None):
+    global f, Of, THRESHOLD_MULT, MIN_POINTS_W, GOOD_NORM
+
+    log.debug('analysis scale: %.3f, analysis shape: %s', scale, small.shape[:2])
+
+    full_f, full_threshold, full_min_points_w, full_good_norm = f, THRESHOLD_MULT, MIN_POINTS_W, GOOD_NORM
+    set_focal_length(full_f * scale)
+    THRESHOLD_MULT = full_threshold
+    MIN_POINTS_W = full_min_points_w * scale
+    GOOD_NORM = full_good_norm * scale
+    try:
+        return kim2014(small, O=O, split=split, n_points_w=n_points_w, estimate_only=True)
+    finally:
+        set_focal_length(full_f)
+        THRESHOLD_MULT = full_threshold
+        MIN_POINTS_W = full_min_points_w
+        GOOD_NORM = full_good_norm
+
+# The coarse-pass lines of the analysis come along, scaled up, so the fine
+# pass at full resolution stays incremental.
+def render_scaled(orig, models, scale, f_points=[], index_numbers=None):
+    lines = [None if model.fine_lines is None else
+             scale_lines(model.fine_lines, 1.0 / scale, model.offset) for model in models]
+    models = [model.rescaled(1.0 / scale, orig.shape) for model in models]
+
+    result = []
+    for model, model_lines in zip(models, lines):
+        for mesh_2d in model.meshes():
+            result.append(correct_geometry(orig, mesh_2d, interpolation=cv2.INTER_LANCZOS4,
+                                           f_points=f_points, index_numbers=index_numbers,
+                                           lines=model_lines))
+
+    return result, models
+
+# A scaled analysis can settle on a surface the full-resolution pass would
+# not: fewer lines survive the downscale, and the restarts land elsewhere.
+# Checked against the lines found at full resolution (probe_lines): enough
+# lines, output not collapsed against their block, mesh mostly on the image.
+MIN_SCALED_LINES = 0.5
+MIN_SCALED_SIZE = 0.25
+MIN_MESH_INSIDE = 0.5
+
+def scaled_result_ok(result, models, probe_lines, shape):
+    n_lines = sum(model.n_lines for model in models)
+    if n_lines < MIN_SCALED_LINES * len(probe_lines):
+        log.debug('scaled analysis: %d lines, %d at full resolution', n_lines, len(probe_lines))
+        return False
+
+    block = Crop.from_lines(probe_lines)
+    for out in result:
+        out_h, out_w = out[0].shape[:2]
+        if out_h < MIN_SCALED_SIZE * block.h or out_w < MIN_SCALED_SIZE * block.w:
+            log.debug('scaled analysis: output %dx%d, text block %dx%d',
+                      out_w, out_h, block.w, block.h)
+            return False
+
+    im_h, im_w = shape[:2]
+    for model in models:
+        for mesh in model.meshes():
+            xs, ys = mesh[..., 0], mesh[..., 1]
+            inside = ((xs >= 0) & (xs < im_w) & (ys >= 0) & (ys < im_h)).mean()
+            if inside < MIN_MESH_INSIDE:
+                log.debug('scaled analysis: %.0f%% of the mesh on the image', 100 * inside)
+                return False
+
+    return True
+
+# orig is a reduced decode of full_res (lib.RawImage: .shape, .full()):
+# estimate on orig, decode the full image only to render the result.
+def kim2014_reduced(orig, full_res, O=None, split=True, n_points_w=None, f_points=[], index_numbers=None):
+    scale = orig.shape[1] / full_res.shape[1]
+    models = estimate_scaled(orig, scale, O=O, split=split, n_points_w=n_points_w)
+    return render_scaled(full_res.full(), models, scale, f_points=f_points, index_numbers=index_numbers)
+
+def kim2014(orig, O=None, split=True, n_points_w=None, f_points=[], index_numbers=None, flatbed=False,
+            return_model=False, analysis_scale=None, estimate_only=False, full_res=None):
     # Flatbed-modus: vrijwel orthografisch → grote f + agressiever filter
     if flatbed:
         set_focal_length(10000)  # ≈ orthografische projectie + THRESHOLD_MULT scaling
-        if lib.debug: print('[{}] Flatbed mode: f={}, THRESHOLD_MULT={}'.format('/'.join(lib.debug_prefix), f, THRESHOLD_MULT))
+        log.debug('Flatbed mode: f=%s, THRESHOLD_MULT=%s', f, THRESHOLD_MULT)
+
+    # full_res: orig is a reduced decode (RAW half_size), O in its coordinates;
+    # the output is rendered from the full decode
+    if full_res is not None and not estimate_only:
+        result, models = kim2014_reduced(orig, full_res, O=O, split=split, n_points_w=n_points_w,
+                                         f_points=f_points, index_numbers=index_numbers)
+        return (result, models) if return_model else result
+
+    # analysis_scale: None = full resolution, 'auto' = from a quick AH estimate
+    if analysis_scale is not None and not estimate_only:
+        if analysis_scale == 'auto':
+            scale = auto_analysis_scale(orig)
+        else:
+            scale = float(analysis_scale)
+
+        if scale < 0.99:
+            # binarization and components are memoized: a fallback reuses them
+            probe_lines = get_AH_line_sets(binarize_lines(orig))[1]
+            result, models = kim2014_scaled(orig, scale, O=O, split=split, n_points_w=n_points_w,
+                                            f_points=f_points, index_numbers=index_numbers)
+            if scaled_result_ok(result, models, probe_lines, orig.shape):
+                return (result, models) if return_model else result
+            log.warning('analysis at scale %.2f is off: falling back to full resolution', scale)
 
     lib.debug_imwrite('gray.png', binarize.grayscale(orig))
-    im = binarize.binarize(orig, algorithm=lambda im: binarize.sauvola_noisy(im, k=0.1))
+    im = binarize_lines(orig)
     global bw
     bw = im
 
     im_h, im_w = im.shape
 
-    AH, lines, _, all_letters = get_AH_lines(im)
+    AH, lines, _, filtered, all_letters = get_AH_line_sets(im)
 
     if O is None:
         O = np.array((im_w / 2.0, im_h / 2.0))
@@ -1213,11 +1525,11 @@ def kim2014(orig, O=None, split=True, n_points_w=None, f_points=[], index_number
         dual = False
 
     if dual:
-        print('Bimodal! Splitting page!')
+        log.debug('Bimodal! Splitting page!')
         pages = crop.split_lines(lines)
 
         n_points_w = 1.2 * np.percentile(np.array([line.width() for line in lines]), 90)
-        n_points_w = max(n_points_w, 1800)
+        n_points_w = max(n_points_w, MIN_POINTS_W)
 
         if lib.debug:
             debug = cv2.cvtColor(bw, cv2.COLOR_GRAY2BGR)
@@ -1237,30 +1549,42 @@ def kim2014(orig, O=None, split=True, n_points_w=None, f_points=[], index_number
             ]
 
         result = []
+        models = []
         for i, (page, page_crop) in enumerate(zip(pages, page_crops)):
-            print('==== PAGE {} ===='.format(i))
+            log.debug('==== PAGE %d ====', i)
             lib.debug_prefix.append('page{}'.format(i))
 
             page_image = page_crop.apply(orig)
             page_bw = page_crop.apply(im)
-            page_AH, page_lines, _, _ = get_AH_lines(page_bw)
+            page_AH, page_lines, _, page_filtered, page_letters = get_AH_line_sets(page_bw)
             new_O = O - np.array((page_crop.x0, page_crop.y0))
             lib.debug_imwrite('precrop.png', im)
             lib.debug_imwrite('page.png', page_image)
 
             bw = page_bw
-            dewarper = Kim2014(page_image, page_bw, page_lines, [page_lines],
+            dewarper = Kim2014(page_image, page_bw, page_lines, [page_lines], page_letters,
                                new_O, page_AH, n_points_w, f_points, index_numbers)
-            result.append(dewarper.run_retry()[0])
+            dewarper.offset = np.array((page_crop.x0, page_crop.y0), dtype=np.float64)
+            dewarper.shape = orig.shape[:2]
+            dewarper.fine_lines = fine_pass_lines(page_lines, page_filtered)
+            result.extend(dewarper.run_retry(render=not estimate_only)[:1])
+            models.append(dewarper.model)
 
             lib.debug_prefix.pop()
-
-        return result
     else:
         lib.debug_prefix.append('page0')
         dewarper = Kim2014(orig, im, lines, [lines], all_letters, O, AH, n_points_w, f_points, index_numbers)
+        dewarper.fine_lines = fine_pass_lines(lines, filtered)
         lib.debug_prefix.pop()
-        return dewarper.run_retry()
+        result = dewarper.run_retry(render=not estimate_only)
+        models = [dewarper.model]
+
+    if estimate_only:
+        return models
+    elif return_model:
+        return result, models
+    else:
+        return result
 
 class Kim2014:
     def __init__(self, orig, im, lines, pages, all_letters, O, AH, n_points_w, f_points, index_numbers=None):
@@ -1274,6 +1598,14 @@ class Kim2014:
         self.all_letters = all_letters
         self.f_points = f_points
         self.index_numbers = index_numbers
+        # position of orig inside the full input image (set for split pages)
+        self.offset = np.zeros(2, dtype=np.float64)
+        self.shape = orig.shape[:2]
+        self.model = None
+        # lines carried into the fine pass (see correct_geometry)
+        self.fine_lines = lines
+        # random starting rotations for the restarts; seeded like the RANSAC fits
+        self.rng = np.random.default_rng(robust.SEED)
 
         for page in self.pages:
             page.sort(key=lambda l: l[0].y)
@@ -1307,7 +1639,7 @@ class Kim2014:
         mean_image_vanishing = np.mean(vanishing_points, axis=0)
         vanishing = np.concatenate([mean_image_vanishing - self.O, [-f]])
         vx, vy, _ = vanishing
-        if lib.debug: print(' v:', vanishing)
+        log.debug(' v: %s', vanishing)
 
         xz_ratio = -f / vx  # theta_x / theta_z
         norm_theta_sq = (atan2(np.sqrt(vx ** 2 + f ** 2), vy) - pi) ** 2
@@ -1320,7 +1652,7 @@ class Kim2014:
         # print('theta_0 dot ey:', theta_0.dot(np.array([0, 1, 0])))
         # print('theta_0 dot v:', theta_0.dot(vanishing))
         # theta_0 = np.array([0.1, 0, 0], dtype=np.float64)
-        theta_0 = (np.random.rand(3) - 0.5) / 4
+        theta_0 = (self.rng.random(3) - 0.5) / 4
         # theta_0 = np.array((-0.4976,  0.6549,  0.2156))
         # flat surface as initial guess.
         # NB: coeff 0 forced to 0 here. not included in opt.
@@ -1328,7 +1660,7 @@ class Kim2014:
 
         R_0 = R_theta(theta_0)
         _, ROf_y, ROf_z = R_0.dot(Of)
-        if lib.debug: print('Rv:', R_0.dot(np.array((vx, vy, -f))))
+        log.debug('Rv: %s', R_0.dot(np.array((vx, vy, -f))))
 
         all_surface = [R_0.dot(-points - Of[:, newaxis]) for points in self.base_points]
         l_m_0 = [Ys.mean() for _, Ys, _ in all_surface]
@@ -1348,21 +1680,33 @@ class Kim2014:
         final_norm, opt_result = self.optimize()
         return self.correct(opt_result)
 
-    def run_retry(self, n_tries=6):
+    def run_retry(self, n_tries=6, render=True):
         best_result = None
         best_norm = np.inf
-        for _ in range(n_tries):
+        best_idx = 0
+        start = time.time()
+        for i in range(n_tries):
             final_norm, opt_result = self.optimize()
             if final_norm < best_norm:
                 best_norm = final_norm
                 best_result = opt_result
+                best_idx = i
 
-            if final_norm < 120:
+            if final_norm < GOOD_NORM:
                 break
             else:
-                print("**** BAD RUN. ****")
+                log.debug('**** BAD RUN. ****')
 
-        return self.correct(best_result)
+        log.info('dewarp: %d lines, %d restart(s), best norm %.1f, %.1fs',
+                 len(self.lines), i + 1, best_norm, time.time() - start)
+        if telemetry.current is not None:
+            telemetry.current.write('/'.join(lib.debug_prefix), best_idx)
+
+        if render:
+            return self.correct(best_result)
+
+        self.make_model(best_result)
+        return []
 
     def debug_images(self, R, g, align, l_m):
         if not lib.debug: return
@@ -1380,11 +1724,10 @@ class Kim2014:
         surface_y_offset = getattr(self, 'surface_y_offset', 0.0)  # Verticale verschuiving
         surface_curvature_adjust = getattr(self, 'surface_curvature_adjust', 1.0)  # Kromming aanpassing
         
-        if lib.debug:
-            print(f'[debug_images] f={current_f}, scale_factor={scale_factor:.3f}')
-            print(f'[debug_images] THRESHOLD_MULT={THRESHOLD_MULT:.2f}')
-            print(f'[debug_images] surface_y_offset={surface_y_offset:.2f}, curvature_adjust={surface_curvature_adjust:.3f}')
-            print(f'[debug_images] Lines detected: {len(self.lines)}, Base points: {len(self.base_points)}')
+        log.debug('[debug_images] f=%s, scale_factor=%.3f', current_f, scale_factor)
+        log.debug('[debug_images] THRESHOLD_MULT=%.2f', THRESHOLD_MULT)
+        log.debug('[debug_images] surface_y_offset=%.2f, curvature_adjust=%.3f', surface_y_offset, surface_curvature_adjust)
+        log.debug('[debug_images] Lines detected: %d, Base points: %d', len(self.lines), len(self.base_points))
 
         for Y, (_, points_XYZ) in zip(l_m, ts_surface):
             Xs, Ys, Zs = points_XYZ
@@ -1447,8 +1790,7 @@ class Kim2014:
         """Experimentele methode om groene lijnen naar blauwe lijnen te bewegen."""
         self.surface_y_offset = y_offset
         self.surface_curvature_adjust = curvature_adjust
-        if lib.debug:
-            print(f'[surface_tuning] Set y_offset={y_offset:.2f}, curvature_adjust={curvature_adjust:.3f}')
+        log.debug('[surface_tuning] Set y_offset=%.2f, curvature_adjust=%.3f', y_offset, curvature_adjust)
 
     def optimize(self):
         global E_str_t0s, E_align_t0s
@@ -1471,6 +1813,8 @@ class Kim2014:
             + make_E_align(self.pages, self.AH, self.O) * 0.6
         )
 
+        if telemetry.current is not None: telemetry.current.start(x_scale)
+        from scipy import optimize as opt
         result = opt.least_squares(
             fun=loss_0.residuals,
             x0=args_0,
@@ -1481,18 +1825,29 @@ class Kim2014:
 
         theta, a_ms, align, T, l_m, g = unpack_args(result.x, n_pages)
         final_norm = norm(result.fun)
+        if telemetry.current is not None: telemetry.current.finish(result, final_norm)
 
-        print('*** OPTIMIZATION DONE ***')
-        print('final norm:', final_norm)
-        print('theta:', theta)
-        if lib.debug:
-            for a_m in a_ms:
-                print('a_m:', np.concatenate([[0], a_m]))
-            if isinstance(g, SplitPoly):
-                print('T:', g.T)
+        log.debug('*** OPTIMIZATION DONE ***')
+        log.debug('final norm: %s', final_norm)
+        log.debug('theta: %s', theta)
+        for a_m in a_ms:
+            log.debug('a_m: %s', np.concatenate([[0], a_m]))
+        if isinstance(g, SplitPoly):
+            log.debug('T: %s', g.T)
 
         return final_norm, result
 
+    def make_model(self, opt_result):
+        theta, a_ms, align, T, l_m, g = unpack_args(opt_result.x, len(self.pages))
+        R = R_theta(theta)
+
+        boxes = make_mesh_boxes(self.orig.shape[:2], self.lines, self.all_letters, self.O, R, g, n_points_w=self.n_points_w)
+        self.model = DewarpModel(theta, a_ms, align, T, l_m, f, self.O, boxes,
+                                 self.shape, offset=self.offset)
+        self.model.fine_lines = self.fine_lines
+        self.model.n_lines = len(self.lines)
+        return self.model
+
     def correct(self, opt_result):
         theta, a_ms, align, T, l_m, g = unpack_args(opt_result.x, len(self.pages))
 
@@ -1500,14 +1855,145 @@ class Kim2014:
 
         self.debug_images(R, g, align, l_m)
 
-        mesh_2ds = make_mesh_2d(self.orig.shape[:2], self.lines, self.all_letters, self.O, R, g, n_points_w=self.n_points_w)
+        boxes = self.make_model(opt_result).boxes
+        mesh_2ds = [mesh_from_box(box_XYZ, n_points_w, self.O, R, g)
+                    for box_XYZ, n_points_w in boxes]
         result = []
         for mesh_2d in mesh_2ds:
-            first_pass = correct_geometry(self.orig, mesh_2d, interpolation=cv2.INTER_LANCZOS4, f_points=self.f_points, index_numbers=self.index_numbers)
+            first_pass = correct_geometry(self.orig, mesh_2d, interpolation=cv2.INTER_LANCZOS4, f_points=self.f_points, index_numbers=self.index_numbers,
+                                          lines=self.fine_lines)
             result.append(first_pass)
 
         return result
 
+# Result of Kim2014.optimize: everything needed to rebuild the meshes, so an
+# image can be re-rendered without detection or optimisation.
+class DewarpModel(object):
+    def __init__(self, theta, a_ms, align, T, l_m, f, O, boxes, shape, offset=(0, 0)):
+        self.theta = np.asarray(theta, dtype=np.float64)
+        self.a_ms = [np.asarray(a_m, dtype=np.float64) for a_m in a_ms]
+        self.align = np.asarray(align, dtype=np.float64)
+        self.T = float(T)
+        self.l_m = np.asarray(l_m, dtype=np.float64)
+        self.f = float(f)
+        self.O = np.asarray(O, dtype=np.float64)
+        # (box_XYZ, n_points_w) per output page
+        self.boxes = [(Crop(*[float(c) for c in box_XYZ]), float(n_points_w))
+                      for box_XYZ, n_points_w in boxes]
+        # shape of the analysed image; offset of the page inside it
+        self.shape = tuple(int(d) for d in shape[:2])
+        self.offset = np.asarray(offset, dtype=np.float64)
+        # coarse-pass lines in page coordinates, for render_scaled, and how
+        # many lines the surface was fitted to, for scaled_result_ok; not saved
+        self.fine_lines = None
+        self.n_lines = 0
+
+    def surface(self):
+        return make_surface(self.a_ms, self.T)
+
+    # Same surface seen in an image scaled by k (with f scaled by k): all
+    # image and surface coordinates scale by k, g_k(x) = k g(x / k).
+    def rescaled(self, k, shape):
+        powers = np.arange(1, DEGREE + 1)
+        boxes = [(Crop(*[c * k for c in box_XYZ]), n_points_w * k)
+                 for box_XYZ, n_points_w in self.boxes]
+        model = DewarpModel(self.theta, [a_m * k ** (1 - powers) for a_m in self.a_ms],
+                            self.align * k, self.T * k, self.l_m * k, self.f * k,
+                            self.O * k, boxes, shape, offset=self.offset * k)
+        model.n_lines = self.n_lines
+        return model
+
+    # meshes into an image of `shape` (default: the analysed image), with
+    # `scale` times the native number of output pixels.
+    def meshes(self, scale=1.0, shape=None):
+        if shape is None:
+            shape = self.shape
+        im_scale = np.array((shape[1] / self.shape[1], shape[0] / self.shape[0]))
+
+        R = R_theta(self.theta)
+        g = self.surface()
+        return [
+            (mesh_from_box(box_XYZ, n_points_w * scale, self.O, R, g, f=self.f) \
+             + self.offset) * im_scale
+            for box_XYZ, n_points_w in self.boxes
+        ]
+
+    def to_dict(self):
+        return {
+            'theta': self.theta.tolist(),
+            'a_ms': [a_m.tolist() for a_m in self.a_ms],
+            'align': self.align.tolist(),
+            'T': self.T,
+            'l_m': self.l_m.tolist(),
+            'f': self.f,
+            'O': self.O.tolist(),
+            'boxes': [list(box_XYZ) for box_XYZ, _ in self.boxes],
+            'n_points_w': [n_points_w for _, n_points_w in self.boxes],
+            'shape': list(self.shape),
+            'offset': self.offset.tolist(),
+        }
+
+    @staticmethod
+    def from_dict(d):
+        return DewarpModel(d['theta'], list(d['a_ms']), d['align'], d['T'],
+                           d['l_m'], d['f'], d['O'],
+                           list(zip(d['boxes'], d['n_points_w'])),
+                           d['shape'], offset=d['offset'])
+
+    def __repr__(self):
+        return 'DewarpModel(theta={}, f={}, pages={})'.format(
+            self.theta, self.f, len(self.boxes))
+
+# .json -> JSON, anything else -> npz
+def save_model(path, models):
+    if path.endswith('.json'):
+        with open(path, 'w') as out:
+            json.dump({'models': [model.to_dict() for model in models]}, out)
+    else:
+        arrays = {'n_models': len(models)}
+        for i, model in enumerate(models):
+            for key, value in model.to_dict().items():
+                arrays['m{}_{}'.format(i, key)] = np.asarray(value)
+        np.savez(path, **arrays)
+
+def load_model(path):
+    if path.endswith('.json'):
+        with open(path) as model_file:
+            return [DewarpModel.from_dict(d) for d in json.load(model_file)['models']]
+    else:
+        with np.load(path) as arrays:
+            n_models = int(arrays['n_models'])
+            prefixes = ['m{}_'.format(i) for i in range(n_models)]
+            return [
+                DewarpModel.from_dict({
+                    key[len(prefix):]: arrays[key]
+                    for key in arrays.files if key.startswith(prefix)
+                })
+                for prefix in prefixes
+            ]
+
+# Render-only path: apply saved models to im (which may be a resized copy of
+# the analysed image). Returns [(image, boxes)] like kim2014; boxes are only
+# found when fine=True, which runs the line-based fine pass on the output.
+def render(im, models, scale=1.0, interpolation=cv2.INTER_LANCZOS4, fine=False,
+           f_points=[], index_numbers=None):
+    result = []
+    for model in models:
+        for mesh_2d in model.meshes(scale=scale, shape=im.shape[:2]):
+            if fine:
+                result.append(correct_geometry(im, mesh_2d, interpolation=interpolation,
+                                               f_points=f_points, index_numbers=index_numbers))
+            else:
+                result.append((remap_mesh(im, mesh_2d, interpolation=interpolation), None))
+
+    return result
+
+def go_render(im, model_path, scale=1.0, interpolation=cv2.INTER_LANCZOS4, fine=False, debug=False):
+    lib.debug = debug
+    lib.debug_prefix = ['dewarp']
+    return render(im, load_model(model_path), scale=scale,
+                  interpolation=interpolation, fine=fine)
+
 def go(argv):
     im = cv2.imread(argv[1], cv2.IMREAD_UNCHANGED)
     lib.debug = True
@@ -1520,33 +2006,51 @@ def go(argv):
 # Global voor surface tuning parameters
 _surface_tuning_params = {}
 
-def go_dewarp(im, ctr, f_points=[], debug=False, split=False, index_numbers=None, flatbed=False, focal_length=None, surface_tuning=None):
-    global THRESHOLD_MULT, _surface_tuning_params
+def go_dewarp(im, ctr, f_points=[], debug=False, split=False, index_numbers=None, flatbed=False, focal_length=None, surface_tuning=None,
+              model_path=None, return_model=False, analysis_scale=None, trace_path=None, trace_name='',
+              binarize_algorithm=None, full_res=None):
+    global THRESHOLD_MULT, BINARIZE, _surface_tuning_params
     
     lib.debug = debug
     lib.debug_prefix = ['dewarp']
+    lib.init_logging(debug)
     np.set_printoptions(linewidth=130, precision=4)
     
     # Store original threshold
     original_threshold = THRESHOLD_MULT
+    original_binarize = BINARIZE
+    if binarize_algorithm is not None:
+        BINARIZE = binarize_algorithm
     
     # Experimentele focal length override
     if focal_length is not None:
         set_focal_length(focal_length)
-        if lib.debug: print(f'Experimental mode: f={f}, THRESHOLD_MULT={THRESHOLD_MULT}')
+        log.debug('Experimental mode: f=%s, THRESHOLD_MULT=%s', f, THRESHOLD_MULT)
     
     # Threshold tuning override
     if surface_tuning and 'threshold_mult' in surface_tuning:
         THRESHOLD_MULT = surface_tuning['threshold_mult']
-        if lib.debug: 
-            print(f'Threshold tuning: THRESHOLD_MULT={THRESHOLD_MULT} (was {original_threshold})')
+        log.debug('Threshold tuning: THRESHOLD_MULT=%s (was %s)', THRESHOLD_MULT, original_threshold)
     
     # Surface tuning hook voor parameter experimenten
     _surface_tuning_params = surface_tuning or {}
-    
+
+    # optimizer telemetry: one JSON line per page appended to trace_path
+    if trace_path is not None:
+        telemetry.current = telemetry.OptTrace(trace_path, trace_name)
+
     try:
-        out = kim2014(im, split=split, O=ctr, f_points=f_points, index_numbers=index_numbers, flatbed=flatbed)
+        with analysis.session():
+            out, models = kim2014(im, split=split, O=ctr, f_points=f_points, index_numbers=index_numbers,
+                                  flatbed=flatbed, return_model=True, analysis_scale=analysis_scale,
+                                  full_res=full_res)
+        if model_path is not None:
+            save_model(model_path, models)
+        if return_model:
+            return out, models
         return out
     finally:
         # Restore original threshold
-        THRESHOLD_MULT = original_threshold
\ No newline at end of file
+        THRESHOLD_MULT = original_threshold
+        BINARIZE = original_binarize
+        telemetry.current = None
\ No newline at end of file
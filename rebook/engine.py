@@ -0,0 +1,159 @@
+from __future__ import division, print_function
+
+import functools
+import itertools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+import zlib
+from multiprocessing import cpu_count
+from multiprocessing.pool import Pool
+
+log = logging.getLogger(__name__)
+
+# Runs fn over a stream of items on a process pool and hands the results
+# back in input order. Work goes out through imap_unordered in chunks; a
+# reorder buffer restores the order, and at most `window` items are read
+# from the input ahead of the last result handed back, so streamed inputs
+# (PDF, ZIP pages) are not all pulled into memory by the pool's feeder
+# thread. An exception in fn fails only its own item.
+
+class Result(object):
+    def __init__(self, index, value=None, error=None, seconds=0.0):
+        self.index, self.item = index, None  # item is filled in by run()
+        self.value, self.error = value, error
+        self.seconds = seconds
+
+    @property
+    def ok(self):
+        return self.error is None
+
+def _call(fn, indexed):
+    index, item = indexed
+    start = time.time()
+    try:
+        return Result(index, value=fn(item), seconds=time.time() - start)
+    except Exception:
+        return Result(index, error=traceback.format_exc().rstrip(),
+                      seconds=time.time() - start)
+
+def run(fn, items, workers=None, chunksize=1, window=None, initializer=None, initargs=()):
+    """Yield a Result per item, in order. workers=0 runs in this process;
+    None uses one process per CPU. fn must be picklable (module level)."""
+    call = functools.partial(_call, fn)
+    if workers == 0:
+        if initializer is not None:
+            initializer(*initargs)
+        for index, item in enumerate(items):
+            result = call((index, item))
+            result.item = item
+            yield result
+        return
+
+    workers = workers or cpu_count()
+    # must be >= chunksize: the pool holds back a partial chunk until it is full
+    window = max(window or 4 * workers * chunksize, chunksize)
+    slots, stopped = threading.Semaphore(window), threading.Event()
+
+    inflight = {}  # the item goes out to the worker, not back
+
+    def feed():
+        it = iter(items)
+        for index in itertools.count():
+            slots.acquire()  # before the item is made: producing it may hold resources
+            if stopped.is_set():
+                return
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            inflight[index] = item
+            yield index, item
+
+    pool = Pool(workers, initializer=initializer, initargs=initargs)
+    try:
+        pending, next_index = {}, 0
+        for result in pool.imap_unordered(call, feed(), chunksize):
+            pending[result.index] = result
+            while next_index in pending:
+                slots.release()
+                result = pending.pop(next_index)
+                result.item = inflight.pop(next_index)
+                yield result
+                next_index += 1
+        pool.close()
+    finally:
+        stopped.set()  # consumer gone early: unblock the feeder thread
+        slots.release()
+        pool.terminate()
+        pool.join()
+
+# Progress and throughput on stderr, one line per finished item; total is
+# None for streamed inputs.
+class Progress(object):
+    def __init__(self, total=None, stream=sys.stderr):
+        self.total, self.stream = total, stream
+        self.start = time.time()
+        self.done = self.failed = 0
+        self.busy = 0.0
+
+    def update(self, result):
+        self.done += 1
+        self.failed += not result.ok
+        self.busy += result.seconds
+        elapsed = time.time() - self.start
+        rate = self.done / elapsed if elapsed > 0 else 0.0
+        count = '{}/{}'.format(self.done, self.total) if self.total else str(self.done)
+        eta = ''
+        if self.total and rate > 0:
+            eta = ', eta {:.0f} s'.format((self.total - self.done) / rate)
+        print('[{}] {:.2f} items/s, {:.1f} s/item in workers, {} failed, {:.0f} s{}'.format(
+            count, rate, self.busy / self.done, self.failed, elapsed, eta), file=self.stream)
+
+    def summary(self):
+        elapsed = time.time() - self.start
+        return '{} items in {:.1f} s ({:.2f} items/s), {} failed'.format(
+            self.done, elapsed, self.done / elapsed if elapsed > 0 else 0.0, self.failed)
+
+# Resume state: one JSON line per finished input with a fingerprint of the
+# input and its outputs. An input counts as done if the fingerprint still
+# matches and all outputs exist; later lines win, so records are appended.
+class Manifest(object):
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:  # torn last line of an interrupted run
+                        continue
+                    self.entries[entry['input']] = entry
+
+    def lookup(self, name, key):
+        entry = self.entries.get(name)
+        if entry is None or entry['key'] != key:
+            return None
+        if not all(os.path.exists(path) for path in entry['outputs']):
+            return None
+        return entry
+
+    def record(self, name, key, outputs, **extra):
+        entry = dict(extra, input=name, key=key, outputs=list(outputs))
+        self.entries[name] = entry
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(entry) + '\n')
+
+def fingerprint(page):
+    """Cheap identity of a sources.Page: size and mtime for files, length
+    and CRC32 of the data for pages read from PDF or ZIP."""
+    if page.kind == 'file':
+        st = os.stat(page.data)
+        return '{}:{}'.format(st.st_size, st.st_mtime_ns)
+    data = page.data if page.kind == 'encoded' else page.data.data
+    return '{}:{:08x}'.format(len(data), zlib.crc32(data) & 0xffffffff)
@@ -0,0 +1,54 @@
+from __future__ import division, print_function
+
+import numpy as np
+
+# Per-label reductions over a label map (as from connectedComponentsWithStats):
+# one np.bincount pass over the image instead of a slice per component.
+# Results are indexed by label; n_labels defaults to label_map.max() + 1.
+# mask: only pixels where mask is nonzero take part.
+
+def n_labels_of(label_map):
+    return int(label_map.max()) + 1 if label_map.size else 1
+
+def select(label_map, mask):
+    labels = label_map.ravel()
+    if mask is None:
+        return labels, None
+    where = mask.ravel().astype(bool, copy=False)
+    return labels[where], where
+
+def count(label_map, n_labels=None, mask=None):
+    if n_labels is None: n_labels = n_labels_of(label_map)
+    labels, _ = select(label_map, mask)
+    return np.bincount(labels, minlength=n_labels)[:n_labels]
+
+def sum(label_map, values, n_labels=None, mask=None):
+    if n_labels is None: n_labels = n_labels_of(label_map)
+    labels, where = select(label_map, mask)
+    values = values.ravel() if where is None else values.ravel()[where]
+    return np.bincount(labels, weights=values, minlength=n_labels)[:n_labels]
+
+# Two passes (mean, then squared deviations) like masked_mean_std.
+# Labels without pixels get mean and std 0.
+def mean_std(label_map, values, n_labels=None, mask=None):
+    if n_labels is None: n_labels = n_labels_of(label_map)
+    labels, where = select(label_map, mask)
+    values = values.ravel() if where is None else values.ravel()[where]
+    values = values.astype(np.float64, copy=False)
+
+    counts = np.bincount(labels, minlength=n_labels)[:n_labels]
+    safe_counts = np.maximum(counts, 1)
+    mean = np.bincount(labels, weights=values, minlength=n_labels)[:n_labels] / safe_counts
+    dev = values - mean[labels]
+    std = np.sqrt(np.bincount(labels, weights=dev * dev, minlength=n_labels)[:n_labels] / safe_counts)
+    return counts, mean, std
+
+# Boolean lookup table: lut(labels, n)[label_map] is the mask of those components.
+def lut(labels, n_labels):
+    table = np.zeros(n_labels, dtype=bool)
+    table[np.asarray(labels, dtype=np.intp)] = True
+    return table
+
+def mask(label_map, labels, n_labels=None):
+    if n_labels is None: n_labels = n_labels_of(label_map)
+    return lut(labels, n_labels)[label_map]
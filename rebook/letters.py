@@ -3,12 +3,17 @@ from __future__ import division, print_function
 import cv2
 import itertools
 import numpy as np
-from numpy.polynomial import Polynomial as Poly
-from skimage.measure import ransac
 
+from . import robust
 from .geometry import Crop, Line
 
+LEFT, TOP, WIDTH, HEIGHT, AREA = cv2.CC_STAT_LEFT, cv2.CC_STAT_TOP, \
+    cv2.CC_STAT_WIDTH, cv2.CC_STAT_HEIGHT, cv2.CC_STAT_AREA
+
+# One connected component. Usually a view on a row of a LetterTable.
 class Letter(object):
+    __slots__ = ('label', 'label_map', 'stats', 'centroid')
+
     def __init__(self, label, label_map, stats, centroid):
         self.label = label
         self.label_map = label_map
@@ -16,19 +21,19 @@ class Letter(object):
         self.centroid = centroid
 
     @property
-    def x(self): return self.stats[cv2.CC_STAT_LEFT]
+    def x(self): return self.stats[LEFT]
 
     @property
-    def y(self): return self.stats[cv2.CC_STAT_TOP]
+    def y(self): return self.stats[TOP]
 
     @property
-    def w(self): return self.stats[cv2.CC_STAT_WIDTH]
+    def w(self): return self.stats[WIDTH]
 
     @property
-    def h(self): return self.stats[cv2.CC_STAT_HEIGHT]
+    def h(self): return self.stats[HEIGHT]
 
     def area(self):
-        return self.stats[cv2.CC_STAT_AREA]
+        return self.stats[AREA]
 
     def __iter__(self):
         return (x for x in self.tuple())
@@ -105,6 +110,98 @@ class Letter(object):
 
     def __repr__(self): return str(self)
 
+# Connected components as columns (struct of arrays), straight from
+# cv2.connectedComponentsWithStats. Indexing with an int gives a Letter view,
+# with a mask, slice or index array a sub-table. Views are created on demand
+# and shared between a table and its sub-tables, so identity is stable.
+class LetterTable(object):
+    def __init__(self, label_map, stats, centroids, labels, root=None, index=None):
+        self.label_map = label_map
+        self.stats = stats
+        self.centroids = centroids
+        self.labels = labels
+        self.root = self if root is None else root
+        self.index = np.arange(len(labels)) if index is None else index
+        if root is None:
+            self._views = [None] * len(labels)
+
+        self.x = stats[:, LEFT]
+        self.y = stats[:, TOP]
+        self.w = stats[:, WIDTH]
+        self.h = stats[:, HEIGHT]
+        self.areas = stats[:, AREA]
+
+    @staticmethod
+    def from_image(im, connectivity=4):
+        # components are the black pixels of a 0/255 image
+        return LetterTable.from_components(
+            cv2.connectedComponentsWithStats(im ^ 255, connectivity=connectivity))
+
+    @staticmethod
+    def from_components(cc):
+        max_label, label_map, stats, centroids = cc
+        return LetterTable(label_map, stats[1:], centroids[1:], np.arange(1, max_label))
+
+    @staticmethod
+    def from_letters(letters):
+        letters = list(letters)
+        if not letters:
+            return LetterTable(None, np.zeros((0, 5), dtype=np.int32),
+                               np.zeros((0, 2)), np.zeros(0, dtype=np.int32))
+        return LetterTable(letters[0].label_map,
+                           np.array([l.stats for l in letters]),
+                           np.array([l.centroid for l in letters]),
+                           np.array([l.label for l in letters]))
+
+    def __len__(self):
+        return len(self.labels)
+
+    def _view(self, i):
+        root = self.root
+        j = self.index[i]
+        view = root._views[j]
+        if view is None:
+            view = Letter(root.labels[j], root.label_map, root.stats[j], root.centroids[j])
+            root._views[j] = view
+        return view
+
+    def __iter__(self):
+        return (self._view(i) for i in range(len(self)))
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            return self._view(key)
+
+        index = self.index[key]
+        return LetterTable(self.label_map, self.root.stats[index], self.root.centroids[index],
+                           self.root.labels[index], root=self.root, index=index)
+
+    def letters(self):
+        return list(self)
+
+    def base_points(self):
+        return np.stack([self.x + self.w / 2.0, self.y + self.h], axis=1)
+
+    def top_points(self):
+        return np.stack([self.x + self.w / 2.0, self.y], axis=1)
+
+    # same order as Letter.corners: N x 4 x 2
+    def corners(self):
+        x0, y0 = self.x, self.y
+        x1, y1 = self.x + self.w, self.y + self.h
+        return np.stack([
+            np.stack([x0, y0], axis=1),
+            np.stack([x0, y1], axis=1),
+            np.stack([x1, y0], axis=1),
+            np.stack([x1, y1], axis=1),
+        ], axis=1)
+
+    def __repr__(self):
+        return 'LetterTable[{}]'.format(len(self))
+
+def letter_stats(letters):
+    return np.array([l.stats for l in letters]).reshape(-1, 5)
+
 class TextLine(object):
     def __init__(self, letters, model=None, underlines=None):
         self.letters = sorted(letters, key=lambda l: l.x)
@@ -179,7 +276,9 @@ class TextLine(object):
         return Line.from_points(self.first_base(), self.last_base())
 
     def base_points(self):
-        return np.array([l.base_point() for l in self.letters])
+        stats = letter_stats(self.letters)
+        return np.stack([stats[:, LEFT] + stats[:, WIDTH] / 2.0,
+                         stats[:, TOP] + stats[:, HEIGHT]], axis=1)
 
     def crop(self):
         if self.underlines:
@@ -190,38 +289,15 @@ class TextLine(object):
         else:
             return Crop.union_all([l.crop() for l in self.letters])
 
-    class PolyModel5(object):
-        def estimate(self, data):
-            self.params = Poly.fit(data[:, 0], data[:, 1], 5, domain=[-1, 1])
-            return True
-
-        def residuals(self, data):
-            return abs(self.params(data[:, 0]) - data[:, 1])
-
     def fit_poly(self):
         if self.model is None:
-            model, inliers = ransac(self.base_points(), TextLine.PolyModel5, 10, 4)
-            self.model = model.params
-            self._inliers = list(itertools.compress(self.letters, inliers))
+            fit_polys([self])
 
         return self.model
 
-    class LineModel(object):
-        def estimate(self, data):
-            self.params = Line.fit(data)
-            return True
-
-        def residuals(self, data):
-            return np.abs(self.params(data[:, 0]) - data[:, 1])
-
     def fit_line(self):
         if self.model_line is None:
-            if len(self) <= 3:
-                self.model_line = Line.fit(self.base_points())
-            else:
-                model, inliers = ransac(self.base_points(), TextLine.LineModel, 3, 4)
-                self.model_line = model.params
-                self._line_inliers = list(itertools.compress(self.letters, inliers))
+            fit_lines([self])
 
         return self.model_line
 
@@ -233,6 +309,25 @@ class TextLine(object):
         self.fit_line()
         return self._line_inliers
 
+# Batched robust baseline fits; fills in the lines that have no model yet.
+def fit_polys(lines):
+    todo = [l for l in lines if l.model is None]
+    fits = robust.fit_polys([l.base_points() for l in todo], 5, 10, 4)
+    for l, (model, inliers) in zip(todo, fits):
+        l.model = model
+        l._inliers = list(itertools.compress(l.letters, inliers))
+
+def fit_lines(lines):
+    todo = [l for l in lines if l.model_line is None]
+    for l in todo:
+        if len(l) <= 3:
+            l.model_line = Line.fit(l.base_points())
+    todo = [l for l in todo if l.model_line is None]
+    fits = robust.fit_polys([l.base_points() for l in todo], 1, 3, 4)
+    for l, (model, inliers) in zip(todo, fits):
+        l.model_line = Line.from_polynomial(model)
+        l._line_inliers = list(itertools.compress(l.letters, inliers))
+
 class Underline(object):
     def __init__(self, label, label_map, stats):
         self.label = label
@@ -1,11 +1,19 @@
 from __future__ import division, print_function
 
 import cv2
+import json
+import logging
 import numpy as np
 import os
 import os.path
-import rawpy
 import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from . import analysis
+
+log = logging.getLogger(__name__)
 
 BLUE = (255, 0, 0)
 GREEN = (0, 255, 0)
@@ -25,10 +33,153 @@ def debug_imwrite(filename, im):
 
     return cv2.imwrite(os.path.join(directory, filename), im)
 
-def imread(path):
-    if path.endswith('.dng'):
+# Logging: every module logs to logging.getLogger(__name__) under 'rebook'.
+# Records carry the current page and debug prefix. Chatter is DEBUG, per-page
+# summaries INFO; setup_logging(debug=False) therefore only shows summaries.
+page = ''
+
+class PrefixFilter(logging.Filter):
+    def filter(self, record):
+        record.page = page
+        record.prefix = '/'.join(debug_prefix)
+        return True
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        message = record.getMessage()
+        where = '/'.join(p for p in (getattr(record, 'page', ''), getattr(record, 'prefix', '')) if p)
+        if record.levelno >= logging.WARNING:
+            message = '{}: {}'.format(record.levelname, message)
+        return '[{}] {}'.format(where, message) if where else message
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record):
+        result = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'page': getattr(record, 'page', ''),
+            'prefix': getattr(record, 'prefix', ''),
+            'msg': record.getMessage(),
+        }
+        if record.exc_info:
+            result['exc'] = self.formatException(record.exc_info)
+        return json.dumps(result)
+
+_log_handler = None
+_log_target = None
+
+# levels: {'rebook.crop': 'WARNING', ...} per-module overrides, also read from
+# $REBOOK_LOG as "rebook.crop=WARNING,rebook.dewarp=DEBUG".
+# json_path: '-' for JSON lines on stderr, a path to append them to a file.
+# Called again (demo: once per image) with the same json_path the handler is
+# kept; otherwise the old one is closed, so no log file stays open.
+def setup_logging(debug=False, json_path=None, levels=None):
+    global _log_handler, _log_target
+    root = logging.getLogger('rebook')
+    if _log_handler is not None and _log_target != json_path:
+        root.removeHandler(_log_handler)
+        _log_handler.close()
+        _log_handler = None
+
+    if _log_handler is None:
+        if json_path is None:
+            handler = logging.StreamHandler()
+            handler.setFormatter(TextFormatter())
+        else:
+            handler = logging.StreamHandler() if json_path == '-' else logging.FileHandler(json_path)
+            handler.setFormatter(JSONFormatter())
+        handler.addFilter(PrefixFilter())
+        root.addHandler(handler)
+        _log_handler, _log_target = handler, json_path
+    root.propagate = False
+    root.setLevel(logging.DEBUG if debug else logging.INFO)
+
+    overrides = dict(levels or {})
+    for item in os.environ.get('REBOOK_LOG', '').split(','):
+        if '=' in item:
+            name, level = item.split('=', 1)
+            overrides[name.strip()] = level.strip()
+    for name, level in overrides.items():
+        logging.getLogger(name).setLevel(level.upper() if isinstance(level, str) else level)
+
+# go_dewarp etc.: configure once if the caller did not, follow lib.debug
+def init_logging(debug=False):
+    if _log_handler is None:
+        setup_logging(debug)
+    else:
+        logging.getLogger('rebook').setLevel(logging.DEBUG if debug else logging.INFO)
+
+RAW_EXTENSIONS = ('.dng',)
+
+def is_raw(path):
+    return path.lower().endswith(RAW_EXTENSIONS)
+
+# Decoded RAW buffers, most recent last: (path, mtime, half_size) -> BGR
+# image, read-only since callers share it. A page is typically decoded at
+# half size for analysis and once more in full for the render.
+RAW_CACHE_SIZE = 2
+_raw_cache = OrderedDict()
+
+def read_raw(path, half_size=False, raw=None):
+    """BGR decode of a RAW file; half_size skips demosaicing (2x2 binning,
+    about 4x faster). raw: an already opened rawpy file for path."""
+    key = (os.path.abspath(path), os.stat(path).st_mtime_ns, half_size)
+    result = _raw_cache.get(key)
+    if result is not None:
+        _raw_cache.move_to_end(key)
+        return result
+
+    if raw is None:
+        import rawpy  # 150 ms to import; only for RAW files
         with rawpy.imread(path) as raw:
-            result = raw.postprocess()
+            return read_raw(path, half_size, raw)
+
+    with timed('raw {} decode'.format('half' if half_size else 'full')):
+        result = cv2.cvtColor(raw.postprocess(half_size=half_size), cv2.COLOR_RGB2BGR)
+    result.flags.writeable = False
+    _raw_cache[key] = result
+    while len(_raw_cache) > RAW_CACHE_SIZE:
+        _raw_cache.popitem(last=False)
+    return result
+
+# A RAW file as the pipeline sees it (rotated by k quarter turns, like
+# np.rot90): half() for detection and estimation, full() only for the final
+# render (dewarp.kim2014 full_res). shape is the full decode's, from the
+# file's metadata; the file is opened once for both decodes.
+class RawImage(object):
+    def __init__(self, path, k=0):
+        import rawpy
+
+        self.path = path
+        self.k = k % 4
+        self.raw = rawpy.imread(path)
+        sizes = self.raw.sizes
+        h, w = (sizes.width, sizes.height) if sizes.flip in (5, 6) else (sizes.height, sizes.width)
+        self.shape = (w, h) if self.k % 2 else (h, w)
+
+    def decode(self, half_size):
+        if self.raw is None:
+            return read_raw(self.path, half_size)
+        return read_raw(self.path, half_size, self.raw)
+
+    def half(self):
+        return np.rot90(self.decode(True), self.k)
+
+    def full(self):
+        result = self.decode(False)
+        self.close()  # nothing is decoded after the full image
+        return np.rot90(result, self.k)
+
+    def close(self):
+        if self.raw is not None:
+            self.raw.close()
+            self.raw = None
+
+def imread(path):
+    if is_raw(path):
+        result = read_raw(path)
     else:
         result = cv2.imread(path, cv2.IMREAD_UNCHANGED)
 
@@ -63,11 +214,40 @@ def timeit(method):
     return timed
 
 def mean_std(im, W):
+    return analysis.memo('mean_std', im, (W,), lambda: _mean_std(im, W))
+
+def _mean_std(im, W):
+    means = np.empty(im.shape, dtype=np.float64)
+    stds = np.empty(im.shape, dtype=np.float64)
+
+    def strip(r0, r1):
+        means[r0:r1], stds[r0:r1] = mean_std_rows(im, W, r0, r1)
+
+    map_strips(strip, im.shape[0])
+    return means, stds
+
+# Indices into an axis of length n, mirrored at both ends like
+# np.pad(mode='reflect'), for any amount of padding.
+def reflect_index(idx, n):
+    if n == 1: return np.zeros_like(idx)
+    idx = np.abs(idx) % (2 * (n - 1))
+    return (n - 1) - np.abs((n - 1) - idx)
+
+# Local mean and standard deviation over a W x W window (image reflected at
+# the border) for output rows r0:r1 only. The window sums come from float64
+# integrals of the strip and are exact for 8-bit images, so any split into
+# strips gives bit-identical results.
+def mean_std_rows(im, W, r0, r1):
     s = W // 2
     N = W * W
+    im_h, im_w = im.shape[:2]
 
-    padded = np.pad(im, (s, s), 'reflect')
-    sum1, sum2 = cv2.integral2(padded, sdepth=cv2.CV_32F)
+    rows = reflect_index(np.arange(r0 - s, r1 + W - 1 - s), im_h)
+    if W - 1 - s < im_w:
+        padded = cv2.copyMakeBorder(im[rows], 0, 0, s, W - 1 - s, cv2.BORDER_REFLECT_101)
+    else:
+        padded = im[rows][:, reflect_index(np.arange(-s, im_w + W - 1 - s), im_w)]
+    sum1, sum2 = cv2.integral2(padded, sdepth=cv2.CV_64F, sqdepth=cv2.CV_64F)
 
     S1 = sum1[W:, W:] - sum1[W:, :-W] - sum1[:-W, W:] + sum1[:-W, :-W]
     S2 = sum2[W:, W:] - sum2[W:, :-W] - sum2[:-W, W:] + sum2[:-W, :-W]
@@ -79,6 +259,39 @@ def mean_std(im, W):
 
     return means, stds
 
+# Row-strip processing: fn(r0, r1) handles rows r0:r1 and writes them into
+# a preallocated output. Strips run on a thread pool (OpenCV and large NumPy
+# operations release the GIL), so peak memory is a few strips' temporaries.
+STRIP_ROWS = 64
+THREADS = None  # None: one per CPU
+
+def strips(h, rows=None):
+    rows = rows or STRIP_ROWS
+    return [(r0, min(r0 + rows, h)) for r0 in range(0, h, rows)]
+
+def map_strips(fn, h, rows=None, threads=None):
+    parallel_map(lambda bound: fn(*bound), strips(h, rows), threads)
+
+def parallel_map(fn, items, threads=None):
+    threads = min(threads or THREADS or os.cpu_count() or 1, len(items))
+    if threads <= 1:
+        return [fn(item) for item in items]
+
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(fn, items))  # re-raises worker exceptions
+
+# Accumulates the wall time of the block into times[name] and logs it.
+@contextmanager
+def timed(name, times=None):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        if times is not None:
+            times[name] = times.get(name, 0) + elapsed
+        log.debug('%s: %.1f ms', name, elapsed * 1000)
+
 def round_point(p):
     try:
         return tuple(np.round(np.atleast_1d(p)).astype(int))
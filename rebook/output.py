@@ -0,0 +1,78 @@
+from __future__ import division, print_function
+
+import cv2
+import logging
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+FORMATS = ('jpg', 'png', 'tif', 'webp')
+ARCHIVE_MODES = ('link', 'copy', 'move')
+
+def extension(fmt, default):
+    """Output extension for format name fmt (None: keep default)."""
+    return '.' + fmt if fmt else default
+
+def encode_params(ext, quality=None, png_compression=None):
+    """cv2.imwrite parameters for ext. None leaves OpenCV's default."""
+    ext = ext.lower()
+    params = []
+    if quality is not None and ext in ('.jpg', '.jpeg'):
+        params += [cv2.IMWRITE_JPEG_QUALITY, quality]
+    elif quality is not None and ext == '.webp':
+        params += [cv2.IMWRITE_WEBP_QUALITY, quality]
+    elif png_compression is not None and ext == '.png':
+        params += [cv2.IMWRITE_PNG_COMPRESSION, png_compression]
+    return params
+
+def archive(path, folder, mode='link'):
+    """Put the original file at path into folder without re-encoding it:
+    hardlink (copy if folder is on another file system), copy or move."""
+    target = os.path.join(folder, os.path.basename(path))
+    if os.path.exists(target):
+        if os.path.samefile(path, target):
+            return target
+        os.remove(target)
+
+    if mode == 'move':
+        shutil.move(path, target)
+    elif mode == 'link':
+        try:
+            os.link(path, target)
+        except OSError:  # cross-device, or no hardlinks on this file system
+            shutil.copyfile(path, target)
+    else:
+        shutil.copyfile(path, target)
+    return target
+
+# Encodes and writes images on a background thread (cv2.imwrite releases
+# the GIL), so disk I/O overlaps with the next page. Images must not be
+# modified after write(). close() waits and re-raises the first error.
+class Writer(object):
+    def __init__(self, threads=1):
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.pending = []
+
+    def write(self, path, im, params=()):
+        self.pending.append(self.executor.submit(self._write, path, im, list(params)))
+
+    @staticmethod
+    def _write(path, im, params):
+        if not cv2.imwrite(path, im, params):
+            raise IOError('could not write {}'.format(path))
+
+    def close(self):
+        try:
+            for future in self.pending:
+                future.result()
+        finally:
+            self.pending = []
+            self.executor.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,184 @@
+from __future__ import division, print_function
+
+import cv2
+import logging
+import numpy as np
+import os
+import struct
+import zlib
+
+log = logging.getLogger(__name__)
+
+# PDF built one page at a time from encoded page images, without decoding
+# them: JPEG goes in as DCT as it stands, PNG (gray, RGB or palette, not
+# interlaced) as its IDAT data, which is a Flate stream with PNG predictors.
+# Dimensions come from the headers. Only other images (alpha, TIFF, ...)
+# are decoded and deflated, bilevel ones at 1 bit per pixel. Each page is
+# written out when added; close() writes the page tree and xref.
+LETTER = (8.5, 11.0)  # inches
+
+class ImageInfo(object):
+    def __init__(self, width, height, filter, data, colorspace, bpc, params=None, decode=None):
+        self.width, self.height = width, height
+        self.filter, self.data = filter, data
+        self.colorspace, self.bpc = colorspace, bpc
+        self.params, self.decode = params, decode
+
+SOF_MARKERS = set(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}
+
+def jpeg_info(data):
+    pos, adobe = 2, False
+    while pos + 4 <= len(data):
+        if data[pos] != 0xff:
+            pos += 1
+            continue
+        marker = data[pos + 1]
+        if marker == 0xff or 0xd0 <= marker <= 0xd9 or marker == 0x01:
+            pos += 2 if marker != 0xff else 1
+            continue
+        length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if marker == 0xee and data[pos + 4:pos + 9] == b'Adobe':
+            adobe = True
+        if marker in SOF_MARKERS:
+            bpc, height, width, components = struct.unpack('>BHHB', data[pos + 4:pos + 10])
+            colorspace = {1: '/DeviceGray', 3: '/DeviceRGB', 4: '/DeviceCMYK'}[components]
+            # Adobe CMYK JPEGs store inverted values
+            decode = '[1 0 1 0 1 0 1 0]' if components == 4 and adobe else None
+            return ImageInfo(width, height, '/DCTDecode', data, colorspace, bpc, decode=decode)
+        pos += 2 + length
+    raise ValueError('no JPEG frame header')
+
+def png_info(data):
+    pos, idat, palette = 8, [], None
+    while pos + 8 <= len(data):
+        length, kind = struct.unpack('>I4s', data[pos:pos + 8])
+        body = data[pos + 8:pos + 8 + length]
+        if kind == b'IHDR':
+            width, height, bpc, color_type, _, _, interlace = struct.unpack('>IIBBBBB', body)
+        elif kind == b'PLTE':
+            palette = body
+        elif kind == b'IDAT':
+            idat.append(body)
+        elif kind == b'IEND':
+            break
+        pos += 12 + length
+
+    if interlace or color_type not in (0, 2, 3):
+        return None  # alpha or Adam7: no passthrough
+    colors = 3 if color_type == 2 else 1
+    if color_type == 3:
+        colorspace = '[/Indexed /DeviceRGB {} <{}>]'.format(len(palette) // 3 - 1, palette.hex())
+    else:
+        colorspace = '/DeviceRGB' if colors == 3 else '/DeviceGray'
+    params = '<< /Predictor 15 /Colors {} /BitsPerComponent {} /Columns {} >>'.format(colors, bpc, width)
+    return ImageInfo(width, height, '/FlateDecode', b''.join(idat), colorspace, bpc, params=params)
+
+def decoded_info(data):
+    im = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_UNCHANGED)
+    if im is None:
+        raise ValueError('cannot decode image')
+    if im.dtype != np.uint8:
+        im = cv2.convertScaleAbs(im, alpha=255.0 / np.iinfo(im.dtype).max)
+    if im.ndim == 3:
+        im = cv2.cvtColor(im, cv2.COLOR_BGRA2RGB if im.shape[2] == 4 else cv2.COLOR_BGR2RGB)
+    height, width = im.shape[:2]
+    if im.ndim == 2 and np.all((im == 0) | (im == 255)):
+        return ImageInfo(width, height, '/FlateDecode', zlib.compress(np.packbits(im, axis=1).tobytes()),
+                         '/DeviceGray', 1)
+    colorspace = '/DeviceRGB' if im.ndim == 3 else '/DeviceGray'
+    return ImageInfo(width, height, '/FlateDecode', zlib.compress(im.tobytes()), colorspace, 8)
+
+def image_info(data):
+    if data[:3] == b'\xff\xd8\xff':
+        return jpeg_info(data)
+    if data[:8] == b'\x89PNG\r\n\x1a\n':
+        info = png_info(data)
+        if info is not None:
+            return info
+    return decoded_info(data)
+
+class PDFWriter(object):
+    def __init__(self, path, page_size=LETTER):
+        self.path = path
+        self.page_w, self.page_h = page_size[0] * 72, page_size[1] * 72
+        self.out = open(path + '.part', 'wb')
+        self.out.write(b'%PDF-1.5\n%\xe2\xe3\xcf\xd3\n')
+        self.offsets = {}
+        self.next_num = 3  # 1: catalog, 2: page tree, written by close()
+        self.pages = []
+
+    def write_object(self, num, body, stream=None):
+        self.offsets[num] = self.out.tell()
+        self.out.write('{} 0 obj\n'.format(num).encode())
+        if stream is None:
+            self.out.write(body.encode() + b'\nendobj\n')
+        else:
+            self.out.write(body.encode() + b'\nstream\n')
+            self.out.write(stream)
+            self.out.write(b'\nendstream\nendobj\n')
+
+    def reserve(self, n):
+        nums = range(self.next_num, self.next_num + n)
+        self.next_num += n
+        return nums
+
+    # Image centred on the page at dpi; scaled to fit the page if dpi is
+    # None or it would not fit.
+    def add_image(self, data, dpi=None):
+        info = image_info(data)
+        if dpi:
+            w, h = info.width / dpi * 72, info.height / dpi * 72
+        else:
+            w, h = info.width, info.height
+        fit = min(self.page_w / w, self.page_h / h)
+        if dpi:
+            fit = min(1.0, fit)
+        w, h = w * fit, h * fit
+        x, y = (self.page_w - w) / 2, (self.page_h - h) / 2
+
+        image_num, content_num, page_num = self.reserve(3)
+        extra = ''.join(' /{} {}'.format(k, v) for k, v in
+                        [('DecodeParms', info.params), ('Decode', info.decode)] if v)
+        self.write_object(image_num, '<< /Type /XObject /Subtype /Image /Width {} /Height {} '
+                          '/ColorSpace {} /BitsPerComponent {} /Filter {}{} /Length {} >>'.format(
+                              info.width, info.height, info.colorspace, info.bpc, info.filter,
+                              extra, len(info.data)), info.data)
+        content = 'q {:.4f} 0 0 {:.4f} {:.4f} {:.4f} cm /Im0 Do Q'.format(w, h, x, y).encode()
+        self.write_object(content_num, '<< /Length {} >>'.format(len(content)), content)
+        self.write_object(page_num, '<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {:g} {:g}] '
+                          '/Resources << /XObject << /Im0 {} 0 R >> >> /Contents {} 0 R >>'.format(
+                              self.page_w, self.page_h, image_num, content_num))
+        self.pages.append(page_num)
+        self.out.flush()
+
+    def add_file(self, path, dpi=None):
+        with open(path, 'rb') as f:
+            self.add_image(f.read(), dpi)
+
+    def close(self):
+        kids = ' '.join('{} 0 R'.format(num) for num in self.pages)
+        self.write_object(2, '<< /Type /Pages /Kids [{}] /Count {} >>'.format(kids, len(self.pages)))
+        self.write_object(1, '<< /Type /Catalog /Pages 2 0 R >>')
+
+        xref = self.out.tell()
+        self.out.write('xref\n0 {}\n0000000000 65535 f \n'.format(self.next_num).encode())
+        for num in range(1, self.next_num):
+            self.out.write('{:010d} 00000 n \n'.format(self.offsets[num]).encode())
+        self.out.write('trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n'.format(
+            self.next_num, xref).encode())
+        self.out.close()
+        os.replace(self.path + '.part', self.path)
+
+    # drop the partial file, leaving any existing PDF at path alone
+    def abort(self):
+        self.out.close()
+        os.remove(self.path + '.part')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
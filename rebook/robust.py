@@ -0,0 +1,83 @@
+from __future__ import division, print_function
+
+import numpy as np
+from numpy.polynomial import Polynomial as Poly
+
+# Batched RANSAC for polynomial fits v = p(u). All datasets (e.g. all lines of
+# a page) are sampled, fitted and scored together in NumPy. Same selection
+# rule as skimage.measure.ransac: most inliers, then smallest sum of squared
+# residuals, then the earliest trial; the final model is refitted on the
+# inliers with Poly.fit. Runs a fixed number of trials (no early stopping),
+# seeded, so results are reproducible.
+SEED = 0
+MAX_TRIALS = 100
+
+def fit_polys(datasets, degree, min_samples, threshold, transpose=False,
+              max_trials=MAX_TRIALS, seed=None):
+    """Robust fit of v = p(u) on each (N, 2) array of (u, v) points.
+
+    transpose: points are (v, u), i.e. fit x = p(y).
+    min_samples, threshold: scalar or one per dataset.
+    Returns [(Poly, inliers)]; (None, None) when a dataset has no inliers.
+    """
+    n_sets = len(datasets)
+    if n_sets == 0: return []
+
+    sizes = np.array([len(points) for points in datasets])
+    min_samples = np.minimum(np.broadcast_to(min_samples, n_sets), sizes).astype(int)
+    threshold = np.broadcast_to(np.asarray(threshold, dtype=np.float64), (n_sets,))
+
+    N = max(sizes.max(), 1)
+    K = max(min_samples.max(), 1)
+    u = np.zeros((n_sets, N))
+    v = np.zeros((n_sets, N))
+    for i, points in enumerate(datasets):
+        if len(points) == 0: continue
+        points = np.asarray(points, dtype=np.float64)
+        u[i, :len(points)], v[i, :len(points)] = (points[:, 1], points[:, 0]) \
+            if transpose else (points[:, 0], points[:, 1])
+    valid = np.arange(N) < sizes[:, np.newaxis]
+
+    # hypotheses are fitted on u scaled to [-1, 1] per dataset
+    u_min = np.where(valid, u, np.inf).min(axis=1, keepdims=True)
+    u_max = np.where(valid, u, -np.inf).max(axis=1, keepdims=True)
+    center = np.where(sizes[:, np.newaxis] > 0, (u_min + u_max) / 2, 0)
+    scale = np.where(sizes[:, np.newaxis] > 0, (u_max - u_min) / 2, 1)
+    scale[scale == 0] = 1
+    V = np.polynomial.polynomial.polyvander((u - center) / scale, degree)  # (sets, N, d+1)
+
+    # min_samples distinct random points per dataset and trial: the K smallest
+    # of a random key per point, of which the first min_samples are used
+    rng = np.random.default_rng(SEED if seed is None else seed)
+    keys = rng.random((max_trials, n_sets, N))
+    keys[:, ~valid] = 2
+    idx = np.argpartition(keys, K - 1, axis=2)[:, :, :K] if K < N else \
+        np.broadcast_to(np.arange(N), keys.shape)
+    idx = np.take_along_axis(idx, np.argsort(np.take_along_axis(keys, idx, axis=2), axis=2), axis=2)
+    weights = (np.arange(K) < min_samples[:, np.newaxis]).astype(np.float64)  # (sets, K)
+
+    set_index = np.arange(n_sets)[:, np.newaxis]
+    A = V[set_index, idx] * weights[..., np.newaxis]  # (trials, sets, K, d+1)
+    b = v[set_index, idx] * weights
+    coef = np.matmul(np.linalg.pinv(A), b[..., np.newaxis])[..., 0]  # (trials, sets, d+1)
+
+    residuals = np.abs(np.einsum('snd,tsd->tsn', V, coef) - v)
+    inliers = (residuals < threshold[:, np.newaxis]) & valid
+    counts = inliers.sum(axis=2)
+    ssr = np.where(valid, residuals * residuals, 0).sum(axis=2)
+    best = np.lexsort((ssr, -counts), axis=0)[0]  # stable: earliest trial wins ties
+
+    result = []
+    for i in range(n_sets):
+        best_inliers = inliers[best[i], i, :sizes[i]]
+        if not best_inliers.any():
+            result.append((None, None))
+            continue
+        model = Poly.fit(u[i, :sizes[i]][best_inliers], v[i, :sizes[i]][best_inliers],
+                         degree, domain=[-1, 1])
+        result.append((model, best_inliers))
+
+    return result
+
+def fit_poly(points, degree, min_samples, threshold, **kwargs):
+    return fit_polys([points], degree, min_samples, threshold, **kwargs)[0]
@@ -0,0 +1,133 @@
+from __future__ import division, print_function
+
+import ast
+import cv2
+import logging
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+# Book segmentation without torch: a YOLOv8/11 segmentation model exported
+# to ONNX (yolo export model=yolov8l-seg.pt format=onnx), run on
+# onnxruntime like RapidOCR. Pre- and post-processing follow the
+# ultralytics predictor (LetterBox, class-aware NMS, process_mask,
+# masks2segments/scale_coords), so the polygons match its masks.xy.
+CONF = 0.25
+IOU = 0.7
+MAX_DET = 300
+MAX_WH = 7680  # box offset per class for class-aware NMS
+PAD_VALUE = 114
+COCO_BOOK = 73
+
+def letterbox(im, shape, auto=False, stride=32):
+    """im resized to fit shape (h, w) keeping aspect, centred on gray.
+    auto: pad only up to a multiple of stride (dynamic-shape models).
+    Returns (padded, gain, (pad_w, pad_h))."""
+    h, w = im.shape[:2]
+    gain = min(shape[0] / h, shape[1] / w)
+    new_w, new_h = int(round(w * gain)), int(round(h * gain))
+    dw, dh = shape[1] - new_w, shape[0] - new_h
+    if auto:
+        dw, dh = dw % stride, dh % stride
+    dw, dh = dw / 2, dh / 2
+
+    if (new_w, new_h) != (w, h):
+        im = cv2.resize(im, (new_w, new_h), interpolation=cv2.INTER_LINEAR)
+    top, bottom = int(round(dh - 0.1)), int(round(dh + 0.1))
+    left, right = int(round(dw - 0.1)), int(round(dw + 0.1))
+    padded = cv2.copyMakeBorder(im, top, bottom, left, right, cv2.BORDER_CONSTANT,
+                                value=(PAD_VALUE,) * 3)
+    return padded, gain, (left, top)
+
+def nms(boxes, scores, classes, iou=IOU, max_det=MAX_DET):
+    """Indices kept by class-aware NMS, by descending score. boxes xyxy."""
+    if len(boxes) == 0:
+        return np.zeros(0, int)
+    shifted = boxes + (classes * MAX_WH)[:, None]
+    xywh = np.concatenate([shifted[:, :2], shifted[:, 2:] - shifted[:, :2]], axis=1)
+    keep = cv2.dnn.NMSBoxes(xywh.tolist(), scores.tolist(), 0.0, iou)
+    keep = np.array(keep, int).reshape(-1)
+    return keep[np.argsort(-scores[keep], kind='stable')][:max_det]
+
+def process_masks(protos, coefficients, boxes, shape):
+    """Binary masks (n, h, w) at input shape from prototypes (c, mh, mw),
+    per-detection coefficients and xyxy boxes in input coordinates. Logits
+    are cut to the box at prototype resolution, then upsampled."""
+    c, mh, mw = protos.shape
+    logits = coefficients.dot(protos.reshape(c, -1)).reshape(-1, mh, mw)
+    h, w = shape
+    cols, rows = np.arange(mw), np.arange(mh)[:, None]
+    scaled = boxes * np.array([mw / w, mh / h] * 2)
+    masks = np.zeros((len(boxes), h, w), np.uint8)
+    for i, (logit, (x1, y1, x2, y2)) in enumerate(zip(logits, scaled)):
+        inside = (cols >= x1) & (cols < x2) & (rows >= y1) & (rows < y2)
+        up = cv2.resize(logit * inside, (w, h), interpolation=cv2.INTER_LINEAR)
+        masks[i] = up > 0
+    return masks
+
+def mask_polygon(mask, gain, pad, image_shape):
+    """Largest outline of mask as float32 (N, 2) in image coordinates."""
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return np.zeros((0, 2), np.float32)
+    xy = max(contours, key=len).reshape(-1, 2).astype(np.float32)
+    xy = ((xy - pad) / gain).astype(np.float32)
+    xy[:, 0] = xy[:, 0].clip(0, image_shape[1])
+    xy[:, 1] = xy[:, 1].clip(0, image_shape[0])
+    return xy
+
+def read_names(session):
+    """Class names from the ultralytics export metadata; COCO book otherwise."""
+    meta = session.get_modelmeta().custom_metadata_map
+    if 'names' in meta:
+        return ast.literal_eval(meta['names'])
+    log.warning('no class names in model metadata, assuming COCO')
+    return {COCO_BOOK: 'book'}
+
+class OnnxSegmenter(object):
+    def __init__(self, path, providers=None, threads=None):
+        import onnxruntime
+
+        options = onnxruntime.SessionOptions()
+        if threads is not None:
+            options.intra_op_num_threads = threads
+        self.session = onnxruntime.InferenceSession(
+            path, options, providers=providers or ['CPUExecutionProvider'])
+        self.input = self.session.get_inputs()[0]
+        self.names = read_names(self.session)
+        _, _, h, w = self.input.shape
+        # dynamic axes come through as names or None
+        self.shape = (h, w) if isinstance(h, int) and isinstance(w, int) else None
+
+    def polygons(self, frame, size=640):
+        """(label, float32 (N, 2) polygon) per detection, frame coordinates."""
+        shape = self.shape or (size, size)
+        padded, gain, pad = letterbox(frame, shape, auto=self.shape is None)
+        blob = cv2.dnn.blobFromImage(padded, 1 / 255, swapRB=True)
+        output, protos = self.session.run(None, {self.input.name: blob})
+
+        n_masks = protos.shape[1]
+        predictions = output[0].T  # (anchors, 4 + classes + masks)
+        class_scores = predictions[:, 4:-n_masks]
+        classes = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(classes)), classes]
+        candidates = scores > CONF
+        predictions, classes, scores = predictions[candidates], classes[candidates], scores[candidates]
+
+        cx, cy, bw, bh = predictions[:, :4].T
+        boxes = np.stack([cx - bw / 2, cy - bh / 2, cx + bw / 2, cy + bh / 2], axis=1)
+        keep = nms(boxes, scores, classes)
+        masks = process_masks(protos[0], predictions[keep, -n_masks:], boxes[keep],
+                              padded.shape[:2])
+
+        return [(self.names.get(int(classes[k]), str(classes[k])),
+                 mask_polygon(mask, gain, pad, frame.shape))
+                for k, mask in zip(keep, masks)]
+
+def load_model(path):
+    """Segmentation model for spliter.segment_book: .onnx files run on
+    onnxruntime, anything else goes to ultralytics YOLO."""
+    if path.lower().endswith('.onnx'):
+        return OnnxSegmenter(path)
+    from ultralytics import YOLO
+    return YOLO(path)
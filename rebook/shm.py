@@ -0,0 +1,137 @@
+from __future__ import division, print_function
+
+import logging
+import multiprocessing
+import numpy as np
+import queue
+from collections import namedtuple
+from contextlib import contextmanager
+from multiprocessing import shared_memory
+
+log = logging.getLogger(__name__)
+
+# Images handed between pipeline processes through shared memory instead of
+# pickles. An ImagePool is one segment cut into fixed-size slots; put()
+# copies an array into a free slot and returns a Handle, which pickles to a
+# few bytes. Any process that has the pool maps the segment once and gets
+# a view of the slot with get(); nothing else is copied.
+#
+# Lifetime is explicit: a slot belongs to whoever holds its handle until
+# release() (or take(), or the lease() block ends) puts it back on the free
+# list. Views must not be used after that, and all views must be gone
+# before close(). The free list is a multiprocessing queue, so alloc()
+# blocks while all slots are out: that is the back-pressure between stages.
+# A shared flag per slot marks it out, so releasing a handle twice (which
+# would hand the slot to two owners) raises instead.
+# Worker processes get the pool at start-up (Pool/ProcessPoolExecutor
+# initializer=install, initargs=(pool,)); it cannot be sent with a task.
+# The process that created the pool unlinks the segment in close(); workers
+# must be its children, so they share its resource tracker.
+
+Handle = namedtuple('Handle', 'slot shape dtype')
+
+def attach_segment(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)  # 3.13+
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+class ImagePool(object):
+    def __init__(self, slots, slot_bytes, ctx=None):
+        ctx = ctx or multiprocessing.get_context()
+        self.slots, self.slot_bytes = slots, slot_bytes
+        self.shm = shared_memory.SharedMemory(create=True, size=slots * slot_bytes)
+        self.name = self.shm.name
+        self.free = ctx.Queue()
+        for slot in range(slots):
+            self.free.put(slot)
+        self.out = ctx.Array('b', slots)  # zeroed; has its own lock
+        self.owner = True
+
+    @classmethod
+    def for_images(cls, slots, shape, dtype=np.uint8, ctx=None):
+        """Pool whose slots hold an image of shape (or anything smaller)."""
+        return cls(slots, int(np.prod(shape)) * np.dtype(dtype).itemsize, ctx)
+
+    # pickled only when a worker process is started
+    def __getstate__(self):
+        return dict(name=self.name, slots=self.slots, slot_bytes=self.slot_bytes,
+                    free=self.free, out=self.out)
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm, self.owner = None, False
+
+    def array(self, handle):
+        if self.shm is None:
+            self.shm = attach_segment(self.name)
+        # frombuffer keeps the buffer exported, so close() refuses to unmap
+        # under a live view (np.ndarray(buffer=...) would not: segfault)
+        count = int(np.prod(handle.shape))
+        return np.frombuffer(self.shm.buf, handle.dtype, count,
+                             handle.slot * self.slot_bytes).reshape(handle.shape)
+
+    def alloc(self, shape, dtype=np.uint8, timeout=None):
+        """Handle to a free slot for an array of shape and dtype. Blocks
+        until a slot is released; TimeoutError after timeout seconds."""
+        shape, dtype = tuple(int(n) for n in shape), np.dtype(dtype)
+        nbytes = int(np.prod(shape)) * dtype.itemsize
+        if nbytes > self.slot_bytes:
+            raise ValueError('{} {} does not fit a {} byte slot'.format(shape, dtype, self.slot_bytes))
+        try:
+            slot = self.free.get(timeout=timeout)
+        except queue.Empty:
+            raise TimeoutError('no free slot in {} s'.format(timeout))
+        with self.out.get_lock():
+            self.out[slot] = 1
+        return Handle(slot, shape, dtype.str)
+
+    def put(self, im, timeout=None):
+        handle = self.alloc(im.shape, im.dtype, timeout)
+        self.array(handle)[...] = im
+        return handle
+
+    def get(self, handle):
+        """View of the slot; valid until the handle is released."""
+        return self.array(handle)
+
+    def take(self, handle):
+        """Private copy of the slot, which is released."""
+        im = self.array(handle).copy()
+        self.release(handle)
+        return im
+
+    def release(self, handle):
+        with self.out.get_lock():
+            if not self.out[handle.slot]:
+                raise ValueError('slot {} is not out: released twice?'.format(handle.slot))
+            self.out[handle.slot] = 0
+        self.free.put(handle.slot)
+
+    @contextmanager
+    def lease(self, handle):
+        try:
+            yield self.array(handle)
+        finally:
+            self.release(handle)
+
+    def close(self):
+        if self.shm is None:
+            return
+        shm, self.shm = self.shm, None
+        if self.owner:
+            shm.unlink()
+        shm.close()  # BufferError while views are still alive
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# pool of this worker process, set by install()
+pool = None
+
+def install(image_pool):
+    global pool
+    pool = image_pool
@@ -0,0 +1,375 @@
+from __future__ import division, print_function
+
+import cv2
+import logging
+import mmap
+import numpy as np
+import os
+import re
+import struct
+import zipfile
+import zlib
+from collections import namedtuple
+from subprocess import check_call
+
+from . import lib
+
+log = logging.getLogger(__name__)
+
+# Input images as a stream of pages, read straight from files, ZIP members
+# and the image streams embedded in PDFs, in reading order. Pages hold the
+# encoded bytes (or a path) rather than pixels: they are small to send to a
+# worker process, which decodes them (decode()).
+#
+# name: path-like name for the outputs (book.pdf -> book/page-000.jpg).
+# kind: 'file' (data: path on disk), 'encoded' (data: bytes for
+#       cv2.imdecode) or 'samples' (data: Samples, raw PDF image data).
+Page = namedtuple('Page', 'name kind data')
+Samples = namedtuple('Samples', 'data compressed width height bpc colors invert')
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.tif', '.tiff') + lib.RAW_EXTENSIONS
+
+def sorted_numeric(strings):
+    return sorted(strings, key=lambda f: list(map(int, re.findall('[0-9]+', f))))
+
+def iter_pages(targets):
+    for path in targets:
+        assert os.path.exists(path), path
+        if os.path.isfile(path):
+            lower = path.lower()
+            if lower.endswith('.pdf'):
+                for page in iter_pdf(path): yield page
+            elif lower.endswith('.zip'):
+                for page in iter_zip(path): yield page
+            elif lower.endswith(IMAGE_EXTENSIONS):
+                yield Page(path, 'file', path)
+        else:
+            files = [os.path.join(path, base) for base in sorted_numeric(os.listdir(path))]
+            for page in iter_pages(files): yield page
+
+def decode(page):
+    if page.kind == 'file':
+        return lib.imread(page.data)
+    elif page.kind == 'encoded':
+        return cv2.imdecode(np.frombuffer(page.data, np.uint8), cv2.IMREAD_UNCHANGED)
+    else:
+        return decode_samples(page.data)
+
+def decode_samples(s):
+    data = zlib.decompress(s.data) if s.compressed else s.data
+    row_bytes = (s.width * s.colors * s.bpc + 7) // 8
+    rows = np.frombuffer(data, np.uint8)[:row_bytes * s.height].reshape(s.height, row_bytes)
+    if s.bpc == 1:
+        im = np.unpackbits(rows, axis=1)[:, :s.width] * np.uint8(255)
+    elif s.bpc == 8:
+        im = rows.reshape(s.height, s.width, s.colors)
+    else:
+        raise ValueError('unsupported bits per component: {}'.format(s.bpc))
+
+    if s.invert:
+        im = 255 - im
+    if s.colors == 1:
+        return im.reshape(s.height, s.width)
+    elif s.colors == 3:
+        return cv2.cvtColor(im, cv2.COLOR_RGB2BGR)
+    else:  # CMYK
+        cmy, k = 255 - im[:, :, 2::-1].astype(np.uint16), 255 - im[:, :, 3:].astype(np.uint16)
+        return (cmy * k // 255).astype(np.uint8)
+
+# ZIP members are read one at a time, in numeric order of their names.
+def iter_zip(path):
+    directory = os.path.dirname(path)
+    with zipfile.ZipFile(path) as archive:
+        names = [info.filename for info in archive.infolist()
+                 if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)]
+        for name in sorted_numeric(names):
+            if name.lower().endswith(lib.RAW_EXTENSIONS):
+                log.warning('%s: skipping RAW member %s (needs a file on disk)', path, name)
+                continue
+            yield Page(os.path.join(directory, name), 'encoded', archive.read(name))
+
+# PDF: images in page order. Needs no PDF library: the object parser below
+# reads dictionaries only, and image streams are passed on undecoded
+# (DCT -> .jpg, JPX -> .jp2, Flate with PNG predictors -> .png container).
+# Anything else (CCITT, JBIG2, indexed colour) falls back to pdfimages.
+def iter_pdf(path):
+    with open(path, 'rb') as f:
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        pdf = PDF(data)
+        images = pdf.page_images()
+        unsupported = [image for image in images if pdf.image_format(image) is None]
+        if unsupported:
+            log.warning('%s: %d images in formats that need pdfimages', path, len(unsupported))
+            for page in iter_pages([pdfimages(path)]): yield page
+            return
+
+        base = path[:-4]
+        for i, image in enumerate(images):
+            yield pdf.image_page(image, os.path.join(base, 'page-{:03d}'.format(i)))
+    finally:
+        data.close()
+
+def pdfimages(pdf_filename):
+    assert pdf_filename.endswith('.pdf')
+    dirpath = pdf_filename[:-4]
+    if not os.path.isdir(dirpath):
+        os.makedirs(dirpath)
+    if not os.listdir(dirpath):
+        check_call(['pdfimages', '-png', pdf_filename, os.path.join(dirpath, 'page')])
+    return dirpath
+
+# names are str, strings bytes
+Ref = namedtuple('Ref', 'num gen')
+
+WHITESPACE = b'\x00\t\n\x0c\r '
+OBJ_RE = re.compile(rb'(\d+)\s+(\d+)\s+obj\b')
+TOKEN_RE = re.compile(rb'[^\x00\t\n\x0c\r ()<>\[\]{}/%]+')
+NUMBER_RE = re.compile(rb'[+-]?(\d+\.?\d*|\.\d+)$')
+REF_RE = re.compile(rb'\s*(\d+)\s+R\b')
+
+def skip_space(data, pos):
+    n = len(data)
+    while pos < n:
+        c = data[pos]
+        if c in WHITESPACE:
+            pos += 1
+        elif c == 0x25:  # %: comment to end of line
+            while pos < n and data[pos] not in b'\r\n': pos += 1
+        else:
+            break
+    return pos
+
+# One PDF object at pos: (value, end position).
+def parse(data, pos):
+    pos = skip_space(data, pos)
+    c = data[pos:pos + 2]
+    if c == b'<<':
+        result, pos = {}, pos + 2
+        while True:
+            pos = skip_space(data, pos)
+            if data[pos:pos + 2] == b'>>':
+                return result, pos + 2
+            key, pos = parse(data, pos)
+            result[key], pos = parse(data, pos)
+    elif c[:1] == b'[':
+        result, pos = [], pos + 1
+        while True:
+            pos = skip_space(data, pos)
+            if data[pos:pos + 1] == b']':
+                return result, pos + 1
+            value, pos = parse(data, pos)
+            result.append(value)
+    elif c[:1] == b'/':
+        m = TOKEN_RE.match(data, pos + 1)
+        token = m.group() if m else b''
+        name = re.sub(rb'#([0-9a-fA-F]{2})', lambda h: bytes([int(h.group(1), 16)]), token)
+        return name.decode('latin-1'), pos + 1 + len(token)
+    elif c[:1] == b'(':
+        depth, start, pos = 1, pos + 1, pos + 1
+        while depth:
+            ch = data[pos]
+            if ch == 0x5c: pos += 1  # backslash escape
+            elif ch == 0x28: depth += 1
+            elif ch == 0x29: depth -= 1
+            pos += 1
+        return bytes(data[start:pos - 1]), pos
+    elif c[:1] == b'<':
+        end = data.find(b'>', pos)
+        return bytes(data[pos + 1:end]), end + 1
+    else:
+        m = TOKEN_RE.match(data, pos)
+        token = m.group()
+        pos += len(token)
+        if NUMBER_RE.match(token):
+            if b'.' not in token:
+                ref = REF_RE.match(data, pos)
+                if ref:
+                    return Ref(int(token), int(ref.group(1))), ref.end()
+                return int(token), pos
+            return float(token), pos
+        return {b'true': True, b'false': False, b'null': None}.get(token, token), pos
+
+class PDF(object):
+    def __init__(self, data):
+        self.data = data
+        self.objects = {}  # num -> (value, stream start, stream length)
+        self.scan()
+
+    # Every 'n g obj' in file order, stepping over stream contents; later
+    # definitions (incremental updates) win. Object streams are unpacked.
+    def scan(self):
+        data, pos = self.data, 0
+        object_streams = []
+        while True:
+            m = OBJ_RE.search(data, pos)
+            if m is None: break
+            try:
+                value, pos = parse(data, m.end())
+            except (IndexError, AttributeError, ValueError):
+                pos = m.end()
+                continue
+            start = length = None
+            after = skip_space(data, pos)
+            if isinstance(value, dict) and data[after:after + 6] == b'stream':
+                start = after + 6
+                start += 2 if data[start:start + 2] == b'\r\n' else 1
+                length = self.length(value, start)
+                pos = start + length
+                if value.get('Type') == 'ObjStm':
+                    object_streams.append(int(m.group(1)))
+            self.objects[int(m.group(1))] = (value, start, length)
+
+        for num in object_streams:
+            self.unpack(num)
+
+    def unpack(self, num):
+        header, _, _ = self.objects[num]
+        body = self.stream(num)
+        first, n = header['First'], header['N']
+        numbers = list(map(int, body[:first].split()))
+        for obj, offset in zip(numbers[0:2 * n:2], numbers[1:2 * n:2]):
+            if obj not in self.objects:
+                self.objects[obj] = (parse(body, first + offset)[0], None, None)
+
+    def value(self, v):
+        while isinstance(v, Ref):
+            entry = self.objects.get(v.num)
+            v = entry[0] if entry else None
+        return v
+
+    # /Length, unless it is missing, wrong or not read yet (an indirect
+    # length usually follows its stream): then up to endstream, less the EOL.
+    def length(self, header, start):
+        data = self.data
+        length = self.value(header.get('Length'))
+        if isinstance(length, int) and data[start + length:start + length + 32].find(b'endstream') >= 0:
+            return length
+        end = data.find(b'endstream', start)
+        if data[end - 2:end] == b'\r\n': end -= 2
+        elif data[end - 1:end] in (b'\n', b'\r'): end -= 1
+        return end - start
+
+    def raw_stream(self, num):
+        header, start, _ = self.objects[num]
+        return bytes(self.data[start:start + self.length(header, start)])
+
+    def stream(self, num):
+        header, _, _ = self.objects[num]
+        body = self.raw_stream(num)
+        filters = self.value(header.get('Filter'))
+        for name in filters if isinstance(filters, list) else [filters] if filters else []:
+            if self.value(name) != 'FlateDecode':
+                raise ValueError('unsupported filter {}'.format(name))
+            body = zlib.decompress(body)
+        return body
+
+    def catalog(self):
+        for value, _, _ in reversed(list(self.objects.values())):
+            if isinstance(value, dict) and value.get('Type') == 'Catalog':
+                return value
+        return None
+
+    # Image XObject numbers drawn on each page, pages in order (object order
+    # if the page tree can't be read).
+    def page_images(self):
+        catalog = self.catalog()
+        images = []
+        if catalog is not None:
+            self.walk(self.value(catalog.get('Pages')), None, images, set())
+        if not images:
+            images = [num for num, (value, start, _) in sorted(self.objects.items())
+                      if start is not None and value.get('Subtype') == 'Image']
+        return images
+
+    def walk(self, node, resources, images, seen):
+        if not isinstance(node, dict) or id(node) in seen: return
+        seen.add(id(node))
+        resources = self.value(node.get('Resources', resources))
+        if node.get('Type') == 'Pages' or 'Kids' in node:
+            for kid in self.value(node.get('Kids')) or []:
+                self.walk(self.value(kid), resources, images, seen)
+        else:
+            self.xobject_images(resources, images, depth=0)
+
+    def xobject_images(self, resources, images, depth):
+        if not isinstance(resources, dict) or depth > 4: return
+        xobjects = self.value(resources.get('XObject')) or {}
+        for ref in xobjects.values():
+            if not isinstance(ref, Ref) or ref.num not in self.objects: continue
+            value, start, _ = self.objects[ref.num]
+            if start is None: continue
+            if value.get('Subtype') == 'Image':
+                images.append(ref.num)
+            elif value.get('Subtype') == 'Form':
+                self.xobject_images(self.value(value.get('Resources')), images, depth + 1)
+
+    def colors(self, space):
+        space = self.value(space)
+        if isinstance(space, list):
+            family = self.value(space[0])
+            if family == 'ICCBased':
+                return self.value((self.value(space[1]) or {}).get('N'))
+            if family == 'CalRGB': return 3
+            if family == 'CalGray': return 1
+            return None  # Indexed, Separation, DeviceN, Lab
+        return {'DeviceGray': 1, 'DeviceRGB': 3, 'DeviceCMYK': 4}.get(space)
+
+    # How image object num is passed on: (extension, kind, Samples without
+    # data or None), kind 'encoded' for the stream as it stands, 'png' for a
+    # PNG container around it, 'samples'. None if it needs pdfimages.
+    def image_format(self, num):
+        header = self.objects[num][0]
+        get = lambda key, default=None: self.value(header.get(key, default))
+        filters = get('Filter')
+        filters = [self.value(f) for f in (filters if isinstance(filters, list) else [filters] if filters else [])]
+        params = get('DecodeParms') or {}
+        if isinstance(params, list):
+            params = self.value(params[0]) if len(params) == 1 else {}
+
+        if filters == ['DCTDecode']:
+            return '.jpg', 'encoded', None
+        if filters == ['JPXDecode']:
+            return '.jp2', 'encoded', None
+        if filters not in ([], ['FlateDecode']):
+            return None
+
+        width, height = get('Width'), get('Height')
+        if get('ImageMask'):
+            colors, bpc = 1, 1
+        else:
+            colors, bpc = self.colors(get('ColorSpace')), get('BitsPerComponent', 8)
+        if colors is None or bpc not in (1, 8) or (bpc == 1 and colors != 1):
+            return None
+        # gray and stencil masks alike: sample 0 is black unless /Decode [1 0]
+        decode = get('Decode')
+        invert = bool(decode) and self.value(decode[0]) == 1
+        samples = Samples(None, bool(filters), width, height, bpc, colors, invert)
+
+        predictor = self.value(params.get('Predictor', 1))
+        if filters and predictor >= 10 and not invert and colors in (1, 3) \
+                and self.value(params.get('Colors', 1)) == colors \
+                and self.value(params.get('BitsPerComponent', 8)) == bpc \
+                and self.value(params.get('Columns', 1)) == width:
+            return '.png', 'png', samples
+        if predictor != 1:
+            return None
+        return '.png', 'samples', samples
+
+    def image_page(self, num, name):
+        ext, kind, samples = self.image_format(num)
+        body = self.raw_stream(num)
+        if kind == 'png':
+            return Page(name + ext, 'encoded', png_container(body, samples.width, samples.height,
+                                                             samples.bpc, samples.colors))
+        elif kind == 'samples':
+            return Page(name + ext, kind, samples._replace(data=body))
+        return Page(name + ext, kind, body)
+
+def png_chunk(kind, body):
+    return struct.pack('>I', len(body)) + kind + body + struct.pack('>I', zlib.crc32(kind + body))
+
+# A Flate stream with PNG predictors is a PNG's IDAT data as it stands.
+def png_container(idat, width, height, bpc, colors):
+    ihdr = struct.pack('>IIBBBBB', width, height, bpc, 0 if colors == 1 else 2, 0, 0, 0)
+    return b'\x89PNG\r\n\x1a\n' + png_chunk(b'IHDR', ihdr) + png_chunk(b'IDAT', idat) + png_chunk(b'IEND', b'')
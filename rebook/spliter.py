@@ -1,7 +1,56 @@
 import cv2
 import numpy as np
 
-def book_spliter(image, segment, f_points):
+# Segmentation input size. The frame is reduced to this once and the book
+# contour lifted back to full resolution, instead of handing the model the
+# full frame (ultralytics resizes internally anyway, after copying it into
+# the results).
+SEGMENT_SIZE = 640
+
+def reduce_frame(frame, size=SEGMENT_SIZE):
+    """Frame with long side at most size, and the x and y factors back."""
+    h, w = frame.shape[:2]
+    scale = min(1.0, size / max(h, w))
+    if scale == 1.0:
+        return frame, 1.0, 1.0
+    small = cv2.resize(frame, (max(1, int(round(w * scale))), max(1, int(round(h * scale)))),
+                       interpolation=cv2.INTER_AREA)
+    return small, w / small.shape[1], h / small.shape[0]
+
+def yolo_polygons(results):
+    """(label, (N, 2) polygon) per detection in ultralytics results."""
+    for r in results:
+        for c in r:
+            yield c.names[c.boxes.cls.tolist().pop()], c.masks.xy.pop()
+
+def largest_book(polygons, scale_x=1.0, scale_y=1.0):
+    """Largest 'book' polygon as an int32 (N, 1, 2) contour, scaled by
+    (scale_x, scale_y); None if there is no book."""
+    max_area = 0
+    largest_contour = None
+    for label, xy in polygons:
+        if label != 'book' or len(xy) == 0: continue
+        contour = (xy * (scale_x, scale_y)).astype(np.int32).reshape(-1, 1, 2)
+        area = cv2.contourArea(contour)
+        if area > max_area:
+            max_area = area
+            largest_contour = contour
+
+    return largest_contour
+
+def book_contour(results, scale_x=1.0, scale_y=1.0):
+    """Largest 'book' mask polygon in YOLO results (see largest_book)."""
+    return largest_book(yolo_polygons(results), scale_x, scale_y)
+
+def segment_book(model, frame, size=SEGMENT_SIZE):
+    """Book contour in frame coordinates, from the model run on a reduced
+    copy. model: ultralytics YOLO or segment.OnnxSegmenter (segment.load_model)."""
+    small, scale_x, scale_y = reduce_frame(frame, size)
+    if hasattr(model, 'polygons'):
+        return largest_book(model.polygons(small, size), scale_x, scale_y)
+    return book_contour(model(small, imgsz=size), scale_x, scale_y)
+
+def book_spliter(image, contour, f_points):
     """
     Splits the given image of a book into left and right pages based on segment.
 
@@ -9,8 +58,8 @@ def book_spliter(image, segment, f_points):
     ----------
     image : np.ndarray
         The input image of the book, where splitting needs to be performed.
-    segment : YOLO output
-        The segmentation data used to find the split area of the book.
+    contour : np.ndarray
+        Outline of the book in image coordinates (see segment_book).
     f_points : np.ndarray, np.array([[100, 200], [150, 250], ...])
         Feature points that provide finger markers.
 
@@ -29,52 +78,50 @@ def book_spliter(image, segment, f_points):
     f_points_r : np.ndarray
         Landmarks of the right hand.
     """
-    max_area = 0
-    largest_contour = None
-    img_mask_shrinked = None
-    for r in segment:
-        img = np.copy(r.orig_img)
-
-        for ci, c in enumerate(r):
-            label = c.names[c.boxes.cls.tolist().pop()]
-            if label != 'book': continue
-            contour = c.masks.xy.pop().astype(np.int32).reshape(-1, 1, 2)
-            area = cv2.contourArea(contour)
-            if area > max_area:
-                max_area = area
-                largest_contour = contour
-        
-        if largest_contour is not None:
-            mask_orignal = np.zeros(img.shape[:2], np.uint8)
-            cv2.drawContours(mask_orignal, [largest_contour], -1, (255, 255, 255), cv2.FILLED)
-            cv2.drawContours(mask_orignal, [largest_contour], -1, (0, 0, 0), thickness=50)
-            
-            contour_shrinked, center_point = shrink_contour(largest_contour, scale=0.7)
-            
-            mask_shrinked = cv2.drawContours(np.zeros(img.shape[:2], np.uint8), [contour_shrinked], -1, (255, 255, 255), cv2.FILLED)
-            
-            img_mask_shrinked = img.copy()
-            img_mask_shrinked[mask_shrinked == 0] = (255, 255, 255)
-    
-    if img_mask_shrinked is None:
+    if contour is None:
         return None
-    gray = cv2.cvtColor(img_mask_shrinked, cv2.COLOR_BGR2GRAY)
+
+    # book mask, only over the contour's bounding box
+    mask_x0, mask_y0, mask_w, mask_h = cv2.boundingRect(contour)
+    mask_x1 = min(mask_x0 + mask_w, image.shape[1])
+    mask_y1 = min(mask_y0 + mask_h, image.shape[0])
+    mask_x0, mask_y0 = max(mask_x0, 0), max(mask_y0, 0)
+    mask_offset = (mask_x0, mask_y0)
+    mask_orignal = np.zeros((max(mask_y1 - mask_y0, 0), max(mask_x1 - mask_x0, 0)), np.uint8)
+    cv2.drawContours(mask_orignal, [contour], -1, (255, 255, 255), cv2.FILLED, offset=(-mask_x0, -mask_y0))
+    cv2.drawContours(mask_orignal, [contour], -1, (0, 0, 0), thickness=50, offset=(-mask_x0, -mask_y0))
+
+    contour_shrinked, center_point = shrink_contour(contour, scale=0.7)
+
+    # Everything outside the shrunk contour is white, so the thresholded page
+    # only needs computing inside its bounding box.
+    roi_x0, roi_y0, roi_w, roi_h = cv2.boundingRect(contour_shrinked)
+    roi_x1 = min(roi_x0 + roi_w, image.shape[1])
+    roi_y1 = min(roi_y0 + roi_h, image.shape[0])
+    roi_x0, roi_y0 = max(roi_x0, 0), max(roi_y0, 0)
+    roi = image[roi_y0:roi_y1, roi_x0:roi_x1]
+
+    mask_shrinked = cv2.drawContours(np.zeros(roi.shape[:2], np.uint8), [contour_shrinked], -1,
+                                     (255, 255, 255), cv2.FILLED, offset=(-roi_x0, -roi_y0))
+    gray = cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY)
+    gray[mask_shrinked == 0] = 255
     _, binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
 
     x, y, w, h = cv2.boundingRect(cv2.bitwise_not(binary))
+    if w > 0 and h > 0:
+        x, y = x + roi_x0, y + roi_y0
 
     length_diagonal = (w**2 + h**2)**0.5 / 2
     x0 = int(x + w/2 - length_diagonal)
     y0 = int(y + h/2 - length_diagonal)
     w = int(2*length_diagonal)
     h = int(2*length_diagonal)
-    if x0 >=0 and y0 >=0 and (x0+w) <= binary.shape[1] and (y0+h) <=binary.shape[0]:
-        binary_squarified = binary[y0:y0+h, x0:x0+w]
-    else:
-        binary_squarified = np.full((h, w), 255, dtype=binary.dtype)
-        valid_area = (max(x0,0), min(x0+w,binary.shape[1]), max(y0,0), min(y0+h,binary.shape[0]))
-        binary_squarified[valid_area[2]-y0:valid_area[3]-y0,valid_area[0]-x0:valid_area[1]-x0] = \
-            binary[max(y0,0):min(y0+h,binary.shape[0]), max(x0,0):min(x0+w,binary.shape[1])]
+    binary_squarified = np.full((h, w), 255, dtype=binary.dtype)
+    sx0, sx1 = max(x0, roi_x0), min(x0 + w, roi_x1)
+    sy0, sy1 = max(y0, roi_y0), min(y0 + h, roi_y1)
+    if sx0 < sx1 and sy0 < sy1:
+        binary_squarified[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = \
+            binary[sy0 - roi_y0:sy1 - roi_y0, sx0 - roi_x0:sx1 - roi_x0]
 
     x_c = image.shape[1]/2 - x0
     y_c = image.shape[0]/2 - y0
@@ -170,8 +217,8 @@ def book_spliter(image, segment, f_points):
         x8 = xx - (yy - y8)/k0
         angle = -angle
 
-    book_left, x_c_l, y_c_l, f_points_l = split_lr(image, mask_orignal, [x7, y7, x8, y8], angle, 'LEFT', f_points)
-    book_right, x_c_r, y_c_r, f_points_r = split_lr(image, mask_orignal, [x7, y7, x8, y8], angle, 'RIGHT', f_points)
+    book_left, x_c_l, y_c_l, f_points_l = split_lr(image, mask_orignal, [x7, y7, x8, y8], angle, 'LEFT', f_points, mask_offset)
+    book_right, x_c_r, y_c_r, f_points_r = split_lr(image, mask_orignal, [x7, y7, x8, y8], angle, 'RIGHT', f_points, mask_offset)
 
     ctr_l = np.array((x_c_l, y_c_l))
     ctr_r = np.array((x_c_r, y_c_r))
@@ -219,7 +266,14 @@ def shrink_contour(contour, scale=0.8):
     
     return np.array(shrink_contour, dtype=np.int32), (cx, cy)
 
-def safe_rotate(image, angle):
+def safe_rotate(image, angle, mask=None):
+    """Rotate image by angle (degrees, counter-clockwise) about its centre.
+
+    The output is cut to the rotated content plus 5 pixels: the nonzero
+    pixels of mask (default: the whole image), whose bounds follow from the
+    corners of its outline, so there is one warpAffine straight into the
+    tight output. Returns it with the position of the centre in it.
+    """
     im_h, im_w = image.shape[:2]
     angle_rad = np.deg2rad(angle)
 
@@ -228,36 +282,22 @@ def safe_rotate(image, angle):
 
     pad_h = int(np.ceil((im_h_new - im_h) / 2))
     pad_w = int(np.ceil((im_w_new - im_w) / 2))
-    pads = ((pad_h, pad_h), (pad_w, pad_w)) + ((0, 0),) * (len(image.shape) - 2)
+    padded_h, padded_w = im_h + 2 * pad_h, im_w + 2 * pad_w
 
-    padded = np.pad(image, pads, 'constant', constant_values=0)
-    padded_h, padded_w = padded.shape[:2]
+    # rotation about the centre of the image padded to the rotated size
     matrix = cv2.getRotationMatrix2D((padded_w / 2, padded_h / 2), angle, 1)
-    result = cv2.warpAffine(padded, matrix, (padded_w, padded_h),
-                            borderMode=cv2.BORDER_CONSTANT,
-                            borderValue=0)
-    
-    gray = cv2.cvtColor(result, cv2.COLOR_BGR2GRAY)
-    _, binary = cv2.threshold(gray, 127, 255, cv2.THRESH_BINARY)
-    colsums = np.sum(binary, axis=0)
-    for idx, col in enumerate(colsums):
-        if col != 0:
-            first_col = idx
-            break
-    for idx, col in enumerate(reversed(colsums)):
-        if col != 0:
-            last_col = len(colsums) - 1 - idx
-            break
-
-    rowsums = np.sum(binary, axis=1)
-    for idx, col in enumerate(rowsums):
-        if col != 0:
-            first_row = idx
-            break
-    for idx, col in enumerate(reversed(rowsums)):
-        if col != 0:
-            last_row = len(rowsums) - 1 - idx
-            break
+    matrix[:, 2] += matrix[:, :2].dot((pad_w, pad_h))
+
+    outline = []
+    if mask is not None:
+        outline, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if len(outline) > 0:
+        points = np.concatenate(outline).reshape(-1, 2)
+    else:
+        points = np.array([[0, 0], [im_w - 1, 0], [im_w - 1, im_h - 1], [0, im_h - 1]])
+    corners = points.dot(matrix[:, :2].T) + matrix[:, 2]
+    (first_col, first_row), (last_col, last_row) = \
+        np.floor(corners.min(axis=0)).astype(int), np.floor(corners.max(axis=0)).astype(int)
 
     pad = 5
     first_col = max(first_col-pad, 0)
@@ -265,28 +305,36 @@ def safe_rotate(image, angle):
     first_row = max(first_row-pad, 0)
     last_row  = min(last_row+pad, padded_h)
 
-    return result[first_row:last_row,first_col:last_col], padded_w/2-first_col, padded_h/2-first_row
+    matrix[:, 2] -= (first_col, first_row)
+    result = cv2.warpAffine(image, matrix, (last_col - first_col, last_row - first_row),
+                            borderMode=cv2.BORDER_CONSTANT,
+                            borderValue=0)
+
+    return result, padded_w/2-first_col, padded_h/2-first_row
 
-def split_lr(image, mask, split_points, angle, lr, f_points):
+# mask: book mask covering image[mask_offset[1]:, mask_offset[0]:]. Only the
+# page's bounding box of image is read.
+def split_lr(image, mask, split_points, angle, lr, f_points, mask_offset=(0, 0)):
     x1, y1, x2, y2 = split_points
-    cropped = image.copy()
+    mask_x0, mask_y0 = mask_offset
     d_mask = mask.copy()
-    h, w, _ = cropped.shape
 
     if lr == 'LEFT':
         s_points = np.array([[x1, y1], [image.shape[1], 0], [image.shape[1], image.shape[0]], [x2, y2]], dtype=np.int32)
     elif lr == 'RIGHT':
         s_points = np.array([[0, 0], [x1, y1], [x2, y2], [0, image.shape[0]]], dtype=np.int32)
-    cv2.fillPoly(d_mask, [s_points], color=(0, 0, 0))
-
-    cropped[d_mask == 0] = (0, 0, 0)
+    cv2.fillPoly(d_mask, [s_points], color=(0, 0, 0), offset=(-mask_x0, -mask_y0))
 
     x, y, w, h = cv2.boundingRect(d_mask)
-    cropped = cropped[y:y+h, x:x+w]
+    page_mask = d_mask[y:y+h, x:x+w]
+    x, y = x + mask_x0, y + mask_y0
+    page = image[y:y+h, x:x+w]
+    cropped = cv2.bitwise_and(page, page, mask=page_mask)
+
     x_c = image.shape[1]/2 - (x + w/2)
     y_c = image.shape[0]/2 - (y + h/2)
 
-    rotated, x_0, y_0 = safe_rotate(cropped, -angle)
+    rotated, x_0, y_0 = safe_rotate(cropped, -angle, page_mask)
     x_c, y_c = rotate_point(x_c, y_c, (0, 0), -angle)
     x_c += x_0
     y_c += y_0
@@ -0,0 +1,192 @@
+from __future__ import division, print_function
+
+import json
+import numpy as np
+import sys
+import time
+
+from numpy.linalg import norm
+
+# Optimizer telemetry for Kim2014. While `current` is set every least_squares
+# run records one row per iteration (= Jacobian evaluation); run_retry writes
+# one JSON line per page with all restarts.
+current = None
+
+COLUMNS = ['t', 'cost', 'step', 'nfev', 'njev', 't_project', 't_jac', 't_residuals']
+TIMERS = ['project', 'jac', 'residuals']
+
+class OptTrace(object):
+    def __init__(self, path=None, name=''):
+        self.path = path
+        self.name = name
+        self.restarts = []
+        self.run = None
+        self.stack = []
+
+    def start(self, x_scale=None):
+        self.run = {
+            'rows': [],
+            'nfev': 0,
+            'njev': 0,
+        }
+        self.x_scale = x_scale
+        self.times = dict((key, 0.0) for key in TIMERS)
+        self.t_start = time.time()
+        self.last_x = None
+        self.last_cost = np.nan
+        self.last_jac_x = None
+
+    # exclusive timing: time spent in a nested call is charged to the inner key
+    def call(self, key, func, *args):
+        self.stack.append(0.0)
+        ts = time.time()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.time() - ts
+            nested = self.stack.pop()
+            if self.run is not None:
+                self.times[key] += elapsed - nested
+            if self.stack:
+                self.stack[-1] += elapsed
+
+    def evaluated(self, x, residuals):
+        self.run['nfev'] += 1
+        self.last_x = np.array(x)
+        self.last_cost = 0.5 * np.dot(residuals, residuals)
+
+    # least_squares (trf) evaluates the Jacobian once per accepted iterate.
+    def iteration(self, x):
+        self.run['njev'] += 1
+        x = np.array(x)
+        cost = self.last_cost if self.last_x is not None and np.array_equal(x, self.last_x) else np.nan
+        if self.last_jac_x is None:
+            step = 0.0
+        else:
+            delta = x - self.last_jac_x
+            step = norm(delta / self.x_scale if self.x_scale is not None else delta)
+        self.last_jac_x = x
+
+        self.run['rows'].append([
+            time.time() - self.t_start, cost, step, self.run['nfev'], self.run['njev'],
+            self.times['project'], self.times['jac'], self.times['residuals'],
+        ])
+
+    def finish(self, result, final_norm):
+        run = self.run
+        run['time'] = time.time() - self.t_start
+        run['final_norm'] = final_norm
+        run['cost'] = float(result.cost)
+        run['status'] = int(result.status)
+        run['nfev'] = int(result.nfev)
+        run['njev'] = int(result.njev) if result.njev is not None else run['njev']
+        run['times'] = dict(self.times)
+        self.restarts.append(run)
+        self.run = None
+
+    # one record per page; `best` is the restart that was kept
+    def write(self, page, best):
+        record = {
+            'name': self.name,
+            'page': page,
+            'columns': COLUMNS,
+            'best': best,
+            'restarts': [compact(run) for run in self.restarts],
+        }
+        self.restarts = []
+        if self.path is None: return record
+
+        with open(self.path, 'a') as out:
+            out.write(json.dumps(record) + '\n')
+        return record
+
+def compact(run):
+    result = dict(run)
+    result['rows'] = [[float('{:.6g}'.format(v)) if np.isfinite(v) else None for v in row]
+                      for row in run['rows']]
+    result['times'] = dict((k, round(v, 6)) for k, v in run['times'].items())
+    return result
+
+def call(key, func, *args):
+    if current is None:
+        return func(*args)
+    return current.call(key, func, *args)
+
+def load(paths):
+    records = []
+    for path in paths:
+        with open(path) as trace_file:
+            records.extend(json.loads(line) for line in trace_file if line.strip())
+    return records
+
+def summarize(records):
+    page_times = np.array([sum(run['time'] for run in r['restarts']) for r in records])
+    restart_times = np.array([run['time'] for r in records for run in r['restarts']])
+    n_restarts = np.array([len(r['restarts']) for r in records])
+    totals = dict((key, sum(run['times'][key] for r in records for run in r['restarts']))
+                  for key in TIMERS)
+    total = restart_times.sum()
+
+    print('pages: {}  restarts: {}  (mean {:.2f}/page)'.format(
+        len(records), len(restart_times), n_restarts.mean() if len(records) else 0))
+    for label, times in [('per page', page_times), ('per restart', restart_times)]:
+        if len(times) == 0: continue
+        print('time to converge {:>12}: median {:.2f}s  p90 {:.2f}s  max {:.2f}s'.format(
+            label, np.median(times), np.percentile(times, 90), times.max()))
+    for key in TIMERS:
+        print('  {:<10} {:8.2f}s  {:5.1f}%'.format(key, totals[key], 100 * totals[key] / max(total, 1e-9)))
+    other = total - sum(totals.values())
+    print('  {:<10} {:8.2f}s  {:5.1f}%'.format('other', other, 100 * other / max(total, 1e-9)))
+
+    return page_times, restart_times, totals, other
+
+def report(paths, out_path):
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    records = load(paths)
+    page_times, restart_times, totals, other = summarize(records)
+
+    fig, axes = plt.subplots(2, 2, figsize=(12, 9))
+    ax = axes[0, 0]
+    ax.hist([page_times, restart_times], bins=30, label=['per page', 'per restart'])
+    ax.set_xlabel('time to converge (s)')
+    ax.set_ylabel('count')
+    ax.legend()
+
+    ax = axes[0, 1]
+    labels = TIMERS + ['other']
+    ax.bar(labels, [totals[key] for key in TIMERS] + [other])
+    ax.set_ylabel('total time (s)')
+    ax.set_title('optimizer time split')
+
+    ax = axes[1, 0]
+    for r in records:
+        for i, run in enumerate(r['restarts']):
+            rows = np.array([[np.nan if v is None else v for v in row] for row in run['rows']])
+            if len(rows) == 0: continue
+            ax.semilogy(rows[:, 0], rows[:, 1], alpha=0.6 if i == r['best'] else 0.2,
+                        color='C0' if i == r['best'] else 'C3')
+    ax.set_xlabel('time (s)')
+    ax.set_ylabel('cost')
+    ax.set_title('cost per iteration (blue: kept restart)')
+
+    ax = axes[1, 1]
+    n_iters = [len(run['rows']) for r in records for run in r['restarts']]
+    ax.scatter(n_iters, restart_times, s=8)
+    ax.set_xlabel('iterations')
+    ax.set_ylabel('time (s)')
+
+    fig.tight_layout()
+    fig.savefig(out_path)
+    print('wrote', out_path)
+
+def go(argv):
+    if len(argv) < 3:
+        print('usage: python -m rebook.telemetry report.png trace.jsonl [...]')
+        return
+    report(argv[2:], argv[1])
+
+if __name__ == '__main__':
+    go(sys.argv)
@@ -3,6 +3,8 @@ import numpy
 from distutils.core import setup
 from Cython.Build import cythonize
 
+# The .pyx files are still Python 2 syntax (print statements). collate.pyx is
+# only used by crop.py; dewarp collates with algorithm.collate_lines.
 modules = cythonize(["inpaint.pyx", "newton.pyx", "collate.pyx", "feature_sign.pyx"], language_level = "2")
 for e in modules:
     e.include_dirs.append(numpy.get_include())
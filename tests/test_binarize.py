@@ -0,0 +1,58 @@
+"""Strip-streamed local thresholds (lib.mean_std_rows): exact window
+statistics, so the output does not depend on strip height or threads."""
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from rebook import binarize, lib
+
+BOOK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'book')
+
+def exact_mean_std(im, W):
+    """Whole-image reference with int64 window sums."""
+    s, N = W // 2, W * W
+    padded = np.pad(im.astype(np.int64), (s, W - 1 - s), 'reflect')
+    sums = []
+    for x in (padded, padded * padded):
+        I = np.zeros((x.shape[0] + 1, x.shape[1] + 1), np.int64)
+        I[1:, 1:] = x.cumsum(0).cumsum(1)
+        sums.append(I[W:, W:] - I[W:, :-W] - I[:-W, W:] + I[:-W, :-W])
+    means = sums[0] / N
+    return means, np.sqrt((sums[1] / N - means * means).clip(0, None))
+
+@pytest.fixture
+def page():
+    im = cv2.imread(os.path.join(BOOK, '1.jpg'))
+    if im is None:
+        pytest.skip('no 1.jpg in book/')
+    return binarize.grayscale(im)
+
+@pytest.mark.parametrize('shape, W', [((300, 257), 61), ((40, 25), 61), ((90, 120), 8)])
+def test_mean_std_exact(shape, W):
+    im = np.random.RandomState(0).randint(0, 256, shape).astype(np.uint8)
+    means, stds = lib._mean_std(im, W)
+    exact_means, exact_stds = exact_mean_std(im, W)
+    assert np.array_equal(means, exact_means)
+    assert np.array_equal(stds, exact_stds)
+
+def test_mean_std_exact_large():
+    # float32 integrals are off by tenths here; the strip sums must not be
+    im = np.full((3000, 4000), 255, np.uint8)
+    im[::2, ::3] = 0
+    means, stds = lib.mean_std_rows(im, 61, 2900, 3000)
+    exact_means, exact_stds = exact_mean_std(im, 61)
+    assert np.array_equal(means, exact_means[2900:])
+    assert np.array_equal(stds, exact_stds[2900:])
+
+@pytest.mark.parametrize('algorithm', ['niblack', 'sauvola', 'sauvola_noisy'])
+def test_strip_and_thread_invariance(monkeypatch, page, algorithm):
+    fn = binarize.ALGORITHMS[algorithm]
+    monkeypatch.setattr(lib, 'THREADS', 1)
+    monkeypatch.setattr(lib, 'STRIP_ROWS', page.shape[0])
+    whole = fn(page)
+    for rows, threads in [(64, 1), (64, 4), (7, 3), (1000, 2)]:
+        monkeypatch.setattr(lib, 'STRIP_ROWS', rows)
+        monkeypatch.setattr(lib, 'THREADS', threads)
+        assert np.array_equal(fn(page), whole), (rows, threads)
@@ -0,0 +1,42 @@
+"""Dewarping the sample pages in book/ end to end."""
+import os
+
+import cv2
+import numpy as np
+import pytest
+
+from rebook import analysis, dewarp
+
+BOOK = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'book')
+
+def read_page(name):
+    im = cv2.imread(os.path.join(BOOK, name))
+    if im is None:
+        pytest.skip('no {} in book/'.format(name))
+    return im
+
+def test_scaled_analysis_flipped_lines():
+    # the analysis lines of book/2 map upside down through the fine mesh;
+    # the incremental fine pass has to drop them, not crash
+    out = dewarp.go_dewarp(read_page('2.jpg'), None, analysis_scale=0.5)
+    assert out and out[0][0].size > 0
+
+def mesh_grid(model, shape, n=9):
+    """The model's meshes sampled on an n x n grid, (pages, n, n, 2)."""
+    return np.stack([cv2.resize(mesh.astype(np.float32), (n, n), interpolation=cv2.INTER_AREA)
+                     for mesh in model.meshes(shape=shape)])
+
+@pytest.mark.parametrize('name', ['1.jpg', '2.jpg'])
+def test_scaled_analysis_close_to_full(name):
+    # A surface estimated at half resolution, or the full-resolution one it
+    # falls back to, must put every mesh point within 1% of the image width
+    # of the full-resolution mesh.
+    im = read_page(name)
+    with analysis.session():
+        _, full = dewarp.kim2014(im, split=False, return_model=True)
+    with analysis.session():
+        _, scaled = dewarp.kim2014(im, split=False, return_model=True, analysis_scale=0.5)
+    assert len(scaled) == len(full)
+    for s, f in zip(scaled, full):
+        distance = np.linalg.norm(mesh_grid(s, im.shape) - mesh_grid(f, im.shape), axis=-1)
+        assert distance.max() <= 0.01 * im.shape[1]
@@ -0,0 +1,80 @@
+"""OnnxSegmenter post-processing against a stub onnxruntime session, so
+no model file or onnxruntime is needed."""
+import numpy as np
+import pytest
+
+from rebook import segment
+
+N_CLASSES = 80
+
+# (xyxy box in network input coordinates, class, score)
+DETECTIONS = [
+    ((100, 160, 500, 400), segment.COCO_BOOK, 0.9),
+    ((104, 164, 496, 404), segment.COCO_BOOK, 0.8),  # duplicate, NMS drops it
+    ((20, 100, 60, 140), 0, 0.6),
+    ((0, 100, 12, 112), 0, 0.1),  # under CONF
+]
+
+class Input(object):
+    name = 'images'
+
+class StubSession(object):
+    """Output of a YOLO-seg export with one mask prototype that is 1
+    everywhere, so each mask is its box."""
+    def run(self, outputs, feeds):
+        self.blob = blob = feeds[Input.name]
+        h, w = blob.shape[2:]
+        output = np.zeros((1, 4 + N_CLASSES + 1, len(DETECTIONS)), np.float32)
+        for i, ((x1, y1, x2, y2), cls, score) in enumerate(DETECTIONS):
+            output[0, :4, i] = ((x1 + x2) / 2, (y1 + y2) / 2, x2 - x1, y2 - y1)
+            output[0, 4 + cls, i] = score
+            output[0, -1, i] = 1.0
+        protos = np.ones((1, 1, h // 4, w // 4), np.float32)
+        return output, protos
+
+def stub_segmenter(shape):
+    model = segment.OnnxSegmenter.__new__(segment.OnnxSegmenter)
+    model.session, model.input = StubSession(), Input()
+    model.names, model.shape = {0: 'person', segment.COCO_BOOK: 'book'}, shape
+    return model
+
+def test_letterbox_fixed_shape():
+    im = np.zeros((600, 800, 3), np.uint8)
+    padded, gain, pad = segment.letterbox(im, (640, 640))
+    assert padded.shape == (640, 640, 3)
+    assert gain == pytest.approx(0.8)
+    assert pad == (0, 80)
+    assert (padded[:80] == segment.PAD_VALUE).all()
+    assert (padded[80:560] == 0).all()
+
+def test_letterbox_auto_pads_to_stride():
+    im = np.zeros((500, 800, 3), np.uint8)
+    padded, gain, pad = segment.letterbox(im, (640, 640), auto=True)
+    assert padded.shape[:2] == (416, 640)  # 400 rounded up to 32
+    assert pad == (0, 8)
+
+def test_nms_class_aware():
+    boxes = np.array([[0, 0, 10, 10], [1, 1, 10, 10], [0, 0, 10, 10]], np.float32)
+    scores = np.array([0.5, 0.9, 0.7], np.float32)
+    classes = np.array([0, 0, 1])
+    assert segment.nms(boxes, scores, classes).tolist() == [1, 2]
+    assert segment.nms(boxes[:0], scores[:0], classes[:0]).tolist() == []
+
+@pytest.mark.parametrize('shape, blob_shape', [((640, 640), (1, 3, 640, 640)),
+                                               (None, (1, 3, 480, 640))])
+def test_polygons(shape, blob_shape):
+    model = stub_segmenter(shape)
+    frame = np.zeros((600, 800, 3), np.uint8)
+    polygons = model.polygons(frame)
+    assert model.session.blob.shape == blob_shape
+
+    # low-confidence and suppressed detections gone, by descending score
+    assert [label for label, _ in polygons] == ['book', 'person']
+    gain, top = 0.8, 80 if shape else 0
+    for (label, polygon), (box, _, _) in zip(polygons, DETECTIONS[::2]):
+        assert polygon.dtype == np.float32
+        expected = (np.array(box, float).reshape(2, 2) - (0, top)) / gain
+        # masks are cut at prototype resolution (4 input pixels)
+        tolerance = 4 / gain
+        assert np.abs(polygon.min(axis=0) - expected[0]).max() <= tolerance
+        assert np.abs(polygon.max(axis=0) - expected[1]).max() <= tolerance